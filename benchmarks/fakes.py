@@ -0,0 +1,339 @@
+import random
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from queue import Queue
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from socomote.metrics import METRICS
+from socomote.mp3 import mp3_duration
+from socomote.tts_engines import SpeechEngine
+
+# One MPEG 1 layer III frame at 128kbps, 44.1kHz, without padding
+_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+_FRAME_SECONDS = 1152 / 44100
+
+
+def fake_mp3(seconds: float) -> bytes:
+    """
+    Return silent MP3 data lasting the given number of seconds.
+    """
+    return _FRAME * max(1, round(seconds / _FRAME_SECONDS))
+
+
+class FakeNetworkError(Exception):
+    pass
+
+
+@dataclass
+class Network:
+    """
+    Simulated network between socomote and the speakers: every call takes `latency` plus up to `jitter` seconds, and
+    fails with probability `failure_rate`.
+    """
+    latency: float = 0.02
+    jitter: float = 0.01
+    failure_rate: float = 0.0
+    seed: int = 0
+    calls: int = 0
+    _rng: random.Random = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+
+    def call(self, action: str):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.failure_rate
+        time.sleep(delay)
+        METRICS.speaker_call(action, delay, failed=fail)
+        if fail:
+            raise FakeNetworkError(f"Simulated failure of {action}")
+
+
+class FakeSubscription:
+
+    def __init__(self, service: 'FakeService'):
+        self.service = service
+        self.events = Queue()
+        self.callback = None
+        self.auto_renew_fail = None
+
+    def send(self, variables: dict):
+        event = SimpleNamespace(service=self.service, variables=variables)
+        if self.callback is not None:
+            self.callback(event)
+        else:
+            self.events.put(event)
+
+    def unsubscribe(self):
+        self.service.subscriptions.remove(self)
+
+
+class FakeService:
+
+    def __init__(self, zone: 'FakeZone', service_type: str):
+        self.zone = zone
+        self.service_type = service_type
+        self.subscriptions: List[FakeSubscription] = []
+
+    def subscribe(self, auto_renew=False, **kwargs) -> FakeSubscription:
+        self.zone.network.call("SUBSCRIBE")
+        sub = FakeSubscription(self)
+        self.subscriptions.append(sub)
+        return sub
+
+    def emit(self, variables: dict):
+        for sub in list(self.subscriptions):
+            sub.send(variables)
+
+    def Browse(self, args, **kwargs):
+        self.zone.network.call("Browse")
+        return {'UpdateID': str(self.zone.household.favorites_update_id)}
+
+    def SnapshotGroupVolume(self, args, **kwargs):
+        self.zone.network.call("SnapshotGroupVolume")
+
+    def SetRelativeGroupVolume(self, args, **kwargs):
+        self.zone.network.call("SetRelativeGroupVolume")
+        change = int(dict(args)['Adjustment'])
+        members = next(g for g in self.zone.household.groups() if self.zone in g).members
+        for member in members:
+            member._volume = max(0, min(100, member._volume + change))
+            member.renderingControl.emit({'volume': {'Master': str(member._volume)}})
+        return {'NewVolume': str(round(sum(m._volume for m in members) / len(members)))}
+
+
+class FakeGroup:
+
+    def __init__(self, coordinator: 'FakeZone', members: Set['FakeZone']):
+        self.coordinator = coordinator
+        self.members = members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __contains__(self, zone):
+        return zone in self.members
+
+
+class Household:
+    """
+    Shared state of all fake zones: group topology and favourites.
+    """
+
+    def __init__(self, network: Network, favourites: List[Tuple[str, str]]):
+        self.network = network
+        self.zones: Dict[str, 'FakeZone'] = {}
+        self.coordinators: Dict[str, str] = {}
+        self.favourites = favourites
+        self.favorites_update_id = 1
+        self._lock = threading.Lock()
+
+    def add_zone(self, name: str) -> 'FakeZone':
+        zone = self.zones[name] = FakeZone(name, self)
+        self.coordinators[name] = name
+        return zone
+
+    def groups(self) -> List[FakeGroup]:
+        with self._lock:
+            coordinators = dict(self.coordinators)
+        groups = []
+        for coordinator in set(coordinators.values()):
+            members = {self.zones[n] for n, c in coordinators.items() if c == coordinator}
+            groups.append(FakeGroup(self.zones[coordinator], members))
+        return groups
+
+    def set_coordinator(self, name: str, coordinator: str):
+        with self._lock:
+            self.coordinators[name] = coordinator
+        for zone in self.zones.values():
+            zone.zoneGroupTopology.emit({'zone_group_state': ''})
+
+
+class FakeZone:
+    """
+    Stand-in for soco.SoCo implementing the parts socomote uses, with simulated network latency per call.
+    """
+
+    def __init__(self, name: str, household: Household):
+        self.player_name = name
+        self.uid = f"RINCON_{name.upper().replace(' ', '')}"
+        self.ip_address = f"fake://{name}"
+        self.household = household
+        self.network = household.network
+        self._volume = 20
+        self._mute = False
+        self._uri = ""
+        self._transport_state = "STOPPED"
+        self.plays: List[Tuple[float, str]] = []
+        self.renderingControl = FakeService(self, "RenderingControl")
+        self.groupRenderingControl = FakeService(self, "GroupRenderingControl")
+        self.avTransport = FakeService(self, "AVTransport")
+        self.zoneGroupTopology = FakeService(self, "ZoneGroupTopology")
+        self.contentDirectory = FakeService(self, "ContentDirectory")
+
+    def __repr__(self):
+        return f"FakeZone({self.player_name})"
+
+    # rendering control
+
+    @property
+    def volume(self) -> int:
+        self.network.call("GetVolume")
+        return self._volume
+
+    @volume.setter
+    def volume(self, volume: int):
+        self.network.call("SetVolume")
+        self._volume = max(0, min(100, int(volume)))
+        self.renderingControl.emit({'volume': {'Master': str(self._volume)}})
+
+    def set_relative_volume(self, relative_volume: int) -> int:
+        self.network.call("SetRelativeVolume")
+        self._volume = max(0, min(100, self._volume + int(relative_volume)))
+        self.renderingControl.emit({'volume': {'Master': str(self._volume)}})
+        return self._volume
+
+    @property
+    def mute(self) -> bool:
+        self.network.call("GetMute")
+        return self._mute
+
+    @mute.setter
+    def mute(self, mute: bool):
+        self.network.call("SetMute")
+        self._mute = bool(mute)
+        self.renderingControl.emit({'mute': {'Master': '1' if self._mute else '0'}})
+
+    # transport
+
+    def _set_transport(self, state: str, uri: Optional[str] = None):
+        self._transport_state = state
+        variables = {'transport_state': state}
+        if uri is not None:
+            self._uri = uri
+            variables['av_transport_uri'] = uri
+        self.avTransport.emit(variables)
+
+    def play_uri(self, uri="", meta="", title="", start=True, force_radio=False, **kwargs):
+        self.network.call("SetAVTransportURI")
+        self.plays.append((time.monotonic(), title))
+        self._set_transport("TRANSITIONING", uri)
+        if uri.startswith("http"):
+            # fetch the announcement like a real speaker would, then stop when it has finished
+            threading.Thread(target=self._play_announcement, args=(uri,), daemon=True).start()
+        else:
+            self._set_transport("PLAYING")
+
+    def _play_announcement(self, uri: str):
+        try:
+            data = urllib.request.urlopen(uri, timeout=10).read()
+        except Exception:
+            self._set_transport("STOPPED")
+            return
+        if self._uri != uri:
+            return
+        self._set_transport("PLAYING")
+        time.sleep(mp3_duration(data))
+        if self._uri == uri:
+            self._set_transport("STOPPED")
+
+    def play(self):
+        self.network.call("Play")
+        self._set_transport("PLAYING")
+
+    def pause(self):
+        self.network.call("Pause")
+        self._set_transport("PAUSED_PLAYBACK")
+
+    def next(self):
+        self.network.call("Next")
+
+    def previous(self):
+        self.network.call("Previous")
+
+    def get_current_transport_info(self) -> dict:
+        self.network.call("GetTransportInfo")
+        return {'current_transport_state': self._transport_state}
+
+    def get_current_media_info(self) -> dict:
+        self.network.call("GetMediaInfo")
+        return {'uri': self._uri, 'channel': ''}
+
+    # grouping
+
+    def join(self, master: 'FakeZone', **kwargs):
+        self.network.call("SetAVTransportURI")
+        self.household.set_coordinator(self.player_name, master.player_name)
+
+    def unjoin(self, **kwargs):
+        self.network.call("BecomeCoordinatorOfStandaloneGroup")
+        self.household.set_coordinator(self.player_name, self.player_name)
+
+    @property
+    def all_groups(self) -> Set[FakeGroup]:
+        return set(self.household.groups())
+
+    @property
+    def all_zones(self) -> Set['FakeZone']:
+        return set(self.household.zones.values())
+
+    @property
+    def group(self) -> FakeGroup:
+        self.network.call("GetZoneGroupState")
+        return next(g for g in self.household.groups() if self in g)
+
+
+class FakeFavourite:
+
+    def __init__(self, title: str, uri: str):
+        self.title = title
+        self._uri = uri
+
+    def get_uri(self) -> str:
+        return self._uri
+
+
+class FakeMusicLibrary:
+    """
+    Stand-in for soco.music_library.MusicLibrary serving the household's favourites.
+    """
+
+    def __init__(self, zone: Optional[FakeZone] = None):
+        self.soco = zone
+        self.contentDirectory = zone.contentDirectory
+
+    def get_sonos_favorites(self, *args, **kwargs) -> List[FakeFavourite]:
+        self.soco.network.call("Browse")
+        return [FakeFavourite(title, uri) for title, uri in self.soco.household.favourites]
+
+
+class FakeSpeechEngine(SpeechEngine):
+    """
+    Local stand-in for a speech engine, streaming silent clips whose length depends on the text. The first audio
+    arrives after a simulated delay, and the rest is produced at `realtime` times playback speed.
+    """
+    name = "fake"
+
+    def __init__(self, latency: float = 0.2, seconds_per_char: float = 0.02, realtime: float = 10.0, workers: int = 4):
+        super().__init__(voice="fake", language="en-GB", workers=workers)
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.realtime = realtime
+        self.requests = 0
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        self.requests += 1
+        time.sleep(self.latency)
+        data = fake_mp3(0.2 + len(text) * self.seconds_per_char)
+        frames_per_chunk = 16
+        chunk = len(_FRAME) * frames_per_chunk
+        for offset in range(0, len(data), chunk):
+            if offset:
+                time.sleep(frames_per_chunk * _FRAME_SECONDS / self.realtime)
+            yield data[offset:offset + chunk]
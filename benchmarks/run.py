@@ -0,0 +1,318 @@
+"""
+Benchmarks socomote against simulated zones, without any real speakers or network access.
+
+    python -m benchmarks.run --output results.json [--compare previous.json]
+"""
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument("--zones", type=int, default=8, help="Number of simulated zones.")
+parser.add_argument("--stations", type=int, default=30, help="Number of simulated favourite stations.")
+parser.add_argument("--latency", type=float, default=0.02, help="Simulated latency of each speaker call, in seconds.")
+parser.add_argument("--jitter", type=float, default=0.01, help="Maximum random extra latency per call, in seconds.")
+parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability of each speaker call failing.")
+parser.add_argument("--tts-latency", type=float, default=0.2, help="Simulated speech synthesis latency, in seconds.")
+parser.add_argument("--seed", type=int, default=0, help="Random seed for the simulated network.")
+parser.add_argument("--output", "-o", help="File to write the results to as JSON.")
+parser.add_argument("--compare", "-c", help="Previous results file to compare against.")
+
+
+def setup_home(zone_names: List[str]) -> Path:
+    """
+    Create a throwaway SOCOMOTE_HOME describing the simulated zones. Must run before socomote.config is imported.
+    """
+    from yaml import safe_dump as dump
+
+    home = Path(tempfile.mkdtemp(prefix="socomote-bench-"))
+    zones = {}
+    for i, name in enumerate(zone_names):
+        others = [n for n in zone_names if n != name]
+        zones[name] = {'Index': i + 1, 'Groups': {2: others[:1], 3: others[:3]}}
+    scenes = {
+        1: {'Name': "Bench", 'Group': zone_names[1:4], 'Volumes': {name: 8 for name in zone_names[:4]}, 'Station': 2}
+    }
+    (home / "config.yaml").write_text(dump({
+        'Zones': zones, 'VolumeIncrement': 3, 'KeyMap': {'SCENE': 'c'}, 'Scenes': scenes,
+    }))
+    (home / "topology.yaml").write_text(dump({
+        name: {'UID': f"RINCON_{i}", 'IP': f"fake://{name}"} for i, name in enumerate(zone_names)
+    }))
+    (home / "plugins.py").write_text("")
+    os.environ['SOCOMOTE_HOME'] = str(home)
+    return home
+
+
+def percentiles(samples: Iterable[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    return {
+        'n': len(samples),
+        'p50_ms': pick(0.5) * 1000,
+        'p99_ms': pick(0.99) * 1000,
+        'mean_ms': statistics.mean(samples) * 1000,
+    }
+
+
+class ScriptedKeys:
+    """
+    Key source which replays a key sequence with a delay before each key, then exits.
+    """
+
+    def __init__(self, keys: List[str], interval: float):
+        from socomote.config import EXIT_CODE
+        from socomote.keys import Keys
+
+        self._keys = iter(list(keys) + list(EXIT_CODE) + [Keys.ENTER])
+        self.interval = interval
+
+    def __call__(self) -> str:
+        time.sleep(self.interval)
+        return next(self._keys)
+
+
+class Bench:
+
+    def __init__(self, args):
+        self.args = args
+        self.zone_names = [f"Zone {i + 1}" for i in range(args.zones)]
+        self.home = setup_home(self.zone_names)
+
+        # socomote.core loads the plugins found in the home set up above
+        import socomote.config
+        import socomote.core
+        import socomote.station
+        import socomote.topology
+        import socomote.tts_server
+        from socomote.tts_server import TTSServer, TTSRequestHandler
+        from benchmarks.fakes import Network, Household, FakeMusicLibrary, FakeSpeechEngine
+
+        self.network = Network(
+            latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, seed=args.seed
+        )
+        favourites = [(f"Station {i + 1}", f"x-rincon-mp3radio:station{i + 1}") for i in range(args.stations)]
+        self.household = Household(self.network, favourites)
+        fakes = {f"fake://{name}": self.household.add_zone(name) for name in self.zone_names}
+        self.speech = FakeSpeechEngine(latency=args.tts_latency)
+
+        socomote.topology.SoCo = fakes.__getitem__
+        socomote.station.MusicLibrary = FakeMusicLibrary
+        socomote.tts_server.open_engine = lambda: self.speech
+        TTSServer._detect_ip_addr = lambda self: "127.0.0.1"
+        TTSRequestHandler.log_message = lambda self, *args: None
+        self.core = socomote.core
+        self.zones = socomote.config.ZONES
+
+    def receiver(self):
+        return self.core.Receiver(self.zones[self.zone_names[0]])
+
+    def drive(self, receiver, keys: List[str], interval: float) -> List[Tuple[str, float]]:
+        """
+        Run the keys through a fresh CommandExecutor, returning (command, key-to-finished seconds) for each command.
+        """
+        from socomote.inputs import TerminalInput
+        from socomote.metrics import METRICS
+
+        finished = []
+        finish_command = METRICS.finish_command
+
+        def record(trace, failed=False):
+            finish_command(trace, failed=failed)
+            finished.append((trace.command, trace.marks['finished'] - trace.marks['received']))
+
+        METRICS.finish_command = record
+        try:
+            self.core.CommandExecutor(receiver, key_input=TerminalInput(getkey=ScriptedKeys(keys, interval))).run()
+        finally:
+            METRICS.finish_command = finish_command
+        return [(name, latency) for name, latency in finished if name != "Exit"]
+
+    def key_latency(self, receiver) -> dict:
+        from socomote.keys import Keys
+
+        keys = [Keys.UP] * 10 + [Keys.DOWN] * 10 + [Keys.MUTE] * 4 + [Keys.PLAY_PAUSE] * 4 + [Keys.NEXT_TRACK] * 4
+        calls_before = self.network.calls
+        finished = self.drive(receiver, keys, interval=0.25)
+        by_command: Dict[str, List[float]] = {}
+        for name, latency in finished:
+            by_command.setdefault(name, []).append(latency)
+        return {
+            'all': percentiles(latency for _, latency in finished),
+            'by_command': {name: percentiles(samples) for name, samples in sorted(by_command.items())},
+            'speaker_calls_per_key': (self.network.calls - calls_before) / len(keys),
+        }
+
+    def station_skip(self, receiver) -> dict:
+        from socomote.keys import Keys
+
+        master = self.zones[self.zone_names[0]]
+        skips = 20
+        stations = receiver.stations
+        receiver.household.stations.wait(10)
+        stations.select_station(1)
+        expected = stations[skips % len(stations) + 1].title
+        start = time.monotonic()
+        finished = self.drive(receiver, [Keys.RIGHT] * skips, interval=0.03)
+        processed = time.monotonic() - start
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and not (master.plays and master.plays[-1][1] == expected):
+            time.sleep(0.01)
+        playing = master.plays[-1][0] - start if master.plays and master.plays[-1][1] == expected else None
+        return {
+            'skips': skips,
+            'commands_executed': len(finished),
+            'skips_per_second': skips / processed,
+            'final_station_playing_s': playing,
+        }
+
+    def scene(self, receiver) -> dict:
+        """
+        Set up a group, volumes and a station with a scene, and with the equivalent separate commands, each from the
+        master zone on its own. Separate commands' times are summed, as if each key was pressed as the last finished.
+        """
+        from socomote.keys import Keys
+
+        receiver.household.stations.wait(10)
+        separate = ['3', Keys.GROUP] + [Keys.DOWN] * 4 + ['2', Keys.ENTER]
+        results = {}
+        for label, keys in (('scene', ['1', Keys.SCENE]), ('separate', separate)):
+            self.drive(receiver, ['1', Keys.GROUP], interval=0.05)
+            for name in self.zone_names:
+                self.zones[name].volume = 20
+            calls_before = self.network.calls
+            finished = self.drive(receiver, keys, interval=0.25)
+            results[f"{label}_s"] = sum(latency for _, latency in finished)
+            results[f"{label}_speaker_calls"] = self.network.calls - calls_before
+        return results
+
+    def regroup(self) -> dict:
+        from socomote.grouping import Regrouper, plan_regroup
+
+        regrouper = Regrouper(self.zones)
+        master = self.zone_names[0]
+        results = {}
+        try:
+            for n in sorted({2, 4, self.args.zones}):
+                if n > self.args.zones:
+                    continue
+                slaves = self.zone_names[1:n]
+                start = time.monotonic()
+                result = regrouper.execute(plan_regroup(master, master, [master], slaves))
+                grouped = time.monotonic() - start
+                start = time.monotonic()
+                regrouper.execute(plan_regroup(master, master, [master] + slaves, []))
+                ungrouped = time.monotonic() - start
+                results[f"{n}_zones"] = {
+                    'group_s': grouped, 'ungroup_s': ungrouped, 'failed': len(result.failed)
+                }
+        finally:
+            regrouper.close()
+        return results
+
+    def tts(self, receiver) -> dict:
+        server = receiver._tts_server
+        text = "Benchmark announcement"
+        uri = server.get_uri(text)
+        start = time.monotonic()
+        with urllib.request.urlopen(uri) as response:
+            response.read(1)
+            first_byte = time.monotonic() - start
+            response.read()
+        cold = time.monotonic() - start
+
+        clients, requests_per_client = 8, 25
+        # distinct uncached phrases announced at once, limited by the number of synthesis workers
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(lambda i: urllib.request.urlopen(server.get_uri(f"{text} {i}")).read(), range(clients)))
+        cold_per_second = clients / (time.monotonic() - start)
+
+        def client(_):
+            for _ in range(requests_per_client):
+                urllib.request.urlopen(uri).read()
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, range(clients)))
+        elapsed = time.monotonic() - start
+        return {
+            'cold_request_s': cold,
+            'cold_first_byte_s': first_byte,
+            'cold_phrases_per_second': cold_per_second,
+            'requests_per_second': clients * requests_per_client / elapsed,
+            'concurrent_clients': clients,
+        }
+
+    def run(self) -> dict:
+        results = {'regroup': self.regroup()}
+        with self.receiver() as receiver:
+            results['tts'] = self.tts(receiver)
+            results['key_latency'] = self.key_latency(receiver)
+            results['station_skip'] = self.station_skip(receiver)
+            results['scene'] = self.scene(receiver)
+        return {
+            'meta': {
+                'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'args': vars(self.args),
+            },
+            'results': results,
+        }
+
+
+def flatten(d: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            flat.update(flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[f"{prefix}{k}"] = v
+    return flat
+
+
+def _fmt(value) -> str:
+    return f"{'-':>12}" if value is None else f"{value:12.3f}"
+
+
+def compare(previous: dict, current: dict, out: Callable[[str], None] = print):
+    old, new = flatten(previous['results']), flatten(current['results'])
+    for key in sorted(set(old) | set(new)):
+        if key in old and key in new and old[key]:
+            out(f"{key:60} {old[key]:12.3f} -> {new[key]:12.3f} ({(new[key] - old[key]) / old[key]:+.0%})")
+        else:
+            out(f"{key:60} {_fmt(old.get(key))} -> {_fmt(new.get(key))}")
+
+
+def main():
+    args = parser.parse_args()
+    results = Bench(args).run()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
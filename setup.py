@@ -11,7 +11,13 @@ setup(
     include_package_data=True,
     install_requires=[
         "pyyaml",
-        "soco >= 0.23.2",
+        "soco >= 0.26",
         "getkey >= 0.6.5"
     ],
+    extras_require={
+        # reading remotes directly from Linux input devices
+        "evdev": ["evdev"],
+        # noticing changes to config.yaml immediately, rather than by polling
+        "inotify": ["inotify_simple"],
+    },
 )
\ No newline at end of file
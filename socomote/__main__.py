@@ -2,23 +2,41 @@ import logging
 import sys
 from argparse import ArgumentParser
 from logging.handlers import RotatingFileHandler
+from typing import TYPE_CHECKING
 
-from socomote.config import ZONES, LOG_FILE, MASTER_ZONE, CONFIG
-from socomote.core import Receiver
+from socomote.startup_profile import STARTUP
+
+if TYPE_CHECKING:
+    from socomote.core import Receiver
 
 parser = ArgumentParser()
 parser.add_argument("--zone", "-z", help="Sonos zone to control (defaults to 'zone' in config.json).")
 parser.add_argument("--debug", "-d", action="store_true", help="Run in DEBUG mode.")
 parser.add_argument("--console-log", "-cl", action="store_true", help="Log to console, not file.")
+parser.add_argument(
+    "--daemon", action="store_true", help="Run a receiver for every remote in 'Remotes' in config.yaml."
+)
+parser.add_argument(
+    "--profile-startup",
+    action="store_true",
+    help="Report the time of each startup phase and module import, and the peak memory, on the first key press.",
+)
 
 
-def main(receiver: Receiver):
+def main(receiver: 'Receiver'):
     with receiver as r:
         r.run()
     return 0
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    if args.profile_startup:
+        # before socomote's other modules are imported, so their imports are timed
+        STARTUP.start()
+    with STARTUP.phase("config"):
+        from socomote.config import ZONES, LOG_FILE, MASTER_ZONE, CONFIG
+    with STARTUP.phase("imports"):
+        from socomote.core import Receiver
     logging_level = logging.DEBUG if args.debug else logging.INFO
 
     logging.getLogger('soco').setLevel(logging.ERROR)
@@ -35,12 +53,23 @@ if __name__ == '__main__':
         level=logging_level, format="%(asctime)s - [%(levelname)s] - %(name)s: %(message)s", handlers=[handler]
     )
     logger = logging.getLogger(__name__)
+    if args.daemon:
+        from socomote.daemon import Daemon
+
+        remotes = CONFIG.get('Remotes') or {}
+        logger.info(f"Starting socomote daemon for zones {sorted(remotes)}...")
+        with STARTUP.phase("discovery"):
+            ZONES.revalidate()
+        Daemon(remotes).run()
+        sys.exit(0)
     if args.zone is not None:
         zone_name = args.zone
     else:
         zone_name = [z for z, v in CONFIG['Zones'].items() if v['Index'] == MASTER_ZONE][0]
     logger.info(f"Starting socomote receiver for zone '{zone_name}'...")
-    controller = ZONES[zone_name]
+    with STARTUP.phase("discovery"):
+        ZONES.revalidate()
+        controller = ZONES[zone_name]
     receiver = Receiver(controller)
 
     sys.exit(main(receiver))
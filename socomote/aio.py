@@ -0,0 +1,88 @@
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from threading import Thread
+from typing import Any, Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of blocking speaker calls running at once, across all commands. Threads are only started as needed.
+MAX_SPEAKER_CALLS = 16
+# Seconds to wait for cancelled tasks to unwind on shutdown
+STOP_TIMEOUT = 1.0
+
+T = TypeVar('T')
+
+
+class AsyncRuntime:
+    """
+    An asyncio event loop on a background thread, on which the commands, the station player and the favourites refresh
+    run.
+
+    soco is synchronous, so speaker calls are made with `call`, which runs them on a bounded pool shared by every
+    command. A command can have many calls in flight at once (e.g. with `asyncio.gather`) without a thread of its own
+    per call. Stopping the runtime cancels whatever is still running on the loop rather than waiting for it.
+    """
+
+    def __init__(self, max_speaker_calls: int = MAX_SPEAKER_CALLS):
+        self.loop = asyncio.new_event_loop()
+        self._calls = ThreadPoolExecutor(max_workers=max_speaker_calls, thread_name_prefix="speaker-call")
+        self._thread = Thread(target=self._run, name="async-runtime", daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        if not self._thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop).result(STOP_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"Tasks didn't finish cancelling: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        # don't wait for calls already sent to the speakers, their results are no longer wanted
+        self._calls.shutdown(wait=False)
+
+    @staticmethod
+    async def _cancel_all():
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            logger.debug(f"Cancelled {len(tasks)} running tasks")
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Make a blocking (e.g. soco) call without blocking the loop. The call sees the caller's context variables, e.g.
+        the trace of the command making it.
+        """
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self._calls, partial(context.run, fn, *args, **kwargs))
+
+    def submit(self, coro: Awaitable[T]) -> 'Future[T]':
+        """
+        Schedule the coroutine on the loop from another thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[T]) -> T:
+        """
+        Run the coroutine on the loop from another thread, waiting for its result.
+        """
+        return self.submit(coro).result()
@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from socomote.mp3 import mp3_duration
+
+logger = logging.getLogger(__name__)
+
+# Default total size of the clips kept, in bytes
+MAX_BYTES = 64 * 1024 * 1024
+# Rewrite the data file without evicted clips once they take up more than this fraction of it
+COMPACT_RATIO = 0.5
+
+DATA_FILE = "clips.dat"
+INDEX_FILE = "clips.idx"
+
+_MAGIC = b"SOCLIPS1"
+# key, offset, length, duration in seconds, last used (time.time())
+_RECORD = struct.Struct("<16sQIfd")
+
+
+def clip_key(text: str, voice: str, language: str) -> bytes:
+    """
+    Key of the clip of the given text spoken by the given voice and language.
+    """
+    return hashlib.blake2b(f"{voice}\0{language}\0{text}".encode(), digest_size=16).digest()
+
+
+@dataclass
+class _Entry:
+    # slotted, as there's one per clip in the store
+    __slots__ = ('offset', 'length', 'duration', 'last_used')
+    offset: int
+    length: int
+    duration: float
+    last_used: float
+
+
+class ClipStore:
+    """
+    Size-bounded store of MP3 clips, packed into a single memory-mapped data file with a compact binary index.
+
+    Clips are appended to the data file and looked up by key, returning a zero-copy view of the mapped file. The least
+    recently used clips are evicted once the total size exceeds `max_bytes`, and the data file is compacted once
+    evicted clips take up too much of it. Views handed out stay valid after eviction or compaction, as they keep the
+    mapping they came from alive.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evicted = 0
+        self._data_file = directory / DATA_FILE
+        self._index_file = directory / INDEX_FILE
+        self._entries: 'OrderedDict[bytes, _Entry]' = OrderedDict()
+        self._map: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        self._lock = Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+        self._data_file.touch()
+        # whether the store has just been created, rather than loaded
+        self.is_new = not self._index_file.exists()
+        self._load_index()
+
+    @property
+    def size(self) -> int:
+        """Total size of the clips stored, in bytes"""
+        return sum(e.length for e in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._entries
+
+    def _load_index(self):
+        if not self._index_file.exists():
+            return
+        data_size = self._data_file.stat().st_size
+        raw = self._index_file.read_bytes()
+        if not raw.startswith(_MAGIC):
+            logger.error(f"Ignoring unrecognised clip index {self._index_file}")
+            return
+        entries = []
+        for key, offset, length, duration, last_used in _RECORD.iter_unpack(raw[len(_MAGIC):]):
+            if offset + length <= data_size:
+                entries.append((key, _Entry(offset, length, duration, last_used)))
+        # least recently used first
+        entries.sort(key=lambda item: item[1].last_used)
+        self._entries.update(entries)
+        logger.info(f"Loaded {len(self._entries)} clips ({self.size / 1e6:.1f}MB) from {self.directory}")
+
+    def _save_index(self):
+        records = b"".join(
+            _RECORD.pack(key, e.offset, e.length, e.duration, e.last_used) for key, e in self._entries.items()
+        )
+        tmp = self._index_file.with_name(INDEX_FILE + ".tmp")
+        tmp.write_bytes(_MAGIC + records)
+        os.replace(tmp, self._index_file)
+
+    def _mapping(self) -> Optional[mmap.mmap]:
+        """
+        Return a mapping covering the whole data file, remapping if it has grown. Must hold the lock.
+        """
+        size = self._data_file.stat().st_size
+        if size == 0:
+            return None
+        if self._map is None or self._mapped_size != size:
+            with self._data_file.open('rb') as f:
+                # the previous mapping is closed once the last view of it is released
+                self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._map
+
+    def get(self, key: bytes) -> Optional[memoryview]:
+        """
+        Return a view of the clip with the given key, or None if it isn't stored.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.last_used = time.time()
+            self._entries.move_to_end(key)
+            return memoryview(self._mapping())[entry.offset:entry.offset + entry.length]
+
+    def duration(self, key: bytes) -> Optional[float]:
+        entry = self._entries.get(key)
+        return None if entry is None else entry.duration
+
+    def put(self, key: bytes, data: bytes, duration: Optional[float] = None, sync: bool = True) -> memoryview:
+        """
+        Store the clip under the given key, evicting the least recently used clips if over budget, and return a view
+        of it. If sync is False, the clip isn't persisted until the next `flush`, for storing many clips at once.
+        """
+        if duration is None:
+            duration = mp3_duration(data)
+        with self._lock:
+            with self._data_file.open('ab') as f:
+                offset = f.tell()
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._entries[key] = _Entry(offset, len(data), duration, time.time())
+            self._entries.move_to_end(key)
+            self._evict()
+            if sync:
+                self._save_index()
+            entry = self._entries.get(key)
+            if entry is None:
+                # larger than the whole budget, so evicted straight away; still serve it this once
+                return memoryview(data)
+            return memoryview(self._mapping())[entry.offset:entry.offset + entry.length]
+
+    def _evict(self):
+        size = self.size
+        while size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            size -= entry.length
+            self.evicted += 1
+        data_size = self._data_file.stat().st_size
+        if data_size and (data_size - size) / data_size > COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the data file with only the clips still in the index. Must hold the lock.
+        """
+        source = self._mapping()
+        tmp = self._data_file.with_name(DATA_FILE + ".tmp")
+        before = self._mapped_size
+        with tmp.open('wb') as f:
+            for entry in self._entries.values():
+                offset = f.tell()
+                f.write(source[entry.offset:entry.offset + entry.length])
+                entry.offset = offset
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._data_file)
+        self._save_index()
+        self._map = None
+        logger.info(f"Compacted clip store from {before / 1e6:.1f}MB to {self._data_file.stat().st_size / 1e6:.1f}MB")
+
+    def flush(self):
+        """
+        Persist all clips stored, and how recently each was used.
+        """
+        with self._lock:
+            with self._data_file.open('ab') as f:
+                os.fsync(f.fileno())
+            self._save_index()
+
+    close = flush
@@ -0,0 +1,126 @@
+import logging
+import time
+from collections import deque
+from threading import Condition
+from typing import Deque, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from socomote.core import Command
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of commands waiting to execute, after coalescing
+MAX_QUEUED = 8
+
+# Priority classes. Each has its own queue and execution thread, so urgent commands (e.g. volume) aren't held up
+# behind a slow normal one (e.g. regrouping).
+URGENT = 0
+NORMAL = 1
+
+# Default seconds after its key press that a command is still worth executing
+DEFAULT_DEADLINE = 10.0
+
+
+class _Cancelled:
+
+    def __repr__(self):
+        return "CANCELLED"
+
+
+# Returned by Command.merge when two commands cancel each other out
+CANCELLED = _Cancelled()
+
+
+class CoalescingQueue:
+    """
+    Command queue which merges commands of the same kind while they are waiting to execute.
+
+    When a command is put:
+     1. Any waiting commands of a type the new command `supersedes` are dropped.
+     2. The most recently queued command is asked to `merge` with the new one. This may return a single command
+        replacing both, CANCELLED if the two cancel out, or None if they can't be merged, in which case the new command
+        is queued as normal.
+
+    Commands whose deadline has passed by the time they reach the front of the queue are dropped.
+    """
+
+    def __init__(self, max_queued: int = MAX_QUEUED):
+        self.max_queued = max_queued
+        # number of commands which were merged or dropped rather than executed
+        self.saved = 0
+        # number of commands dropped as their deadline had passed
+        self.expired = 0
+        self._queue: Deque['Command'] = deque()
+        self._condition = Condition()
+        self._closed = False
+
+    def put(self, command: 'Command', force: bool = False) -> bool:
+        """
+        Add the command to the queue, returning False if it was discarded as the queue is full.
+        If force is set, the command is queued even if the queue is full.
+        """
+        with self._condition:
+            if command.supersedes:
+                superseded = [c for c in self._queue if isinstance(c, command.supersedes)]
+                for c in superseded:
+                    logger.debug(f"{command} supersedes queued {c}")
+                    self._queue.remove(c)
+                    self.saved += 1
+            if self._queue:
+                merged = self._queue[-1].merge(command)
+                if merged is CANCELLED:
+                    logger.debug(f"{command} cancels out queued {self._queue[-1]}")
+                    self._queue.pop()
+                    self.saved += 2
+                    return True
+                elif merged is not None:
+                    logger.debug(f"{command} merged with queued {self._queue[-1]} into {merged}")
+                    if merged.trace is None:
+                        # time the merged command from the earliest key press
+                        merged.trace = self._queue[-1].trace
+                    self._queue[-1] = merged
+                    self.saved += 1
+                    return True
+            if len(self._queue) >= self.max_queued and not force:
+                return False
+            self._queue.append(command)
+            self._condition.notify()
+            return True
+
+    def get(self) -> Optional['Command']:
+        """
+        Return the next command which is still within its deadline, waiting for one if necessary, or None once the
+        queue is closed and empty.
+        """
+        with self._condition:
+            while True:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return None
+                command = self._queue.popleft()
+                if command.expired(time.monotonic()):
+                    logger.info(f"Dropping {command}, its deadline has passed")
+                    self.expired += 1
+                    continue
+                return command
+
+    def clear(self) -> List['Command']:
+        """
+        Remove and return all waiting commands.
+        """
+        with self._condition:
+            cleared = list(self._queue)
+            self._queue.clear()
+            return cleared
+
+    def close(self):
+        """
+        Stop waiting for commands: once the queued commands have been taken, `get` returns None.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def qsize(self) -> int:
+        return len(self._queue)
@@ -3,20 +3,13 @@ import os
 import shutil
 import sys
 from pathlib import Path
-from typing import Dict
-from importlib import __import__
 
-from yaml import safe_load as load, safe_dump as dump
-import soco
-from soco import SoCo
+from socomote.topology import ZoneDirectory
+from socomote.yaml_io import load, dump
 
 
 logger = logging.getLogger(__name__)
 
-ZONES: Dict[str, SoCo] = {}
-for zone in soco.discover():
-    ZONES[zone.player_name] = zone
-
 
 SOCOMOTE_HOME = Path(
     os.environ.get('SOCOMOTE_HOME', '~/socomote')
@@ -24,6 +17,11 @@ SOCOMOTE_HOME = Path(
 SOCOMOTE_HOME.mkdir(parents=True, exist_ok=True)
 
 LOG_FILE = SOCOMOTE_HOME / "main.log"
+METRICS_FILE = SOCOMOTE_HOME / "metrics.json"
+
+# Zones are loaded from the cached topology on first use and revalidated by discovery in the background.
+TOPOLOGY_FILE = SOCOMOTE_HOME / "topology.yaml"
+ZONES = ZoneDirectory(TOPOLOGY_FILE)
 
 SOCOMOTE_CONFIG_FILE = SOCOMOTE_HOME / "config.yaml"
 # Copy the example config if the file doesn't exist, and exit, probably needs to be edited before socomote can run.
@@ -47,17 +45,21 @@ with SOCOMOTE_MASTER_ZONE_FILE.open('r') as f:
     MASTER_ZONE = load(f.read())['MasterZone']
 
 
+# Stations with their preset numbers, loaded at startup and kept in step with the Sonos favourites.
+STATIONS_FILE = SOCOMOTE_HOME / "stations.yaml"
+
+# Synthesized announcements, packed into a single file
+CLIP_STORE_DIR = SOCOMOTE_HOME / "clips"
+# One file per announcement, as cached by earlier versions. Imported into the clip store when it's first created.
 MP3_LIB = SOCOMOTE_HOME / "mp3s"
-MP3_LIB.mkdir(exist_ok=True)
 
 EXIT_CODE = CONFIG.get('Codes', {}).get('EXIT', '000')
 
+# Plugin modules are plugins.py and any other plugin*.py files in SOCOMOTE_HOME, imported when one of their commands
+# is first used (see `plugin_loader`). The example plugins are copied on first run.
 PLUGINS = SOCOMOTE_HOME / "plugins.py"
 sys.path.append(str(SOCOMOTE_HOME))
 
 if not PLUGINS.exists():
     example_plugins = Path(__file__).parent / "resources" / "example_plugins.py"
     shutil.copy(example_plugins, PLUGINS)
-
-# use the __import__ function to not annoy the IDE
-__import__("plugins")
\ No newline at end of file
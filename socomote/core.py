@@ -1,65 +1,262 @@
+import asyncio
+import inspect
 import logging
-import random
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dataclasses import dataclass
-from queue import Queue, Empty as QueueEmpty
-from threading import Thread
-from typing import Iterable, Optional, ClassVar
+from functools import partial
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, ClassVar, Tuple, Type, TypeVar, Union
 
 from soco import SoCo
-from yaml import dump
-from getkey import getkey
 
-from socomote.config import ZONES, CONFIG, SOCOMOTE_MASTER_ZONE_FILE, EXIT_CODE
+from socomote.aio import AsyncRuntime
+from socomote.clip_store import MAX_BYTES
+from socomote.command_queue import CoalescingQueue, CANCELLED, URGENT, NORMAL, DEFAULT_DEADLINE
+from socomote.config import ZONES, SOCOMOTE_HOME, SOCOMOTE_MASTER_ZONE_FILE, METRICS_FILE, STATIONS_FILE
+from socomote.grouping import Regrouper, RegroupResult
+from socomote.http_pool import INTERNET, SPEAKERS
+from socomote.inputs import KeyInput, open_input, rebind_evdev_keys
 from socomote.keys import Keys
-from socomote.station import Station, Stations, is_station_uri
+from socomote.live_config import LIVE_CONFIG, ConfigError, ConfigSnapshot, ConfigWatcher
+from socomote.metrics import METRICS, CommandTrace
+from socomote.plugin_loader import (
+    CODE, KEY, SPECIAL_CODE, PluginCommand, PluginLoader, bound_trigger, discover_plugins
+)
+from socomote.scenes import Scene, Step, run_plan
+from socomote.soco_hooks import install_soco_hooks
+from socomote.startup_profile import STARTUP
+from socomote.station import Station, Stations, is_station_uri, REFRESH_INTERVAL
+from socomote.tts_cache import Presynthesizer
 from socomote.tts_server import TTSServer
+from socomote.volume import VolumeControl
+from socomote.yaml_io import dump
+from socomote.zone_health import ZONE_HEALTH, ZoneUnavailable
+from socomote.zone_state import ZoneStateCache, ZoneState, PLAYING_STATES
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+HELLO = "Socomote hello!"
+GOODBYE = "Socomote goodbye."
+
+# Time allowed for an announcement whose length isn't known, when its end can't be watched for
+DEFAULT_ANNOUNCEMENT_SECONDS = 2
+# Longest a station waits for the end of an announcement whose length isn't known, e.g. one still being streamed
+UNKNOWN_ANNOUNCEMENT_SECONDS = 30.0
+# Seconds between checks of the transport state for the end of such an announcement, if events aren't being received
+ANNOUNCEMENT_POLL_SECONDS = 0.5
+# Allowance for the speaker fetching and starting an announcement
+ANNOUNCEMENT_START_SECONDS = 0.3
+# Seconds to wait on exit for a running plugin command to notice it's been cancelled
+EXIT_TIMEOUT = 5.0
+# Seconds a plugin command may run before it's cut off and reported, unless it sets its own `timeout`
+PLUGIN_TIMEOUT = 10.0
+# Plugin commands which can run at once. A plugin command which ignores being cut off keeps its worker until it returns.
+PLUGIN_WORKERS = 2
+
+class Household:
+    """
+    Services shared by every receiver in the process: the zone state cache, regrouping, the announcement server with
+    its synthesis cache, the station list and the event loop commands run on. A receiver creates its own if not given
+    one, so several receivers controlling different master zones can share a single instance (see `daemon`).
+    """
+
+    def __init__(self, station_zone: Optional[SoCo] = None):
+        """
+        :param station_zone: zone to browse favourites on and watch for favourites changes. Any zone if not given.
+        """
+        install_soco_hooks()
+        self.runtime = AsyncRuntime()
+        # plugin commands run here, so a misbehaving one can be cut off without holding up the other commands
+        self.plugin_pool = ThreadPoolExecutor(
+            max_workers=LIVE_CONFIG.snapshot.raw.get('PluginWorkers', PLUGIN_WORKERS), thread_name_prefix="plugin"
+        )
+        self.zone_state = ZoneStateCache(ZONES)
+        ZONE_HEALTH.add_listener(self.zone_state.resubscribe)
+        self.regrouper = Regrouper(ZONES)
+        with STARTUP.phase("tts bind"):
+            self.tts_server = TTSServer()
+        self.presynthesizer = Presynthesizer(self.tts_server.cache)
+        self._register_gauges()
+        self.presynthesizer.submit([HELLO, GOODBYE])
+        self.config_watcher = ConfigWatcher(LIVE_CONFIG)
+        with STARTUP.phase("stations"):
+            self.stations = Stations(
+                on_change=self._presynthesize_titles,
+                zone=station_zone,
+                interval=LIVE_CONFIG.snapshot.raw.get('StationRefreshInterval', REFRESH_INTERVAL),
+                snapshot_file=STATIONS_FILE,
+                runtime=self.runtime,
+            )
+        LIVE_CONFIG.add_listener(self._on_config)
+
+    def __enter__(self):
+        self.runtime.__enter__()
+        self.zone_state.__enter__()
+        self.tts_server.__enter__()
+        self.config_watcher.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.config_watcher.__exit__(exc_type, exc_val, exc_tb)
+        LIVE_CONFIG.remove_listener(self._on_config)
+        ZONE_HEALTH.remove_listener(self.zone_state.resubscribe)
+        self.runtime.__exit__(exc_type, exc_val, exc_tb)
+        # don't wait for plugin commands which were cut off but are still running
+        self.plugin_pool.shutdown(wait=False, cancel_futures=True)
+        self.tts_server.__exit__(exc_type, exc_val, exc_tb)
+        self.stations.stop()
+        self.zone_state.__exit__(exc_type, exc_val, exc_tb)
+        self.regrouper.close()
+        self.presynthesizer.close()
+        self.tts_server.cache.close()
+        METRICS.dump(METRICS_FILE)
+
+    def _on_config(self, config: ConfigSnapshot):
+        # the refresh loop and the clip store read these each time they're used
+        self.stations.interval = config.raw.get('StationRefreshInterval', REFRESH_INTERVAL)
+        self.tts_server.cache.store.max_bytes = config.raw.get('AnnouncementCacheBytes', MAX_BYTES)
+
+    def _register_gauges(self):
+        cache = self.tts_server.cache
+        METRICS.gauge('tts_cache_hits', lambda: cache.hits)
+        METRICS.gauge('tts_cache_misses', lambda: cache.misses)
+        METRICS.gauge('tts_cache_in_flight', lambda: cache.in_flight)
+        METRICS.gauge('tts_cache_deduplicated', lambda: cache.deduplicated)
+        METRICS.gauge('tts_cache_failed', lambda: cache.failed)
+        METRICS.gauge('tts_clips', lambda: len(cache.store))
+        METRICS.gauge('tts_clip_bytes', lambda: cache.store.size)
+        METRICS.gauge('tts_clips_evicted', lambda: cache.store.evicted)
+        for pool in (SPEAKERS, INTERNET):
+            METRICS.gauge('http_connections_reused', lambda pool=pool: pool.reused, pool=pool.name)
+        METRICS.gauge('plugins_loaded', lambda: len(PLUGINS.import_seconds))
+        METRICS.gauge('zones_unavailable', lambda: len(ZONE_HEALTH.unavailable()))
+
+    def _presynthesize_titles(self, stations: Iterable[Station]):
+        self.presynthesizer.submit(s.title for s in stations)
+
+
 class Receiver:
 
-    def __init__(self, master_zone: SoCo):
-        self.master_zone: SoCo = master_zone
-        self.stations = Stations()
+    def __init__(
+        self,
+        master_zone: SoCo,
+        household: Optional[Household] = None,
+        key_input: Optional[KeyInput] = None,
+        name: str = "main",
+    ):
+        """
+        :param master_zone: zone to control.
+        :param household: shared services, if controlling one of several master zones. Created and managed by this
+            receiver if not given.
+        :param key_input: source of key presses. Opened from the 'Input' config if not given.
+        :param name: name of this receiver in logs and metrics.
+        """
+        self.name = name
+        self._owns_household = household is None
+        self.household = Household(station_zone=master_zone) if household is None else household
+        self.zone_state = self.household.zone_state
+        self.regrouper = self.household.regrouper
+        self._tts_server = self.household.tts_server
+        self.stations = self.household.stations.cursor()
+        self.volume: Optional[VolumeControl] = None
+        self.master_zone = master_zone
         self.exit = False
-        self._station_queue = Queue(maxsize=1)
-        self._play_stations_thread = Thread(target=self._play_stations)
-        self._tts_server = TTSServer()
-        self._executor = CommandExecutor(self)
+        # guards the queued station and the announcement it's waiting on, which are set from any thread
+        self._station_lock = Lock()
+        self._queued_station: Optional[Station] = None
+        self._announcement_end = 0.0
+        self._announcement_uri: Optional[str] = None
+        self._announcement_started = False
+        # the queued station is waiting for the announcement to stop, as its length isn't known
+        self._announcement_unknown = False
+        # set on the loop to wake the station player, created there once it's running
+        self._station_wake: Optional[asyncio.Event] = None
+        self._station_player = None
+        self.zone_state.add_listener(self._on_zone_state)
+        LIVE_CONFIG.add_listener(self._on_config)
+        ZONE_HEALTH.add_listener(self._on_zone_moved)
+        self._executor = CommandExecutor(self, key_input=key_input)
 
     def __enter__(self):
         self.exit = False
-        self._play_stations_thread.start()
-        self._tts_server.__enter__()
+        if self._owns_household:
+            self.household.__enter__()
+        self._station_player = self.household.runtime.submit(self._play_stations())
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._tts_server.__exit__(exc_type, exc_val, exc_tb)
-        self._play_stations_thread.join()
+        self.exit = True
+        # a station waiting to play, or starting, is abandoned rather than waited for
+        self._station_player.cancel()
+        self.volume.stop()
+        LIVE_CONFIG.remove_listener(self._on_config)
+        ZONE_HEALTH.remove_listener(self._on_zone_moved)
+        if self._owns_household:
+            self.household.__exit__(exc_type, exc_val, exc_tb)
+
+    @property
+    def master_zone(self) -> SoCo:
+        return self._master_zone
+
+    @master_zone.setter
+    def master_zone(self, zone: SoCo):
+        self._master_zone = zone
+        if self.volume is not None:
+            self.volume.stop()
+        settings = LIVE_CONFIG.snapshot.volume[zone.player_name]
+        self.volume = VolumeControl(zone, ZONES, self.zone_state, settings)
+
+    def _on_config(self, snapshot: ConfigSnapshot):
+        self.volume.settings = snapshot.volume[self.master_zone.player_name]
+
+    def _on_zone_moved(self, name: str, zone: SoCo):
+        if name == self.master_zone.player_name:
+            logger.info(f"Master zone {name} has moved to {zone.ip_address}")
+            self.master_zone = zone
 
     def run(self):
-        self.speak("Socomote hello!")
+        with STARTUP.phase("hello"):
+            self.speak(HELLO)
         self._executor.run()
-        self.speak("Socomote goodbye.")
-        time.sleep(2)
+        duration = self.speak(GOODBYE)
+        time.sleep(DEFAULT_ANNOUNCEMENT_SECONDS if duration is None else duration + ANNOUNCEMENT_START_SECONDS)
+
+    async def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Make a blocking call, e.g. to a speaker, from an async command without blocking the other commands.
+        """
+        return await self.household.runtime.call(fn, *args, **kwargs)
 
     def take_control(self):
         """
         Set the master zone to be the coordinator of the group it's in.
         This is necessary before various actions as non-coordinator zones cannot do various thing such as playing URIs.
         """
-        if self.master_zone.group.coordinator != self.master_zone:
-            slaves = [s for s in self.master_zone.group if s != self.master_zone]
-            logger.info(
-                f"Controller {self.master_zone.player_name} is not the master, "
-                f"taking control of: {[s.player_name for s in slaves]}"
-            )
-            for s in slaves:
-                s.unjoin()
-            for s in slaves:
-                s.join(self.master_zone)
+        master_name = self.master_zone.player_name
+        if self.zone_state.coordinator(self.master_zone) != master_name:
+            slaves = {s for s in self.zone_state.members(self.master_zone) if s != master_name}
+            logger.info(f"Controller {master_name} is not the master, taking control of: {sorted(slaves)}")
+            # unavailable slaves are left out by regroup
+            self.regroup(slaves)
+
+    def regroup(
+        self, target_slaves: Iterable[str], cancelled: Optional[Callable[[], bool]] = None
+    ) -> RegroupResult:
+        """
+        Make the master zone the coordinator of a group containing exactly the given slaves, making only the
+        join / unjoin calls needed, in parallel. Stops between the unjoin and join phases if `cancelled` returns True.
+        Slaves which are known to be unavailable are left out, rather than each waiting for a call to fail.
+        """
+        target_slaves = set(target_slaves)
+        unavailable = {name for name in target_slaves if not ZONE_HEALTH.available(name)}
+        if unavailable:
+            logger.warning(f"Leaving unavailable zones {sorted(unavailable)} out of the group")
+            target_slaves -= unavailable
+        return self.regrouper.regroup(self.master_zone, target_slaves, self.zone_state, cancelled=cancelled)
 
     def play_uri(self, uri="", meta="", title="", start=True, force_radio=False, take_control=True):
         """Wrapper for _master_zone.play_uri which first takes control to ensure the play_uri call succeeds"""
@@ -67,103 +264,326 @@ class Receiver:
             self.take_control()
         self.master_zone.play_uri(uri=uri, meta=meta, title=title, start=start, force_radio=force_radio)
 
-    def speak(self, text: str):
+    def speak(self, text: str) -> Optional[float]:
         """
         Convert the given text to speech and play it. See `tts_server` for details.
+        Returns the length of the announcement in seconds, if known.
         """
         uri = self._tts_server.get_uri(text)
+        with self._station_lock:
+            self._announcement_uri = uri
+            self._announcement_started = False
+        METRICS.expect_tts(text)
         self.play_uri(uri=uri, title=text)
+        return self._tts_server.cache.duration(text)
 
     def current_station(self) -> Optional[Station]:
         """
         Return the currently playing station, if a radio station, else None
         """
-        info = self.master_zone.get_current_media_info()
-        if is_station_uri(info['uri']):
-            return Station(title=info['channel'], uri=info['uri'])
-        else:
-            logger.info(f"Currently playing media: {info['channel']}, uri {info['uri']} not a station.")
+        uri = self.zone_state.uri(self.master_zone)
+        if not is_station_uri(uri):
+            logger.info(f"Currently playing uri {uri} not a station.")
+            return None
+        station = self.stations.by_uri(uri)
+        if station is None:
+            # Not one of the favourites, so get the title from the speaker
+            info = self.master_zone.get_current_media_info()
+            station = Station(title=info['channel'], uri=uri)
+        return station
 
     def play_station(self, station: Station, announce_title=True):
         """
         Play the given station after speaking its title.
         """
         logger.info(f"Playing station {station}")
+        announcement = 0.0
         if announce_title:
-            self.speak(station.title)
-        self.enqueue_station(station)
+            announcement = self.speak(station.title)
+        self.enqueue_station(station, announcement)
 
-    def enqueue_station(self, station: Station):
-        logger.debug(f"attempted to enqueue station {station}")
-        try:
-            self._station_queue.get_nowait()
-            logger.debug("station queue was non-empty and is now cleared")
-        except QueueEmpty:
-            logger.debug("station queue empty")
-            pass
-        self._station_queue.put(station, block=False)
-        logger.debug(f"{station} enqueued")
-
-    def vol_change(self, up: bool):
-        increment = CONFIG['Zones'][self.master_zone.player_name].get('VolumeIncrement')
-        if increment is None:
-            increment = CONFIG.get('VolumeIncrement', 3)
-        logger.debug(f"Volume change: Volume is currently {self.master_zone.volume}")
-        if up:
-            logger.debug(f"Increasing volume by {increment}")
-            self.master_zone.volume += increment
+    def enqueue_station(self, station: Station, announcement: Optional[float] = 0.0):
+        """
+        Queue the station to play once the announcement of the given length has finished, replacing any station
+        already waiting. If the length is None (unknown, e.g. the announcement is still being synthesized) the station
+        waits for the master zone to stop playing the announcement, up to UNKNOWN_ANNOUNCEMENT_SECONDS.
+        """
+        if announcement is None:
+            wait = UNKNOWN_ANNOUNCEMENT_SECONDS
+        elif announcement > 0:
+            wait = announcement + ANNOUNCEMENT_START_SECONDS
         else:
-            logger.debug(f"Decreasing volume by {increment}")
-            self.master_zone.volume -= increment
-        logger.debug(f"Volume is now {self.master_zone.volume}")
+            wait = 0.0
+        with self._station_lock:
+            if self._queued_station is not None:
+                logger.debug(f"replacing queued station {self._queued_station}")
+            self._queued_station = station
+            self._announcement_end = time.monotonic() + wait
+            self._announcement_unknown = announcement is None
+        self._wake_station_player()
+        logger.debug(f"{station} enqueued to play in {wait:.2f}s")
+
+    def _on_zone_state(self, name: str, state: ZoneState):
+        """
+        Watch the master zone's transport state to start a queued station as soon as its announcement stops.
+        """
+        if name != self.master_zone.player_name:
+            return
+        with self._station_lock:
+            if state.uri != self._announcement_uri:
+                return
+            finished = False
+            if state.transport_state == "PLAYING":
+                self._announcement_started = True
+            elif state.transport_state == "STOPPED" and self._announcement_started and self._queued_station:
+                logger.debug("Announcement finished")
+                self._announcement_end = time.monotonic()
+                finished = True
+        if finished:
+            self._wake_station_player()
+
+    def vol_change(self, up: bool, steps: int = 1):
+        self.volume.change(steps if up else -steps)
 
     def prev_next(self, is_next: bool):
         to_play = self.stations.prev_next(is_next=is_next)
         self.play_station(to_play)
 
-    def _play_stations(self):
-        while not self.exit:
-            # wait until a station has been queued
+    def step_station(self, steps: int, base: Optional[int] = None):
+        to_play = self.stations.step(steps, base=base)
+        self.play_station(to_play)
+
+    def _wake_station_player(self):
+        wake = self._station_wake
+        if wake is not None:
+            self.household.runtime.loop.call_soon_threadsafe(wake.set)
+
+    async def _play_stations(self):
+        """
+        Play each queued station once its announcement has finished, as a task on the household's loop. If another
+        station is queued in the meantime (i.e. further station skipping), it replaces this one and the wait starts
+        again.
+        """
+        self._station_wake = asyncio.Event()
+        while True:
+            # anything queued before this is seen below, so no wake up is missed
+            self._station_wake.clear()
+            with self._station_lock:
+                station, wait = self._queued_station, self._announcement_end - time.monotonic()
+                if station is not None and wait <= 0:
+                    self._queued_station = None
+                unknown = self._announcement_unknown
+            if station is not None and wait <= 0:
+                try:
+                    await self.call(self.play_uri, uri=station.uri, title=station.title)
+                except Exception as e:
+                    logger.error(f"Unable to play station {station}: {e}")
+                continue
+            # without events, the end of an announcement of unknown length has to be looked for
+            poll = (
+                station is not None and unknown
+                and not self.zone_state.is_live(self.master_zone.player_name, "avTransport")
+            )
+            timeout = None if station is None else min(wait, ANNOUNCEMENT_POLL_SECONDS) if poll else wait
             try:
-                station = self._station_queue.get(block=True, timeout=3)
-            except QueueEmpty:
+                await asyncio.wait_for(self._station_wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                if poll:
+                    await self._poll_announcement()
+
+    async def _poll_announcement(self):
+        """
+        Read the master zone's transport state, ending the wait for the announcement if it has stopped.
+        """
+        try:
+            info = await self.call(self.master_zone.get_current_transport_info)
+        except Exception as e:
+            logger.debug(f"Unable to check whether the announcement has finished: {e}")
+            return
+        state = info['current_transport_state']
+        with self._station_lock:
+            if state in PLAYING_STATES:
+                self._announcement_started = True
+            elif state == "STOPPED" and self._announcement_started:
+                logger.debug("Announcement finished")
+                self._announcement_end = time.monotonic()
+
+
+@dataclass(frozen=True)
+class Dispatch:
+    """
+    Which command each key, or code and terminal key, creates. Built from the registered command types, the commands
+    of plugins not yet loaded and the key map, and rebuilt and swapped in as a whole when the config is reloaded.
+    """
+    key_commands: Dict[str, Union[Type['KeyCommand'], PluginCommand]]
+    code_commands: Dict[str, Union[Type['CodeCommand'], PluginCommand]]
+    special_code_commands: Dict[Tuple[str, str], Union[Type['SpecialCodeCommand'], PluginCommand]]
+
+    @property
+    def terminals(self) -> FrozenSet[str]:
+        """Keys which end a code"""
+        return frozenset(self.code_commands) | {terminal for terminal, _ in self.special_code_commands}
+
+    @classmethod
+    def build(
+        cls, command_types: Iterable[Type['Command']], config: ConfigSnapshot, plugins: Iterable[PluginCommand] = ()
+    ) -> 'Dispatch':
+        """
+        Raises a ConfigError if two commands would share a key or code.
+        """
+        key_commands, code_commands, special_code_commands = {}, {}, {}
+        tables = {KEY: key_commands, CODE: code_commands, SPECIAL_CODE: special_code_commands}
+
+        def add(table: dict, trigger, command_type: Union[Type[Command], PluginCommand]):
+            if trigger is None or (isinstance(trigger, tuple) and trigger[0] is None):
+                # its key is unbound in the key map
+                return
+            if trigger in table:
+                raise ConfigError(f"{table[trigger].__name__} and {command_type.__name__} both use {trigger!r}")
+            table[trigger] = command_type
+
+        command_types = list(command_types)
+        for command_type in command_types:
+            if issubclass(command_type, KeyCommand):
+                add(key_commands, command_type.bound_key(config), command_type)
+            elif issubclass(command_type, CodeCommand):
+                add(code_commands, command_type.bound_key(config), command_type)
+            elif issubclass(command_type, SpecialCodeCommand):
+                trigger = (command_type.bound_key(config), command_type.bound_code(config))
+                add(special_code_commands, trigger, command_type)
+        # a plugin's commands replace their placeholders as its module is imported
+        loaded = {(command_type.__module__, command_type.__name__) for command_type in command_types}
+        for plugin in plugins:
+            if (plugin.module, plugin.name) in loaded:
                 continue
-            # sleep for 2 seconds to ensure the title announcement finishes
-            time.sleep(2)
-            # if the queue is still empty (i.e. no further station skipping has ocurred while the announcement was playing)
-            # play the station
-            if self._station_queue.empty():
-                self.play_uri(uri=station.uri, title=station.title)
-            # if the queue is non-empty, loop round again and try to play that station.
+            key, code = bound_trigger(plugin, config.key_map, config.codes)
+            add(tables[plugin.kind], (key, code) if plugin.kind == SPECIAL_CODE else key, plugin)
+        return cls(key_commands, code_commands, special_code_commands)
 
 
 class Command(ABC):
-    _key_commands = {}
-    _code_commands = {}
-    _special_code_commands = {}
+    # key, code and special code command types, in the order they were defined
+    _registered: List[Type['Command']] = []
+    # commands of plugins found at startup, which are imported when first used
+    _plugins: List[PluginCommand] = []
+    _dispatch = Dispatch({}, {}, {})
+
+    # Name of the KeyMap entry in the config setting this command's key (or terminal key), if it can be remapped. The
+    # command can't be entered while the entry is unbound.
+    binding: ClassVar[Optional[str]] = None
+    # Command types which this command replaces if they are still waiting to execute, and cancels if running
+    supersedes: ClassVar[Tuple[Type['Command'], ...]] = ()
+    # URGENT commands run on their own thread, ahead of any NORMAL commands
+    priority: ClassVar[int] = NORMAL
+    # Seconds after the key press after which the command is dropped rather than executed, or None to never drop it
+    deadline: ClassVar[Optional[float]] = DEFAULT_DEADLINE
+    # Seconds a plugin command may run before being cut off, if not the 'PluginTimeout' config. Ignored for built in
+    # commands.
+    timeout: ClassVar[Optional[float]] = None
+    # Timings of this command, from the key press which created it
+    trace = None
+    _cancelled = False
+    _future = None
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether the command has been cancelled. Long running commands should check this between steps.
+        """
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Cancel the command: if waiting it won't execute, if executing asynchronously it's interrupted, and if executing
+        synchronously it should stop at its next check of `cancelled`.
+        """
+        self._cancelled = True
+        if self._future is not None:
+            self._future.cancel()
+
+    def expired(self, now: float) -> bool:
+        if self.deadline is None or self.trace is None:
+            return False
+        return now - self.trace.marks['received'] > self.deadline
 
     @abstractmethod
     def execute(self, receiver: Receiver):
+        """
+        Carry out the command. The built in commands are defined with `async def`, so run on the household's event loop
+        and make blocking calls, e.g. to the speakers, with `await receiver.call(...)`, where cancelling the command
+        interrupts them. Plugin commands may also be plain functions, which run on the plugin pool.
+        """
         ...
 
+    def merge(self, newer: 'Command') -> Union['Command', object, None]:
+        """
+        Merge this command, which is waiting to execute, with a newer command queued directly after it.
+        Return a single command to replace both, CANCELLED if they cancel each other out, or None if they can't be
+        merged. Override to define merge rules for custom commands.
+        """
+        return None
+
+    @classmethod
+    def dispatch(cls) -> Dispatch:
+        """The current dispatch table"""
+        return Command._dispatch
+
+    @property
+    def is_plugin(self) -> bool:
+        """Whether this command is defined by a plugin, rather than socomote itself"""
+        return not type(self).__module__.startswith('socomote.')
+
     @classmethod
     def from_input(cls, key: str, code: Optional[str] = None) -> Optional['Command']:
-        if code is not None and (key, code) in cls._special_code_commands:
-            return cls._special_code_commands[(key, code)]()
-        elif code is not None and key in cls._code_commands:
-            return cls._code_commands[key](code)
-        elif code is None and key in cls._key_commands:
-            return cls._key_commands[key]()
+        dispatch = cls.dispatch()
+        if code is not None and (key, code) in dispatch.special_code_commands:
+            return _create(dispatch.special_code_commands[(key, code)])
+        elif code is not None and key in dispatch.code_commands:
+            return _create(dispatch.code_commands[key], code)
+        elif code is None and key in dispatch.key_commands:
+            return _create(dispatch.key_commands[key])
         logger.error(f"Unable to construct command from key='{key}', code='{code}'")
 
+    @classmethod
+    def _register(cls):
+        """
+        Add the command type to the dispatch table. Raises a ConfigError if its key or code is already used.
+        """
+        registered = Command._registered + [cls]
+        Command._dispatch = Dispatch.build(registered, LIVE_CONFIG.snapshot, Command._plugins)
+        Command._registered = registered
+
+    @classmethod
+    def bound_key(cls, config: ConfigSnapshot) -> Optional[str]:
+        raise NotImplementedError
+
+
+def _create(command_type: Union[Type[Command], PluginCommand], *args) -> Command:
+    if isinstance(command_type, PluginCommand):
+        return LoadPlugin(command_type, *args)
+    return command_type(*args)
+
+
+def _rebind(config: ConfigSnapshot):
+    Command._dispatch = Dispatch.build(Command._registered, config, Command._plugins)
+    Keys.apply(config.key_map)
+    rebind_evdev_keys()
+
+
+# rebuild the dispatch table when the key map or codes change, rejecting a config which would leave keys clashing
+LIVE_CONFIG.add_validator(lambda config: Dispatch.build(Command._registered, config, Command._plugins))
+LIVE_CONFIG.add_listener(_rebind)
+
 
 class KeyCommand(Command):
     key: ClassVar[str]
 
+    @classmethod
+    def bound_key(cls, config: ConfigSnapshot) -> Optional[str]:
+        return config.key_map.get(cls.binding) if cls.binding else cls.key
+
     def __init_subclass__(cls, **kwargs):
-        if cls.key in cls._key_commands:
-            raise Exception(f"KeyCommand {cls._key_commands[cls.key]} already registered for key {cls.key}")
-        cls._key_commands[cls.key] = cls
+        cls._register()
 
 
 @dataclass
@@ -175,141 +595,239 @@ class CodeCommand(Command):
     def int_code(self) -> int:
         return int(self.code)
 
+    @classmethod
+    def bound_key(cls, config: ConfigSnapshot) -> Optional[str]:
+        return config.key_map.get(cls.binding) if cls.binding else cls.terminal
+
     def __init_subclass__(cls, **kwargs):
-        if cls.terminal in cls._code_commands:
-            raise Exception(
-                f"CodeCommand {cls._code_commands[cls.terminal]} already registered for terminal {cls.terminal}"
-            )
-        cls._code_commands[cls.terminal] = cls
+        cls._register()
 
 
 class SpecialCodeCommand(Command):
     terminal: ClassVar[str]
     code: ClassVar[str]
+    # Name of the entry in the config's Codes setting this command's code, if it can be changed
+    code_binding: ClassVar[Optional[str]] = None
+
+    @classmethod
+    def bound_key(cls, config: ConfigSnapshot) -> Optional[str]:
+        return config.key_map.get(cls.binding) if cls.binding else cls.terminal
+
+    @classmethod
+    def bound_code(cls, config: ConfigSnapshot) -> str:
+        return config.codes[cls.code_binding] if cls.code_binding else cls.code
 
     def __init_subclass__(cls, **kwargs):
-        if (cls.terminal, cls.code) in cls._special_code_commands:
-            raise Exception(
-                f"SpecialCodeCommand {cls._special_code_commands[(cls.terminal, cls.code)]} "
-                f"already registered for terminal={cls.terminal}, code={cls.code}"
-            )
-        cls._special_code_commands[(cls.terminal, cls.code)] = cls
+        cls._register()
 
 
 @dataclass
 class PlayPause(KeyCommand):
     key = Keys.PLAY_PAUSE
+    binding = "PLAY_PAUSE"
 
-    def execute(self, receiver: Receiver):
-        receiver.take_control()
-        curr_info = receiver.master_zone.get_current_track_info()
-        position = curr_info['position']
-        logger.debug(f"Current position is {repr(position)}")
-        if position is None or position == '' or position == '0:00:00':
-            logger.debug(f"Currently paused, playing")
-            receiver.master_zone.play()
-        else:
+    async def execute(self, receiver: Receiver):
+        await receiver.call(receiver.take_control)
+        transport_state = await receiver.call(receiver.zone_state.transport_state, receiver.master_zone)
+        logger.debug(f"Current transport state is {repr(transport_state)}")
+        if transport_state in PLAYING_STATES:
             logger.debug(f"Currently playing, pausing")
-            receiver.master_zone.pause()
+            await receiver.call(receiver.master_zone.pause)
+            transport_state = "PAUSED_PLAYBACK"
+        else:
+            logger.debug(f"Currently paused, playing")
+            await receiver.call(receiver.master_zone.play)
+            transport_state = "PLAYING"
+        receiver.zone_state.update(receiver.master_zone.player_name, transport_state=transport_state)
+
+
+class VolumeCommand(Command):
+    """
+    Base for commands changing the volume by a number of increments. Consecutive volume commands merge into a
+    single net change.
+    """
+    steps: int
+    priority = URGENT
+    # a volume change arriving long after the key press would be a surprise
+    deadline = 3.0
+
+    async def execute(self, receiver: Receiver):
+        await receiver.call(receiver.volume.change, self.steps)
+
+    def merge(self, newer: Command):
+        if not isinstance(newer, VolumeCommand):
+            return None
+        steps = self.steps + newer.steps
+        return VolChange(steps) if steps else CANCELLED
 
 
 @dataclass
-class VolUp(KeyCommand):
+class VolUp(VolumeCommand, KeyCommand):
     key = Keys.UP
-
-    def execute(self, receiver: Receiver):
-        receiver.vol_change(up=True)
+    steps: ClassVar[int] = 1
 
 
 @dataclass
-class VolDown(KeyCommand):
+class VolDown(VolumeCommand, KeyCommand):
     key = Keys.DOWN
+    steps: ClassVar[int] = -1
 
-    def execute(self, receiver: Receiver):
-        receiver.vol_change(up=False)
+
+@dataclass
+class VolChange(VolumeCommand):
+    """
+    Net change of several volume commands.
+    """
+    steps: int
 
 
 @dataclass
 class ToggleMute(KeyCommand):
     key = Keys.MUTE
+    binding = "MUTE"
+    priority = URGENT
+    deadline = 3.0
+
+    async def execute(self, receiver: Receiver):
+        mute = not await receiver.call(receiver.zone_state.mute, receiver.master_zone)
+        await receiver.call(setattr, receiver.master_zone, 'mute', mute)
+        receiver.zone_state.update(receiver.master_zone.player_name, mute=mute)
+
+    def merge(self, newer: Command):
+        return CANCELLED if isinstance(newer, ToggleMute) else None
+
+
+class StationCommand(Command):
+    """
+    Base for commands selecting a station. Selecting a specific station supersedes any station commands still
+    waiting, and skipping merges with the station command before it into a single step.
+    """
+
+    def merge(self, newer: Command):
+        if not isinstance(newer, StepCommand):
+            return None
+        base, steps = self.step_from()
+        steps += newer.steps
+        if base is None and steps == 0:
+            return CANCELLED
+        return StepStation(steps=steps, base=base)
+
+    def step_from(self) -> Tuple[Optional[int], int]:
+        """
+        Return (base station number, steps) equivalent to this command, where a base of None means the current station.
+        """
+        raise NotImplementedError
 
-    def execute(self, receiver: Receiver):
-        receiver.master_zone.mute = not receiver.master_zone.mute
+
+class StepCommand(StationCommand):
+    steps: int
+
+    async def execute(self, receiver: Receiver):
+        await receiver.call(receiver.step_station, self.steps)
+
+    def step_from(self) -> Tuple[Optional[int], int]:
+        return None, self.steps
 
 
 @dataclass
-class SelectStation(CodeCommand):
+class SelectStation(StationCommand, CodeCommand):
     terminal = Keys.ENTER
+    supersedes = (StationCommand,)
 
-    def execute(self, receiver: Receiver):
+    async def execute(self, receiver: Receiver):
         station = receiver.stations.select_station(self.int_code)
-        receiver.play_station(station)
+        await receiver.call(receiver.play_station, station)
+
+    def step_from(self) -> Tuple[Optional[int], int]:
+        return self.int_code, 0
 
 
 @dataclass
-class ShuffleStation(KeyCommand):
+class ShuffleStation(StationCommand, KeyCommand):
     key = Keys.SHUFFLE
+    binding = "SHUFFLE"
+    supersedes = (StationCommand,)
 
-    def execute(self, receiver: Receiver):
-        station = random.choice(receiver.stations)
+    async def execute(self, receiver: Receiver):
+        station = receiver.stations.random()
         logger.info(f"Playing random station: {station}")
-        receiver.play_station(station)
+        await receiver.call(receiver.play_station, station)
+
+    def merge(self, newer: Command):
+        # the station chosen isn't known until execution, so can't be stepped from
+        return None
 
 
 @dataclass
-class NextStation(KeyCommand):
+class NextStation(StepCommand, KeyCommand):
     key = Keys.RIGHT
-
-    def execute(self, receiver: Receiver):
-        receiver.prev_next(is_next=True)
+    steps: ClassVar[int] = 1
 
 
 @dataclass
-class PrevStation(KeyCommand):
+class PrevStation(StepCommand, KeyCommand):
     key = Keys.LEFT
+    steps: ClassVar[int] = -1
 
-    def execute(self, receiver: Receiver):
-        receiver.prev_next(is_next=False)
+
+@dataclass
+class StepStation(StepCommand):
+    """
+    Net change of several station skips, optionally from a given station rather than the current one.
+    """
+    steps: int
+    base: Optional[int] = None
+
+    async def execute(self, receiver: Receiver):
+        await receiver.call(receiver.step_station, self.steps, base=self.base)
+
+    def step_from(self) -> Tuple[Optional[int], int]:
+        return self.base, self.steps
 
 
 @dataclass
 class NextTrack(KeyCommand):
     key = Keys.NEXT_TRACK
+    binding = "NEXT_TRACK"
 
-    def execute(self, receiver: Receiver):
-        receiver.take_control()
-        receiver.master_zone.next()
+    async def execute(self, receiver: Receiver):
+        await receiver.call(receiver.take_control)
+        await receiver.call(receiver.master_zone.next)
 
 
 @dataclass
 class PrevTrack(KeyCommand):
     key = Keys.PREV_TRACK
+    binding = "PREV_TRACK"
 
-    def execute(self, receiver: Receiver):
-        receiver.take_control()
-        receiver.master_zone.previous()
+    async def execute(self, receiver: Receiver):
+        await receiver.call(receiver.take_control)
+        await receiver.call(receiver.master_zone.previous)
 
 
 @dataclass
 class Announce(KeyCommand):
     key = Keys.ANNOUNCE
+    binding = "ANNOUNCE"
 
-    def execute(self, receiver: Receiver):
+    async def execute(self, receiver: Receiver):
         # If currently playing a station, re-play it, as this will announce the title
         # then immediately restart.
         # Can't easily implement for other media types as e.g. soco can't play streaming service URIs
-        current = receiver.current_station()
+        current = await receiver.call(receiver.current_station)
         if current is not None:
-            receiver.play_station(current)
+            await receiver.call(receiver.play_station, current)
 
 
 @dataclass
 class SelectGroup(CodeCommand):
     terminal = Keys.GROUP
+    binding = "GROUP"
 
-    def execute(self, receiver: Receiver):
-        receiver.take_control()
-        current_slaves = {s.player_name for s in receiver.master_zone.group if s != receiver.master_zone}
+    async def execute(self, receiver: Receiver):
+        master_name = receiver.master_zone.player_name
+        members = await receiver.call(receiver.zone_state.members, receiver.master_zone)
+        current_slaves = {s for s in members if s != master_name}
         if self.int_code == 1:
             # reserved for the group just containing the master zone
             target_slaves = set()
@@ -317,32 +835,35 @@ class SelectGroup(CodeCommand):
             # reserved for all available zones
             target_slaves = {name for name in ZONES if name != receiver.master_zone.player_name}
         else:
-            target_slaves = set(CONFIG['Zones'][receiver.master_zone.player_name]['Groups'][self.int_code])
+            target_slaves = set(LIVE_CONFIG.snapshot.group(receiver.master_zone.player_name, self.int_code))
         if target_slaves != current_slaves:
             logger.info(f"Grouping with target slaves {target_slaves}. (Current slaves are: {current_slaves}")
-            released_slaves = current_slaves - target_slaves
-            new_slaves = target_slaves - current_slaves
-            for slave in released_slaves:
-                ZONES[slave].unjoin()
-            for slave in new_slaves:
-                ZONES[slave].join(receiver.master_zone)
+            await receiver.call(receiver.regroup, target_slaves, cancelled=lambda: self.cancelled)
         else:
             logger.info(f"Target slaves {target_slaves} are equivalent to the existing slaves.")
+            # still ensure the master is the coordinator
+            await receiver.call(receiver.take_control)
+
+
+# a newer group selection replaces one which is waiting or still running
+SelectGroup.supersedes = (SelectGroup,)
 
 
 @dataclass
 class SetMaster(CodeCommand):
     terminal = Keys.ZONE
+    binding = "ZONE"
 
-    def execute(self, receiver: Receiver):
+    async def execute(self, receiver: Receiver):
         # Retrieve the new controller
-        controller: SoCo
-        for name, zone in CONFIG['Zones'].items():
-            if zone['Index'] == self.int_code:
-                controller = ZONES[name]
-                break
-        else:
+        name = LIVE_CONFIG.snapshot.zone_with_index(self.int_code)
+        if name is None:
             raise Exception(f"No zone with index {self.int_code}")
+        if not ZONE_HEALTH.available(name):
+            # it may have moved, in which case it'll be available once found
+            ZONE_HEALTH.resolve_soon(name)
+            raise ZoneUnavailable(f"Zone {name} is unavailable, not making it the master zone")
+        controller: SoCo = await receiver.call(ZONES.__getitem__, name)
 
         if controller.player_name != receiver.master_zone.player_name:
             logger.info(f"Setting master zone to {controller.player_name}")
@@ -351,54 +872,222 @@ class SetMaster(CodeCommand):
             with SOCOMOTE_MASTER_ZONE_FILE.open('w') as f:
                 f.write(dump({"MasterZone": MASTER_ZONE}))
             receiver.master_zone = controller
-            receiver.take_control()
-            receiver.speak("Socomote hello!")
+            await receiver.call(receiver.take_control)
+            await receiver.call(receiver.speak, HELLO)
+
+
+@dataclass
+class PlayScene(CodeCommand):
+    """
+    Set up the master zone's group as described by a numbered scene in the config. The changes run as a plan, each as
+    soon as what it depends on is done: regrouping, each zone's volume and mute all run at once, and the station, which
+    needs the master to be in control of the group, starts as soon as regrouping has finished.
+    """
+    terminal = Keys.SCENE
+    binding = "SCENE"
+
+    async def execute(self, receiver: Receiver):
+        scene = LIVE_CONFIG.snapshot.scenes.get(self.int_code)
+        if scene is None:
+            raise Exception(f"No scene {self.int_code}")
+        logger.info(f"Setting up scene {scene.name}")
+        start = time.monotonic()
+        members = None
+        if scene.mute is not None and scene.group is None:
+            # the group the mute applies to is the master's current one
+            members = await receiver.call(receiver.zone_state.members, receiver.master_zone)
+        finished = await run_plan(self.steps(scene, receiver, members), receiver.call)
+        seconds = time.monotonic() - start
+        METRICS.observe('scene_seconds', seconds, scene=scene.name)
+        steps = ", ".join(f"{name} {at:.2f}s" for name, at in finished.items())
+        logger.info(f"Scene {scene.name} set up in {seconds:.2f}s ({steps or 'nothing to change'})")
+
+    def steps(self, scene: Scene, receiver: Receiver, members: Optional[FrozenSet[str]] = None) -> List[Step]:
+        """
+        :param members: the master's current group, which is muted or unmuted if the scene doesn't regroup it.
+        """
+        master_name = receiver.master_zone.player_name
+        steps = []
+        after_group = ()
+        if scene.group is not None:
+            steps.append(Step("group", partial(self._regroup, receiver, scene.group)))
+            after_group = ("group",)
+            members = scene.group | {master_name}
+        # volume and mute are always set, rather than skipped if the zone state says they're in place already, as it
+        # may be out of date, and setting them again is harmless
+        for name, volume in scene.volumes.items():
+            steps.append(Step(f"volume {name}", partial(self._set_volume, receiver, name, volume)))
+        if scene.mute is not None:
+            for name in sorted(members or {master_name}):
+                steps.append(Step(f"mute {name}", partial(self._set_mute, receiver, name, scene.mute)))
+        if scene.station is not None:
+            steps.append(Step("station", partial(self._play_station, receiver, scene.station), after=after_group))
+        return steps
+
+    def _regroup(self, receiver: Receiver, group: FrozenSet[str]):
+        result = receiver.regroup(group, cancelled=lambda: self.cancelled)
+        if not result.members:
+            raise Exception(f"Unable to take control of the group: {result}")
+        if not result.ok:
+            logger.warning(f"Scene group only partly set up: {result}")
+
+    @staticmethod
+    def _set_volume(receiver: Receiver, name: str, volume: int):
+        ZONES[name].volume = volume
+        receiver.zone_state.update(name, volume=volume)
+
+    @staticmethod
+    def _set_mute(receiver: Receiver, name: str, mute: bool):
+        ZONES[name].mute = mute
+        receiver.zone_state.update(name, mute=mute)
+
+    @staticmethod
+    def _play_station(receiver: Receiver, number: int):
+        receiver.play_station(receiver.stations.select_station(number))
+
+
+# a newer scene replaces a scene or group selection which is waiting or still running
+PlayScene.supersedes = (PlayScene, SelectGroup)
 
 
 @dataclass
 class Exit(SpecialCodeCommand):
     terminal = Keys.ENTER
-    code = EXIT_CODE
+    code = LIVE_CONFIG.snapshot.codes['EXIT']
+    code_binding = 'EXIT'
+    priority = URGENT
+    deadline = None
 
-    def execute(self, receiver: Receiver):
+    async def execute(self, receiver: Receiver):
         logger.info("Exiting.")
         receiver.exit = True
 
 
+@dataclass
+class LoadPlugin(Command):
+    """
+    A plugin command whose module hasn't been imported yet. Imports the module, as a plugin command so a slow or broken
+    import is cut off like any other, then executes the command.
+    """
+    plugin: PluginCommand
+    code: Optional[str] = None
+    _command: Optional[Command] = None
+
+    @property
+    def is_plugin(self) -> bool:
+        return True
+
+    def cancel(self):
+        super().cancel()
+        if self._command is not None:
+            self._command.cancel()
+
+    def execute(self, receiver: Receiver):
+        command_type = PLUGINS.command_type(self.plugin)
+        self._command = command_type(self.code) if self.plugin.kind == CODE else command_type()
+        if self.cancelled:
+            self._command.cancel()
+        return self._command.execute(receiver)
+
+    def __str__(self):
+        return f"{self.plugin.name} (loading {self.plugin.module})"
+
+
 class CommandExecutor:
 
-    def __init__(self, receiver: Receiver):
+    def __init__(self, receiver: Receiver, key_input: Optional[KeyInput] = None):
         self.receiver = receiver
+        self._input = key_input
         self._exit = False
-        self._queue: Queue[Command] = Queue()
-        self._queued_station: Optional[Station] = None
-        self._execution_thread = Thread(target=self._execute_commands)
+        self._queues = {URGENT: CoalescingQueue(), NORMAL: CoalescingQueue()}
+        # the command currently executing for each priority
+        self._running: Dict[int, Optional[Command]] = {priority: None for priority in self._queues}
+        # counted by both execution threads and the input thread, so only changed with _count_cancelled
+        self.cancelled = 0
+        self._cancelled_lock = Lock()
+        METRICS.gauge(
+            'commands_coalesced', lambda: sum(q.saved for q in self._queues.values()), receiver=receiver.name
+        )
+        METRICS.gauge(
+            'commands_expired', lambda: sum(q.expired for q in self._queues.values()), receiver=receiver.name
+        )
+        METRICS.gauge('commands_cancelled', lambda: self.cancelled, receiver=receiver.name)
+        # one per priority, taking commands off its queue in order and waiting for each to finish on the loop
+        self._execution_threads = {
+            priority: Thread(
+                target=self._execute_commands,
+                args=(priority,),
+                name=f"{receiver.name}-{'urgent' if priority == URGENT else 'commands'}",
+                daemon=True,
+            )
+            for priority in self._queues
+        }
 
     def run(self):
-        self._execution_thread.start()
+        for thread in self._execution_threads.values():
+            thread.start()
         for command in self.commands():
-            if self._queue.qsize() > 3:
-                logger.info(f"Could not add {command} to queue, queue full. Discarding.")
-                continue
             if isinstance(command, Exit):
-                # Set the flag in the main thread so we don't hit a subsequent call to getkey
+                # Set the flag in the main thread so we don't read another key
                 self._exit = True
-            self._queue.put(command)
-        logger.debug("Waiting for execution thread to exit.")
-        self._execution_thread.join()
-        logger.debug("Done.")
+            self._cancel_superseded(command)
+            if not self._queues[command.priority].put(command, force=isinstance(command, Exit)):
+                logger.info(f"Could not add {command} to queue, queue full. Discarding.")
+                METRICS.incr('commands_discarded_total')
+            elif command.trace is not None:
+                command.trace.mark('queued')
+        self._input.close()
+        self._shutdown()
+        logger.info(
+            f"Done. Coalescing saved {sum(q.saved for q in self._queues.values())} commands, "
+            f"{sum(q.expired for q in self._queues.values())} expired and {self.cancelled} were cancelled."
+        )
+
+    def _cancel_superseded(self, command: Command):
+        for running in list(self._running.values()):
+            if running is not None and command.supersedes and isinstance(running, command.supersedes):
+                logger.info(f"{command} supersedes running {running}, cancelling it")
+                running.cancel()
+
+    def _shutdown(self):
+        """
+        Stop executing commands once Exit has run: waiting normal commands are dropped and a running one is cancelled,
+        which interrupts it at once as commands run on the loop. Threads still stuck after EXIT_TIMEOUT (only
+        possible for a plain plugin command ignoring `cancelled`) are abandoned.
+        """
+        dropped = self._queues[NORMAL].clear()
+        if dropped:
+            logger.info(f"Exiting, dropping {len(dropped)} waiting commands: {dropped}")
+            self._count_cancelled(len(dropped))
+        running = self._running[NORMAL]
+        if running is not None:
+            logger.info(f"Exiting, cancelling running {running}")
+            running.cancel()
+        for queue in self._queues.values():
+            queue.close()
+        logger.debug("Waiting for execution threads to exit.")
+        deadline = time.monotonic() + EXIT_TIMEOUT
+        for priority, thread in self._execution_threads.items():
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                logger.warning(f"Abandoning {self._running[priority]}, still running after {EXIT_TIMEOUT}s")
 
     def commands(self) -> Iterable[Command]:
+        if self._input is None:
+            self._input = open_input()
+        STARTUP.ready()
         digit_buffer = ''
         while not self._exit:
             logger.debug("Getting key")
-            key = getkey()
-            logger.debug(f"Received {repr(key)}")
+            event = self._input.read()
+            key = event.key
+            trace = CommandTrace(received=event.time)
+            logger.debug(f"Received {repr(key)} ({event.action} from {event.device})")
             cmd = None
             if key.isdigit():
                 digit_buffer += key
                 logger.debug(f"Added {repr(key)} to buffer. Buffer is now {repr(digit_buffer)}.")
-            elif key in Keys.TERMINALS and digit_buffer != '':
+            elif key in Command.dispatch().terminals and digit_buffer != '':
                 logger.debug(f"Received terminal key {key}. Handling buffer.")
                 cmd = Command.from_input(key, digit_buffer)
                 digit_buffer = ''
@@ -410,13 +1099,96 @@ class CommandExecutor:
                 # This is intentional as terminal keys may be re-used as key commands (e.g. SETUP as QUERY by default)
                 cmd = Command.from_input(key)
             if cmd is not None:
+                cmd.trace = trace
                 yield cmd
 
-    def _execute_commands(self):
-        while not self._exit:
-            command = self._queue.get()
+    def _execute_commands(self, priority: int):
+        queue = self._queues[priority]
+        while True:
+            command = queue.get()
+            if command is None:
+                return
+            if command.cancelled:
+                logger.info(f"Dropping cancelled command {command}")
+                self._count_cancelled()
+                continue
+            self._running[priority] = command
             logger.info(f"Executing command {command}")
+            trace = command.trace or CommandTrace()
+            METRICS.start_command(type(command).__name__, trace)
+            failed = False
             try:
-                command.execute(self.receiver)
+                if command.is_plugin:
+                    failed = not self._execute_plugin(command)
+                else:
+                    self._execute(command)
+            except CancelledError:
+                logger.info(f"Cancelled command {command}")
             except BaseException as e:
+                failed = True
                 logging.error(f"Unhandled exception executing command {command}: {e}")
+            finally:
+                self._running[priority] = None
+                if command.cancelled:
+                    self._count_cancelled()
+                METRICS.finish_command(trace, failed=failed)
+
+    def _count_cancelled(self, n: int = 1):
+        with self._cancelled_lock:
+            self.cancelled += n
+
+    def _execute(self, command: Command):
+        result = command.execute(self.receiver)
+        if inspect.isawaitable(result):
+            command._future = self.receiver.household.runtime.submit(result)
+            if command.cancelled:
+                command._future.cancel()
+            command._future.result()
+
+    def _execute_plugin(self, command: Command) -> bool:
+        """
+        Execute a plugin command on the household's plugin pool, cutting it off if it runs past its timeout.
+        Returns whether it finished in time.
+        """
+        timeout = command.timeout or LIVE_CONFIG.snapshot.raw.get('PluginTimeout', PLUGIN_TIMEOUT)
+        future = self.receiver.household.plugin_pool.submit(self._execute, command)
+        try:
+            future.result(timeout)
+            return True
+        except FutureTimeoutError:
+            # an async command is interrupted, a sync one should stop at its next check of `cancelled`, otherwise it
+            # keeps its plugin worker until it returns
+            future.cancel()
+            command.cancel()
+            METRICS.incr('plugin_timeouts_total', command=type(command).__name__)
+            logger.error(f"Plugin command {command} cut off after running for {timeout}s")
+            return False
+
+
+# Imports plugin modules as their commands are first used
+PLUGINS = PluginLoader()
+
+
+def load_plugins():
+    """
+    Find the plugins in SOCOMOTE_HOME, adding their commands to the dispatch table to be imported on first use.
+    Plugins which can't be loaded lazily are imported now.
+    """
+    for module in discover_plugins(SOCOMOTE_HOME):
+        if module.eager:
+            try:
+                PLUGINS.load(module.name)
+            except ImportError:
+                pass
+            continue
+        plugins = Command._plugins + module.commands
+        try:
+            Command._dispatch = Dispatch.build(Command._registered, LIVE_CONFIG.snapshot, plugins)
+        except ConfigError as e:
+            logger.error(f"Not loading plugin {module.name}: {e}")
+            continue
+        Command._plugins = plugins
+        logger.info(f"Found plugin {module.name}: {', '.join(command.name for command in module.commands)}")
+
+
+load_plugins()
@@ -0,0 +1,56 @@
+import logging
+from contextlib import ExitStack
+from threading import Thread
+from typing import Dict, List, Union
+
+from socomote.config import ZONES
+from socomote.core import Household, Receiver
+from socomote.inputs import open_input
+
+logger = logging.getLogger(__name__)
+
+
+class Daemon:
+    """
+    Runs a receiver for each of several master zones in one process, each reading keys from its own input devices.
+
+    The receivers share a single `Household`, so there is one zone state cache, one station list and one announcement
+    server however many zones are controlled. Each receiver executes its commands on its own threads, so a slow
+    command for one zone doesn't delay the others.
+    """
+
+    def __init__(self, bindings: Dict[str, Union[str, List[str]]]):
+        """
+        :param bindings: master zone name -> input device(s) to read its keys from, see `inputs.open_input`.
+        """
+        if not bindings:
+            raise ValueError("No remotes configured")
+        zones = {name: ZONES[name] for name in bindings}
+        self.household = Household(station_zone=next(iter(zones.values())))
+        self.receivers: List[Receiver] = [
+            Receiver(zone, household=self.household, key_input=open_input(bindings[name]), name=name)
+            for name, zone in zones.items()
+        ]
+
+    def run(self):
+        with ExitStack() as stack:
+            stack.enter_context(self.household)
+            for receiver in self.receivers:
+                stack.enter_context(receiver)
+            threads = [
+                Thread(target=self._run_receiver, args=(receiver,), name=receiver.name, daemon=True)
+                for receiver in self.receivers
+            ]
+            for thread in threads:
+                thread.start()
+            logger.info(f"Running receivers for {[r.name for r in self.receivers]}")
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _run_receiver(receiver: Receiver):
+        try:
+            receiver.run()
+        except Exception as e:
+            logger.error(f"Receiver {receiver.name} failed: {e}")
+        logger.info(f"Receiver {receiver.name} exited")
@@ -0,0 +1,180 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, FrozenSet, List, Mapping, Optional, Tuple, Iterable
+
+from soco import SoCo
+
+from socomote.zone_state import ZoneStateCache
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on concurrent join/unjoin calls
+MAX_WORKERS = 8
+# Per-zone timeout in seconds for each join/unjoin call
+ZONE_TIMEOUT = 5.0
+
+UNJOIN = "unjoin"
+JOIN = "join"
+
+
+@dataclass(frozen=True)
+class GroupPlan:
+    """
+    The topology changes needed to turn the master zone's current group into the target group.
+
+    The plan runs in two phases, each of which may be run in parallel:
+     1. `unjoin` - zones to make standalone, which includes the master if it is not currently the coordinator.
+     2. `join` - zones to join to the master.
+    """
+    master: str
+    target: FrozenSet[str]
+    unjoin: FrozenSet[str] = frozenset()
+    join: FrozenSet[str] = frozenset()
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.unjoin and not self.join
+
+    @property
+    def phases(self) -> Tuple[Tuple[str, FrozenSet[str]], ...]:
+        return tuple((action, zones) for action, zones in ((UNJOIN, self.unjoin), (JOIN, self.join)) if zones)
+
+
+def plan_regroup(master: str, coordinator: str, members: Iterable[str], target_slaves: Iterable[str]) -> GroupPlan:
+    """
+    Compute the minimal set of join / unjoin calls to take the master zone from its current group (described by
+    `coordinator` and `members`) to a group coordinated by the master containing exactly `target_slaves`.
+    """
+    members = frozenset(members) - {master}
+    target = frozenset(target_slaves) - {master}
+    if coordinator == master:
+        return GroupPlan(master=master, target=target, unjoin=members - target, join=target - members)
+    # The master has to leave its group to become a coordinator. Zones in the old group which aren't wanted are
+    # released, and everything in the target joins the master directly - joining works from any group.
+    return GroupPlan(master=master, target=target, unjoin=(members - target) | {master}, join=target)
+
+
+@dataclass(frozen=True)
+class ZoneResult:
+    zone: str
+    action: str
+    duration: float
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class RegroupResult:
+    plan: GroupPlan
+    results: List[ZoneResult] = field(default_factory=list)
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return all(r.ok for r in self.results)
+
+    @property
+    def failed(self) -> List[ZoneResult]:
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def members(self) -> FrozenSet[str]:
+        """The zones which ended up in the master's group"""
+        # joins which failed or weren't made, e.g. as the regroup was cancelled
+        not_joined = self.plan.join - {r.zone for r in self.results if r.action == JOIN and r.ok}
+        failed_unjoins = {r.zone for r in self.failed if r.action == UNJOIN}
+        if self.plan.master in failed_unjoins:
+            # the master couldn't leave its old group, so none of the joins are meaningful
+            return frozenset()
+        return (self.plan.target - not_joined) | failed_unjoins | {self.plan.master}
+
+    def __str__(self):
+        summary = f"{len(self.results)} calls in {self.duration:.2f}s"
+        if self.failed:
+            summary += ", failed: " + ", ".join(f"{r.action} {r.zone} ({r.error})" for r in self.failed)
+        return summary
+
+
+class Regrouper:
+    """
+    Applies group plans by running the independent join / unjoin calls of each phase on a bounded worker pool.
+    """
+
+    def __init__(self, zones: Mapping[str, SoCo], max_workers: int = MAX_WORKERS, timeout: float = ZONE_TIMEOUT):
+        self._zones = zones
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="regroup")
+        self.timeout = timeout
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def regroup(
+        self,
+        master: SoCo,
+        target_slaves: Iterable[str],
+        zone_state: ZoneStateCache,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> RegroupResult:
+        """
+        Group the given slaves with the master as coordinator, using the zone state cache to find the current group,
+        and recording the resulting group back into the cache.
+        """
+        master_name = master.player_name
+        plan = plan_regroup(
+            master=master_name,
+            coordinator=zone_state.coordinator(master),
+            members=zone_state.members(master),
+            target_slaves=target_slaves,
+        )
+        result = self.execute(plan, cancelled=cancelled)
+        if not plan.is_empty:
+            for r in result.results:
+                if r.action == UNJOIN and r.ok and r.zone != master_name:
+                    zone_state.set_group(r.zone, frozenset())
+            if result.members:
+                zone_state.set_group(master_name, result.members)
+        return result
+
+    def execute(self, plan: GroupPlan, cancelled: Optional[Callable[[], bool]] = None) -> RegroupResult:
+        """
+        Run the plan's phases in order, checking `cancelled` (if given) before each.
+        """
+        result = RegroupResult(plan=plan)
+        if plan.is_empty:
+            return result
+        master = self._zones[plan.master]
+        start = time.monotonic()
+        for action, zones in plan.phases:
+            if cancelled is not None and cancelled():
+                logger.info(f"Regrouping {plan.master} cancelled before {action} of {sorted(zones)}")
+                break
+            if action == JOIN and plan.master in {r.zone for r in result.failed}:
+                logger.error(f"Master {plan.master} could not leave its group, not joining {sorted(zones)}")
+                break
+            # each call is made in a copy of the caller's context, so it's timed as part of the command making it
+            futures = [
+                self._pool.submit(contextvars.copy_context().run, self._run, action, name, master) for name in zones
+            ]
+            result.results.extend(f.result() for f in futures)
+        result.duration = time.monotonic() - start
+        log = logger.error if result.failed else logger.info
+        log(f"Regrouped {plan.master} with {sorted(plan.target)}: {result}")
+        return result
+
+    def _run(self, action: str, name: str, master: SoCo) -> ZoneResult:
+        start = time.monotonic()
+        try:
+            zone = self._zones[name]
+            if action == JOIN:
+                zone.join(master, timeout=self.timeout)
+            else:
+                zone.unjoin(timeout=self.timeout)
+        except Exception as e:
+            return ZoneResult(zone=name, action=action, duration=time.monotonic() - start, error=e)
+        return ZoneResult(zone=name, action=action, duration=time.monotonic() - start)
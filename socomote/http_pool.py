@@ -0,0 +1,139 @@
+import logging
+from threading import Lock
+from typing import Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from socomote.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a speaker on the local network to accept a connection, and then to respond
+SPEAKER_TIMEOUT = (2.0, 10.0)
+# Seconds to wait for an internet service to accept a connection, and then to respond
+INTERNET_TIMEOUT = (5.0, 30.0)
+# Number of hosts to keep connections open to
+SPEAKER_HOSTS = 32
+INTERNET_HOSTS = 4
+# Idle connections kept open per host. More may be opened at once, but are closed after use.
+CONNECTIONS_PER_HOST = 4
+
+Timeout = Union[None, float, Tuple[float, float]]
+
+
+class ConnectionPool:
+    """
+    A requests session keeping connections to each host open between requests, so a burst of requests to the same
+    host only pays for one TCP (and TLS) handshake. Counts requests and new connections per host, exposed as the
+    `http_requests_total` and `http_connections_total` metrics, so connection reuse can be checked.
+    """
+
+    def __init__(self, name: str, timeout: Tuple[float, float], hosts: int, per_host: int = CONNECTIONS_PER_HOST):
+        """
+        :param timeout: default (connect, read) timeouts in seconds. A single timeout given to a request is only used
+        as its read timeout, so a host which is down is always given up on after the connect timeout.
+        """
+        self.name = name
+        self.timeout = timeout
+        self.requests = 0
+        self.connections = 0
+        self._lock = Lock()
+        self.session = requests.Session()
+        adapter = _CountingAdapter(self, pool_connections=hosts, pool_maxsize=per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def reused(self) -> int:
+        """Number of requests sent over an already open connection"""
+        return max(0, self.requests - self.connections)
+
+    def request(self, method: str, url: str, timeout: Timeout = None, **kwargs) -> requests.Response:
+        if timeout is None:
+            timeout = self.timeout
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.timeout[0], timeout), timeout)
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def _sent(self, host: str):
+        with self._lock:
+            self.requests += 1
+        METRICS.incr('http_requests_total', pool=self.name, host=host)
+
+    def _connected(self, host: str):
+        with self._lock:
+            self.connections += 1
+        METRICS.incr('http_connections_total', pool=self.name, host=host)
+        logger.debug(f"Opened connection {self.connections} of the {self.name} pool, to {host}")
+
+    def __str__(self):
+        return f"{self.requests} requests over {self.connections} connections ({self.reused} reused)"
+
+
+class _CountingAdapter(HTTPAdapter):
+
+    def __init__(self, pool: ConnectionPool, **kwargs):
+        # set first, as the base class creates the pool manager
+        self._counted_pool = pool
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        manager = self.poolmanager
+        manager.pool_classes_by_scheme = {
+            scheme: _counting(cls, self._counted_pool) for scheme, cls in manager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request, *args, **kwargs):
+        self._counted_pool._sent(urlsplit(request.url).netloc)
+        return super().send(request, *args, **kwargs)
+
+
+def _counting(pool_cls: type, pool: ConnectionPool) -> type:
+    """
+    Subclass the urllib3 connection pool class to count the connections it opens.
+    """
+
+    class CountingConnectionPool(pool_cls):
+
+        def _new_conn(self):
+            pool._connected(f"{self.host}:{self.port}" if self.port else self.host)
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+# Control of the speakers, by soco
+SPEAKERS = ConnectionPool("speakers", SPEAKER_TIMEOUT, hosts=SPEAKER_HOSTS)
+# Internet services, such as speech synthesis
+INTERNET = ConnectionPool("internet", INTERNET_TIMEOUT, hosts=INTERNET_HOSTS)
+
+
+class PooledRequests:
+    """
+    Stands in for the requests module within soco, sending its requests through a connection pool (see
+    `soco_hooks`).
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+
+    def __getattr__(self, name: str):
+        return getattr(requests, name)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self._pool.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self._pool.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self._pool.request("POST", url, **kwargs)
@@ -0,0 +1,265 @@
+import logging
+import select
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Union
+
+from getkey import getkey as read_terminal
+from getkey.platforms import PlatformUnix
+
+from socomote.config import CONFIG
+from socomote.keys import Keys
+from socomote.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Key actions, as reported by evdev
+DOWN = "down"
+REPEAT = "repeat"
+UP = "up"
+_EVDEV_ACTIONS = {0: UP, 1: DOWN, 2: REPEAT}
+
+# Input device which reads the terminal socomote was started from
+STDIN = "stdin"
+# Prefix of the Linux input device paths read with evdev
+EVDEV_PREFIX = "/dev/input/"
+
+# A key pressed again within this many seconds of its last event is a bounce or IR repeat, not a new press
+DEBOUNCE_SECONDS = 0.05
+# Minimum seconds between commands from a held key. None to ignore held keys.
+REPEAT_INTERVAL = 0.25
+
+
+def evdev_keys() -> Dict[str, str]:
+    """
+    evdev key names which don't map to a key of the same name, e.g. media keys sent by IR receivers such as FLIRC, under
+    the current key map.
+    """
+    return {
+        'KEY_ENTER': Keys.ENTER,
+        'KEY_KPENTER': Keys.ENTER,
+        'KEY_UP': Keys.UP,
+        'KEY_DOWN': Keys.DOWN,
+        'KEY_LEFT': Keys.LEFT,
+        'KEY_RIGHT': Keys.RIGHT,
+        'KEY_VOLUMEUP': Keys.UP,
+        'KEY_VOLUMEDOWN': Keys.DOWN,
+        'KEY_MUTE': Keys.MUTE,
+        'KEY_PLAYPAUSE': Keys.PLAY_PAUSE,
+        'KEY_NEXTSONG': Keys.NEXT_TRACK,
+        'KEY_PREVIOUSSONG': Keys.PREV_TRACK,
+        'KEY_SPACE': " ",
+        'KEY_LEFTBRACE': "[",
+        'KEY_RIGHTBRACE': "]",
+        'KEY_MINUS': "-",
+        'KEY_EQUAL': "=",
+        'KEY_COMMA': ",",
+        'KEY_DOT': ".",
+        'KEY_SLASH': "/",
+    }
+
+
+# evdev key names which don't map to a key of the same name, replaced by `rebind_evdev_keys` when the key map changes
+EVDEV_KEYS = evdev_keys()
+
+
+def rebind_evdev_keys():
+    global EVDEV_KEYS
+    EVDEV_KEYS = evdev_keys()
+
+
+@dataclass(frozen=True)
+class KeyEvent:
+    key: str
+    action: str = DOWN
+    # time.monotonic() of the key press
+    time: float = 0.0
+    device: str = STDIN
+
+
+class KeyInput(ABC):
+    """
+    Source of key events for a CommandExecutor.
+    """
+
+    @abstractmethod
+    def read(self) -> KeyEvent:
+        """
+        Block until the next key event.
+        """
+        ...
+
+    def close(self):
+        pass
+
+
+class TerminalInput(KeyInput):
+    """
+    Reads keys typed into a terminal with getkey. Terminals only report key presses, so every key is a DOWN, and held
+    keys arrive as a stream of presses.
+    """
+
+    def __init__(self, device: str = STDIN, getkey: Optional[Callable[[], str]] = None):
+        """
+        :param device: terminal device to read, e.g. /dev/tty2, or STDIN.
+        :param getkey: function returning the next key, instead of reading the device.
+        """
+        self.device = device
+        self._file = None
+        if getkey is None and device != STDIN:
+            self._file = open(device)
+            getkey = PlatformUnix(stdin=self._file).getkey
+        self._getkey = getkey or read_terminal
+
+    def read(self) -> KeyEvent:
+        key = self._getkey()
+        return KeyEvent(key, DOWN, time.monotonic(), self.device)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class EvdevInput(KeyInput):
+    """
+    Reads key events directly from one or more Linux input devices, e.g. an IR receiver and a keyboard, using the
+    optional `evdev` package. Unlike a terminal, this works without a login shell, reports key up / down / repeat
+    separately, and timestamps each event when the kernel received it.
+    """
+
+    def __init__(self, paths: List[str], key_codes: Optional[Dict[str, str]] = None, grab: bool = True):
+        """
+        :param paths: input device paths, e.g. /dev/input/by-id/usb-flirc.tv_flirc-if01-event-kbd
+        :param key_codes: evdev key name -> socomote key, in addition to / overriding EVDEV_KEYS.
+        :param grab: take exclusive use of the devices, so key presses don't also reach the console.
+        """
+        try:
+            from evdev import InputDevice, ecodes
+        except ImportError:
+            raise ImportError("Reading input devices requires the evdev package: pip install evdev")
+        self._ecodes = ecodes
+        # read alongside EVDEV_KEYS on every key, so a change to the key map applies straight away
+        self._key_codes = dict(key_codes or {})
+        self._devices = {}
+        for path in paths:
+            device = InputDevice(path)
+            if grab:
+                try:
+                    device.grab()
+                except OSError as e:
+                    logger.warning(f"Unable to grab {path}, its keys will also reach the console: {e}")
+            self._devices[device.fd] = device
+            logger.info(f"Reading keys from {device.name} ({path})")
+        self._pending: Deque[KeyEvent] = deque()
+
+    def _key(self, code: int) -> Optional[str]:
+        names = self._ecodes.KEY.get(code) or self._ecodes.BTN.get(code)
+        for name in names if isinstance(names, list) else [names]:
+            key = self._key_codes.get(name, EVDEV_KEYS.get(name))
+            if key is not None:
+                return key
+            if name is not None and name.startswith('KEY_') and len(name) == 5:
+                # letters and digits
+                return name[-1].lower()
+            if name is not None and name.startswith('KEY_KP') and len(name) == 7 and name[-1].isdigit():
+                return name[-1]
+        return None
+
+    def read(self) -> KeyEvent:
+        while not self._pending:
+            if not self._devices:
+                raise EOFError("No input devices left to read")
+            ready, _, _ = select.select(list(self._devices), [], [])
+            for fd in ready:
+                device = self._devices[fd]
+                try:
+                    events = list(device.read())
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    logger.error(f"Lost input device {device.path}: {e}")
+                    del self._devices[fd]
+                    continue
+                for event in events:
+                    if event.type != self._ecodes.EV_KEY or event.value not in _EVDEV_ACTIONS:
+                        continue
+                    key = self._key(event.code)
+                    if key is None:
+                        logger.debug(f"Ignoring unmapped key code {event.code} from {device.path}")
+                        continue
+                    # convert the kernel's wall clock timestamp, so latency is measured from the key press
+                    received = time.monotonic() - max(0.0, time.time() - event.timestamp())
+                    self._pending.append(KeyEvent(key, _EVDEV_ACTIONS[event.value], received, device.path))
+        return self._pending.popleft()
+
+    def close(self):
+        for device in self._devices.values():
+            device.close()
+
+
+class KeyFilter(KeyInput):
+    """
+    Turns raw key events into key presses to dispatch. Key ups are dropped, a press of a key within `debounce`
+    seconds of its last event counts as a repeat rather than a new press, and repeats of a held key are passed on at
+    most once per `repeat_interval` seconds. Digits and terminal keys are never repeated, as they make up codes.
+    """
+
+    def __init__(
+        self,
+        source: KeyInput,
+        debounce: float = DEBOUNCE_SECONDS,
+        repeat_interval: Optional[float] = REPEAT_INTERVAL,
+    ):
+        self.source = source
+        self.debounce = debounce
+        self.repeat_interval = repeat_interval
+        self._last_event: Dict[str, float] = {}
+        self._last_dispatched: Dict[str, float] = {}
+
+    def read(self) -> KeyEvent:
+        while True:
+            event = self.source.read()
+            if self._accept(event):
+                self._last_dispatched[event.key] = event.time
+                return event
+            METRICS.incr('key_events_dropped_total', action=event.action)
+
+    def _accept(self, event: KeyEvent) -> bool:
+        last_event = self._last_event.get(event.key)
+        self._last_event[event.key] = event.time
+        if event.action == UP:
+            return False
+        if event.action == DOWN and (last_event is None or event.time - last_event >= self.debounce):
+            return True
+        # a repeat, or a bounce which is treated as one
+        if self.repeat_interval is None or event.key.isdigit() or event.key in Keys.TERMINALS:
+            return False
+        last_dispatched = self._last_dispatched.get(event.key)
+        return last_dispatched is None or event.time - last_dispatched >= self.repeat_interval
+
+    def close(self):
+        self.source.close()
+
+
+def open_input(devices: Union[str, List[str], None] = None) -> KeyInput:
+    """
+    Open the given input device(s), filtered according to the 'Input' config. Paths under /dev/input are read with
+    evdev, anything else is a terminal. Defaults to the devices in the config, or the terminal.
+    """
+    settings = CONFIG.get('Input') or {}
+    if devices is None:
+        devices = settings.get('Devices', STDIN)
+    paths = [devices] if isinstance(devices, str) else list(devices)
+    if all(path.startswith(EVDEV_PREFIX) for path in paths):
+        source = EvdevInput(paths, key_codes=settings.get('KeyCodes'), grab=settings.get('Grab', True))
+    elif len(paths) == 1:
+        source = TerminalInput(paths[0])
+    else:
+        raise ValueError(f"Only input devices under {EVDEV_PREFIX} can be combined, got {paths}")
+    return KeyFilter(
+        source,
+        debounce=settings.get('Debounce', DEBOUNCE_SECONDS),
+        repeat_interval=settings.get('RepeatInterval', REPEAT_INTERVAL),
+    )
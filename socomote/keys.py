@@ -1,24 +1,83 @@
+import logging
+from typing import Dict
+
 from getkey import keys
 
 from socomote.config import CONFIG
 
+logger = logging.getLogger(__name__)
+
+# Keys which can be remapped with 'KeyMap' in the config, and their defaults. Keys added since the key map was
+# introduced are unbound (None) unless set in the config, so they can't clash with keys existing configs already use.
+DEFAULT_KEY_MAP = {
+    "PLAY_PAUSE": "p",
+    "NEXT_TRACK": "]",
+    "PREV_TRACK": "[",
+    "SHUFFLE": "s",
+    "ANNOUNCE": "a",
+    "MUTE": "m",
+    "GROUP": "g",
+    "ZONE": "z",
+    "SCENE": None,
+}
+
+
+def resolve_key_map(config: dict) -> Dict[str, str]:
+    """
+    Return the key for each remappable key name, from the config's 'KeyMap' or the defaults, leaving out those which
+    are unbound. Raises a ValueError if the key map is invalid, including if it unbinds a key which has a default.
+    """
+    key_map = config.get('KeyMap') or {}
+    if not isinstance(key_map, dict):
+        raise ValueError(f"KeyMap must be a mapping of key names to keys, got {key_map!r}")
+    unknown = set(key_map) - set(DEFAULT_KEY_MAP)
+    if unknown:
+        logger.warning(f"Ignoring unknown KeyMap entries {sorted(unknown)}, expected {sorted(DEFAULT_KEY_MAP)}")
+    for name, default in DEFAULT_KEY_MAP.items():
+        if default is not None and name in key_map and key_map[name] is None:
+            raise ValueError(f"KeyMap {name} must be a key, it can't be unbound")
+    resolved = {
+        name: str(key_map.get(name, default)) for name, default in DEFAULT_KEY_MAP.items()
+        if key_map.get(name, default) is not None
+    }
+    for name, key in resolved.items():
+        if not key or key.isdigit():
+            raise ValueError(f"KeyMap {name} must be a key other than a digit, got {key!r}")
+    keys_used = list(resolved.values())
+    duplicates = {name: key for name, key in resolved.items() if keys_used.count(key) > 1}
+    if duplicates:
+        raise ValueError(f"KeyMap assigns the same key more than once: {duplicates}")
+    return resolved
+
 
 class Keys:
 
-    KEY_MAP = CONFIG.get('KeyMap', {})
+    KEY_MAP = resolve_key_map(CONFIG)
 
     ENTER = keys.ENTER
     UP = keys.UP
     DOWN = keys.DOWN
     LEFT = keys.LEFT
     RIGHT = keys.RIGHT
-    PLAY_PAUSE = KEY_MAP.get("PLAY_PAUSE", "p")
-    NEXT_TRACK = KEY_MAP.get("NEXT_TRACK", "]")
-    PREV_TRACK = KEY_MAP.get("PREV_TRACK", "[")
-    SHUFFLE = KEY_MAP.get("SHUFFLE", "s")
-    ANNOUNCE = KEY_MAP.get("ANNOUNCE", "a")
-    MUTE = KEY_MAP.get("MUTE", "m")
-    GROUP = KEY_MAP.get("GROUP", "g")
-    ZONE = KEY_MAP.get("ZONE", "z")
-
-    TERMINALS = {ENTER, GROUP, ZONE}
\ No newline at end of file
+    PLAY_PAUSE = KEY_MAP["PLAY_PAUSE"]
+    NEXT_TRACK = KEY_MAP["NEXT_TRACK"]
+    PREV_TRACK = KEY_MAP["PREV_TRACK"]
+    SHUFFLE = KEY_MAP["SHUFFLE"]
+    ANNOUNCE = KEY_MAP["ANNOUNCE"]
+    MUTE = KEY_MAP["MUTE"]
+    GROUP = KEY_MAP["GROUP"]
+    ZONE = KEY_MAP["ZONE"]
+    SCENE = KEY_MAP.get("SCENE")
+
+    TERMINALS = {key for key in (ENTER, GROUP, ZONE, SCENE) if key is not None}
+
+    @classmethod
+    def apply(cls, key_map: Dict[str, str]):
+        """
+        Update the remappable keys from a reloaded config. Commands are dispatched by `core.Dispatch`, rebuilt at the
+        same time, so this only affects code reading the keys directly.
+        """
+        cls.KEY_MAP = key_map
+        for name in DEFAULT_KEY_MAP:
+            setattr(cls, name, key_map.get(name))
+        cls.TERMINALS = {key for key in (cls.ENTER, cls.GROUP, cls.ZONE, cls.SCENE) if key is not None}
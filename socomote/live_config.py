@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from socomote.config import CONFIG, SOCOMOTE_CONFIG_FILE
+from socomote.keys import resolve_key_map
+from socomote.scenes import Scene, parse_scenes
+from socomote.volume import VolumeSettings, resolve_volume_settings
+from socomote.yaml_io import YAMLError, load
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the config file for changes, if inotify_simple isn't installed
+POLL_INTERVAL = 2.0
+# Seconds to wait after a change to the config file for any further writes, so a half-saved file isn't read
+SETTLE_SECONDS = 0.2
+# Settings which are only read at startup, so changing them is logged as needing a restart
+RESTART_SETTINGS = ('Input', 'TTS', 'PluginWorkers', 'Remotes')
+# Codes which can be set with 'Codes' in the config, and their defaults
+DEFAULT_CODES = {'EXIT': '000'}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    The parts of config.yaml which take effect without restarting: the zones and their groups, volume settings, the
+    key map, codes and scenes, and the settings read from `raw` as they're used, such as PluginTimeout. Validated as a
+    whole, and replaced as a whole when the file changes. RESTART_SETTINGS only take effect on restarting.
+    """
+    raw: dict
+    volume: Dict[str, VolumeSettings]
+    key_map: Dict[str, str]
+    # code name -> digits, e.g. EXIT: '000'
+    codes: Dict[str, str]
+    scenes: Dict[int, Scene]
+    version: int = 0
+
+    @property
+    def zones(self) -> dict:
+        return self.raw['Zones']
+
+    def zone_with_index(self, index: int) -> Optional[str]:
+        return next((name for name, zone in self.zones.items() if (zone or {}).get('Index') == index), None)
+
+    def group(self, zone: str, number: int) -> List[str]:
+        """
+        Return the slaves of the given numbered group of the zone. Raises a KeyError if there's no such group.
+        """
+        return list(((self.zones[zone] or {}).get('Groups') or {})[number])
+
+
+def parse_config(raw: dict, version: int = 0, strict: bool = True) -> ConfigSnapshot:
+    """
+    Validate the config, returning a snapshot of it. Raises a ConfigError describing the first problem found.
+
+    :param strict: if False, problems with the zones and codes, which only stop the affected zone, group or code from
+        being used, are logged rather than raised. Used for the config read at startup, which has no previous config
+        to fall back to.
+    """
+
+    def problem(message: str):
+        if strict:
+            raise ConfigError(message)
+        logger.warning(f"{message}, ignoring")
+
+    if not isinstance(raw, dict):
+        raise ConfigError("Config must be a mapping")
+    zones = raw.get('Zones')
+    if not isinstance(zones, dict) or not zones:
+        raise ConfigError("Zones must be a mapping of zone names to their settings")
+    indexes: Dict[int, str] = {}
+    for name, zone in zones.items():
+        if not isinstance(zone, dict) or not isinstance(zone.get('Index'), int):
+            problem(f"Zone {name} must have an integer Index")
+            continue
+        if zone['Index'] in indexes:
+            problem(f"Zones {indexes[zone['Index']]} and {name} have the same Index {zone['Index']}")
+            continue
+        indexes[zone['Index']] = name
+        groups = zone.get('Groups') or {}
+        if not isinstance(groups, dict):
+            problem(f"Groups of zone {name} must be a mapping of group numbers to zone names")
+            continue
+        for number, members in groups.items():
+            if not isinstance(number, int) or not isinstance(members, list):
+                problem(f"Group {number} of zone {name} must be numbered, with a list of zone names")
+    codes = raw.get('Codes') or {}
+    if not isinstance(codes, dict):
+        raise ConfigError(f"Codes must be a mapping of code names to digits, got {codes!r}")
+    codes = {**DEFAULT_CODES, **{name: str(code) for name, code in codes.items()}}
+    for name, code in codes.items():
+        if not code.isdigit():
+            problem(f"Code {name} must be digits, got {code!r}")
+    try:
+        volume = resolve_volume_settings(raw)
+        key_map = resolve_key_map(raw)
+        scenes = parse_scenes(raw)
+    except (ValueError, TypeError) as e:
+        raise ConfigError(str(e)) from e
+    return ConfigSnapshot(raw=raw, volume=volume, key_map=key_map, codes=codes, scenes=scenes, version=version)
+
+
+class LiveConfig:
+    """
+    The current config snapshot. Readers take `snapshot` once per operation, so see a consistent config, and a reload
+    swaps in a new snapshot in a single assignment, then notifies listeners to rebuild anything derived from it.
+    """
+
+    def __init__(self, path: Path, snapshot: ConfigSnapshot):
+        self.path = path
+        self.snapshot = snapshot
+        self.reloads = 0
+        self.rejected = 0
+        self._validators: List[Callable[[ConfigSnapshot], None]] = []
+        self._listeners: List[Callable[[ConfigSnapshot], None]] = []
+        self._lock = threading.Lock()
+
+    def add_validator(self, validator: Callable[[ConfigSnapshot], None]):
+        """
+        Add a check, run before a reloaded config is swapped in, raising a ConfigError if it can't be applied.
+        """
+        self._validators.append(validator)
+
+    def add_listener(self, listener: Callable[[ConfigSnapshot], None]):
+        """
+        Add a function called with each reloaded config, once it's been swapped in.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[ConfigSnapshot], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def reload(self) -> bool:
+        """
+        Read and validate the config file, and swap it in if valid. An invalid config is logged and ignored, leaving
+        the current config in place. Returns whether the config was replaced.
+        """
+        with self._lock:
+            try:
+                with self.path.open('r') as f:
+                    raw = load(f.read())
+                snapshot = parse_config(raw, version=self.snapshot.version + 1)
+                for validator in self._validators:
+                    validator(snapshot)
+            except (OSError, YAMLError, ConfigError) as e:
+                self.rejected += 1
+                logger.error(f"Not reloading {self.path}, keeping the current config: {e}")
+                return False
+            previous, self.snapshot = self.snapshot, snapshot
+            self.reloads += 1
+            restart = [name for name in RESTART_SETTINGS if raw.get(name) != previous.raw.get(name)]
+            if restart:
+                logger.warning(f"{', '.join(restart)} changed in {self.path}, restart socomote for this to take effect")
+            for listener in self._listeners:
+                try:
+                    listener(snapshot)
+                except Exception as e:
+                    logger.error(f"Failed to apply reloaded config to {listener}: {e}")
+            logger.info(f"Reloaded {self.path} (version {snapshot.version})")
+            return True
+
+
+class ConfigWatcher:
+    """
+    Reloads the live config whenever its file changes, on a background thread. Uses inotify if the optional
+    `inotify_simple` package is installed, otherwise checks the file every `poll_interval` seconds.
+    """
+
+    def __init__(self, live_config: LiveConfig, poll_interval: float = POLL_INTERVAL):
+        self.live_config = live_config
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._inotify = None
+
+    def __enter__(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            logger.info(f"Checking {self.live_config.path} for changes every {self.poll_interval}s")
+        else:
+            self._inotify = INotify()
+            # editors often save by writing a new file and renaming it over the old, so watch the directory
+            self._inotify.add_watch(
+                str(self.live_config.path.parent), flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+            )
+            logger.info(f"Watching {self.live_config.path} for changes")
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        # the watcher wakes at least every poll_interval to check for this
+        self._thread.join(timeout=self.poll_interval + SETTLE_SECONDS)
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def _run(self):
+        wait = self._wait_inotify if self._inotify is not None else self._wait_poll
+        last = self._file_state()
+        while not self._stop.is_set():
+            if not wait():
+                continue
+            # let the write finish before reading
+            if self._stop.wait(SETTLE_SECONDS):
+                return
+            state = self._file_state()
+            if state != last:
+                last = state
+                self.live_config.reload()
+
+    def _wait_inotify(self) -> bool:
+        try:
+            events = self._inotify.read(timeout=int(self.poll_interval * 1000))
+        except OSError as e:
+            logger.error(f"Unable to watch {self.live_config.path}: {e}")
+            return False
+        return any(event.name == self.live_config.path.name for event in events)
+
+    def _wait_poll(self) -> bool:
+        return not self._stop.wait(self.poll_interval)
+
+    def _file_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.live_config.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
+# The config as of the last successful load of config.yaml. Problems the zones had at startup are logged, see
+# `parse_config`, but a reloaded config with problems is rejected.
+LIVE_CONFIG = LiveConfig(SOCOMOTE_CONFIG_FILE, parse_config(CONFIG, strict=False))
@@ -0,0 +1,210 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Histogram:
+    """
+    Thread-safe histogram of durations in seconds, with fixed buckets.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Return the upper bound of the bucket containing the given quantile, or None if nothing has been observed.
+        """
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class CommandTrace:
+    """
+    Timestamps of a command's progress from key press to completion, plus the speaker calls it made.
+    """
+
+    def __init__(self, received: Optional[float] = None):
+        """
+        :param received: time.monotonic() of the key press, if not now.
+        """
+        self.command = ''
+        self.marks: Dict[str, float] = {'received': time.monotonic() if received is None else received}
+        self.calls: List[Tuple[str, float]] = []
+
+    def mark(self, name: str):
+        self.marks[name] = time.monotonic()
+
+    def since_received(self, name: str) -> Optional[float]:
+        if name not in self.marks:
+            return None
+        return self.marks[name] - self.marks['received']
+
+    def __str__(self):
+        marks = ", ".join(f"{name} +{self.since_received(name) * 1000:.0f}ms" for name in self.marks)
+        return f"{marks}; {len(self.calls)} speaker calls taking {sum(d for _, d in self.calls) * 1000:.0f}ms"
+
+
+class Metrics:
+    """
+    In-memory counters, gauges and latency histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._counters: Dict[_Key, float] = {}
+        self._histograms: Dict[_Key, Histogram] = {}
+        self._gauges: Dict[_Key, Callable[[], float]] = {}
+        self._tts_traces: Dict[str, CommandTrace] = {}
+        # the trace of the command being executed, which follows it onto the loop and into the calls it makes there
+        self._trace: ContextVar[Optional[CommandTrace]] = ContextVar('command_trace', default=None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, str]) -> _Key:
+        return name, tuple(sorted(labels.items()))
+
+    def incr(self, name: str, value: float = 1, **labels: str):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            return histogram
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        self.histogram(name, **labels).observe(seconds)
+
+    def gauge(self, name: str, read: Callable[[], float], **labels: str):
+        """
+        Register a gauge, whose value is read when the metrics are rendered.
+        """
+        self._gauges[self._key(name, labels)] = read
+
+    @property
+    def current_trace(self) -> Optional[CommandTrace]:
+        """The trace of the command being executed, if any"""
+        return self._trace.get()
+
+    def start_command(self, command_name: str, trace: CommandTrace):
+        trace.command = command_name
+        trace.mark('started')
+        self._trace.set(trace)
+
+    def finish_command(self, trace: CommandTrace, failed: bool = False):
+        trace.mark('finished')
+        self._trace.set(None)
+        marks = trace.marks
+        self.incr('commands_total', command=trace.command, result='failed' if failed else 'ok')
+        self.observe('command_latency_seconds', marks['finished'] - marks['received'], command=trace.command)
+        self.observe('command_queue_seconds', marks['started'] - marks['received'], command=trace.command)
+        self.observe('command_execution_seconds', marks['finished'] - marks['started'], command=trace.command)
+        logger.debug(f"{trace.command}: {trace}")
+
+    def speaker_call(self, action: str, seconds: float, failed: bool = False):
+        self.observe('speaker_call_seconds', seconds, action=action)
+        if failed:
+            self.incr('speaker_call_failures_total', action=action)
+        trace = self.current_trace
+        if trace is not None:
+            trace.calls.append((action, seconds))
+
+    def expect_tts(self, text: str):
+        """
+        Record that the command executing on this thread is about to have the speaker fetch the given text.
+        """
+        trace = self.current_trace
+        if trace is not None:
+            self._tts_traces[text] = trace
+
+    def tts_served(self, text: str, seconds: float):
+        self.observe('tts_request_seconds', seconds)
+        trace = self._tts_traces.pop(text, None)
+        if trace is not None:
+            trace.mark('tts_served')
+            self.observe('key_to_tts_seconds', trace.since_received('tts_served'), command=trace.command)
+
+    def render(self) -> str:
+        def fmt(name: str, labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            all_labels = labels + extra
+            if not all_labels:
+                return name
+            return name + "{" + ",".join(f'{k}="{v}"' for k, v in all_labels) + "}"
+
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(f"{fmt(name, labels)} {value}")
+        for (name, labels), read in sorted(self._gauges.items()):
+            lines.append(f"{fmt(name, labels)} {read()}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip([str(b) for b in histogram.buckets] + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f"{fmt(name + '_bucket', labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{fmt(name + '_sum', labels)} {histogram.sum}")
+            lines.append(f"{fmt(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        def fmt(name, labels):
+            return name + "".join(f",{k}={v}" for k, v in labels)
+
+        with self._lock:
+            return {
+                'counters': {fmt(*key): value for key, value in self._counters.items()},
+                'gauges': {fmt(*key): read() for key, read in self._gauges.items()},
+                'histograms': {fmt(*key): h.to_dict() for key, h in self._histograms.items()},
+            }
+
+    def dump(self, path: Path):
+        with path.open('w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logger.info(f"Metrics written to {path}")
+
+
+METRICS = Metrics()
@@ -0,0 +1,77 @@
+from typing import Optional, Tuple
+
+# kbps, indexed by [is MPEG 1][layer][bitrate index]
+_BITRATES = {
+    True: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+
+# Hz, indexed by version bits then sample rate index
+_SAMPLE_RATES = {
+    0b00: (11025, 12000, 8000),  # MPEG 2.5
+    0b10: (22050, 24000, 16000),  # MPEG 2
+    0b11: (44100, 48000, 32000),  # MPEG 1
+}
+
+
+def _id3v2_size(data: bytes) -> int:
+    if len(data) < 10 or not data.startswith(b"ID3"):
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _frame(data: bytes, pos: int) -> Optional[Tuple[int, float]]:
+    """
+    Parse the frame header at the given position, returning (frame length in bytes, frame duration in seconds),
+    or None if there is no valid header there.
+    """
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 0b11
+    layer = 4 - ((data[pos + 1] >> 1) & 0b11)
+    bitrate_ix = data[pos + 2] >> 4
+    sample_rate_ix = (data[pos + 2] >> 2) & 0b11
+    padding = (data[pos + 2] >> 1) & 0b1
+    if version not in _SAMPLE_RATES or layer == 4 or bitrate_ix in (0, 15) or sample_rate_ix == 3:
+        return None
+    is_mpeg1 = version == 0b11
+    bitrate = _BITRATES[is_mpeg1][layer][bitrate_ix] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_ix]
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or is_mpeg1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return length, samples / sample_rate
+
+
+def mp3_duration(data: bytes) -> float:
+    """
+    Return the duration in seconds of the MP3 data, by summing the durations of all of its frames.
+    """
+    pos = _id3v2_size(data)
+    duration = 0.0
+    while pos < len(data):
+        frame = _frame(data, pos)
+        if frame is None:
+            if data.startswith(b"TAG", pos):
+                # ID3v1 tag at the end of the file
+                break
+            # not a frame header, resync
+            pos += 1
+            continue
+        length, frame_duration = frame
+        duration += frame_duration
+        pos += length
+    return duration
@@ -0,0 +1,190 @@
+import ast
+import importlib
+import logging
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from socomote.keys import Keys
+from socomote.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Kinds of command, by the base class they're defined with
+KEY = "key"
+CODE = "code"
+SPECIAL_CODE = "special_code"
+_BASES = {'KeyCommand': KEY, 'CodeCommand': CODE, 'SpecialCodeCommand': SPECIAL_CODE}
+# Plugin modules in SOCOMOTE_HOME: plugins.py, and any others, e.g. plugin_lights.py
+PLUGIN_GLOB = "plugin*.py"
+
+
+@dataclass(frozen=True)
+class PluginCommand:
+    """
+    A command found in a plugin module without importing it, so it can be dispatched before the module is loaded.
+    """
+    module: str
+    name: str
+    kind: str
+    # key for key commands, terminal key for code commands
+    key: Optional[str] = None
+    code: Optional[str] = None
+    binding: Optional[str] = None
+    code_binding: Optional[str] = None
+
+    @property
+    def __name__(self) -> str:
+        return self.name
+
+
+@dataclass
+class PluginModule:
+    name: str
+    path: Path
+    commands: List[PluginCommand] = field(default_factory=list)
+    # can't be loaded lazily: either its commands couldn't all be found by reading it, or it has no commands, so may
+    # just be customising socomote
+    eager: bool = False
+
+
+def _literal(node: ast.AST) -> Optional[str]:
+    """
+    The value of a class attribute assigned a string, or a `Keys` constant.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'Keys':
+        value = getattr(Keys, node.attr, None)
+        return value if isinstance(value, str) else None
+    return None
+
+
+def _base_kind(base: ast.AST) -> Optional[str]:
+    name = base.attr if isinstance(base, ast.Attribute) else getattr(base, 'id', None)
+    return _BASES.get(name)
+
+
+def _has_side_effects(node: ast.stmt) -> bool:
+    """
+    Whether a top level statement may do more than define things, e.g. register a speech engine, so the module has to
+    be loaded at startup.
+    """
+    if isinstance(node, (ast.Import, ast.ImportFrom, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+        return False
+    if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+        return False
+    if isinstance(node, ast.Assign):
+        return not all(isinstance(target, ast.Name) for target in node.targets)
+    if isinstance(node, ast.AnnAssign):
+        return not isinstance(node.target, ast.Name)
+    return True
+
+
+def scan_module(path: Path) -> PluginModule:
+    """
+    Find the commands defined in a plugin module by parsing it, without running it.
+    """
+    module = PluginModule(name=path.stem, path=path)
+    try:
+        tree = ast.parse(path.read_text(), filename=str(path))
+    except (OSError, SyntaxError, ValueError) as e:
+        logger.error(f"Unable to read plugin {path}, loading it at startup to report the error: {e}")
+        module.eager = True
+        return module
+    for node in tree.body:
+        if _has_side_effects(node):
+            module.eager = True
+        if not isinstance(node, ast.ClassDef):
+            continue
+        kinds = {_base_kind(base) for base in node.bases} - {None}
+        if not kinds:
+            continue
+        attributes: Dict[str, Optional[str]] = {}
+        for statement in node.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+                target, value = statement.targets[0], statement.value
+            elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+                target, value = statement.target, statement.value
+            else:
+                continue
+            if isinstance(target, ast.Name):
+                attributes[target.id] = _literal(value)
+        kind = kinds.pop()
+        key = attributes.get('key' if kind == KEY else 'terminal')
+        code = attributes.get('code')
+        if kinds or key is None or (kind == SPECIAL_CODE and code is None and 'code_binding' not in attributes):
+            logger.info(f"Can't tell which key runs {node.name} in {path.name}, loading it at startup")
+            module.eager = True
+            continue
+        module.commands.append(PluginCommand(
+            module=module.name,
+            name=node.name,
+            kind=kind,
+            key=key,
+            code=code,
+            binding=attributes.get('binding'),
+            code_binding=attributes.get('code_binding'),
+        ))
+    if not module.commands:
+        module.eager = True
+    return module
+
+
+def discover_plugins(directory: Path) -> List[PluginModule]:
+    """
+    Find the plugin modules in the directory.
+    """
+    return [scan_module(path) for path in sorted(directory.glob(PLUGIN_GLOB))]
+
+
+class PluginLoader:
+    """
+    Imports plugin modules on demand, once each, recording how long each import takes.
+    """
+
+    def __init__(self):
+        self.import_seconds: Dict[str, float] = {}
+        self._failed: Dict[str, Exception] = {}
+        self._lock = Lock()
+
+    def load(self, module: str):
+        """
+        Import the plugin module if not already imported, raising an ImportError if it can't be.
+        """
+        with self._lock:
+            if module in self.import_seconds:
+                return importlib.import_module(module)
+            if module in self._failed:
+                raise ImportError(f"Plugin {module} failed to load: {self._failed[module]}")
+            start = time.monotonic()
+            try:
+                loaded = importlib.import_module(module)
+            except Exception as e:
+                self._failed[module] = e
+                logger.error(f"Failed to load plugin {module}: {e}")
+                raise ImportError(f"Plugin {module} failed to load: {e}") from e
+            seconds = self.import_seconds[module] = time.monotonic() - start
+        METRICS.observe('plugin_import_seconds', seconds, plugin=module)
+        logger.info(f"Loaded plugin {module} in {seconds:.3f}s")
+        return loaded
+
+    def command_type(self, command: PluginCommand) -> type:
+        return getattr(self.load(command.module), command.name)
+
+    def __str__(self):
+        return ", ".join(f"{name} ({seconds:.3f}s)" for name, seconds in self.import_seconds.items())
+
+
+def bound_trigger(
+    command: PluginCommand, key_map: Dict[str, str], codes: Dict[str, str]
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    The key, and code if a special code command, which runs the command under the given key map and codes. The key is
+    None if the command's key map entry is unbound.
+    """
+    key = key_map.get(command.binding) if command.binding else command.key
+    code = codes[command.code_binding] if command.code_binding else command.code
+    return key, code
@@ -1,14 +1,25 @@
+import asyncio
 from dataclasses import dataclass
 
+from socomote.config import ZONES
 from socomote.core import KeyCommand, Receiver
 
 
 @dataclass
 class ToggleStatusLight(KeyCommand):
     """
-    Toggle the status light on the master zone speaker(s).
+    Toggle the status light on the master zone speaker(s), and on every other speaker in its group.
     """
     key = 'l'
 
-    def execute(self, receiver: Receiver):
-        receiver.master_zone.status_light = not receiver.master_zone.status_light
\ No newline at end of file
+    async def execute(self, receiver: Receiver):
+        # commands can be defined with `async def` to make several speaker calls at once, via `receiver.call`. Anything
+        # which may block, including looking up zones, goes through it too, so the event loop is never held up.
+        light = not await receiver.call(getattr, receiver.master_zone, 'status_light')
+        members = await receiver.call(receiver.zone_state.members, receiver.master_zone)
+        members = members or {receiver.master_zone.player_name}
+        await asyncio.gather(*(receiver.call(self._set_light, name, light) for name in members))
+
+    @staticmethod
+    def _set_light(name: str, light: bool):
+        ZONES[name].status_light = light
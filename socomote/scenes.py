@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Scene:
+    """
+    A set up of the master zone's group, entered as a code: which zones it's grouped with, their volumes, whether
+    they're muted and the station they play. Anything not given is left as it is.
+    """
+    number: int
+    name: str
+    # zones to group with the master zone
+    group: Optional[FrozenSet[str]] = None
+    # zone name -> volume, 0 - 100
+    volumes: Mapping[str, int] = field(default_factory=dict)
+    mute: Optional[bool] = None
+    station: Optional[int] = None
+
+
+def parse_scenes(config: dict) -> Dict[int, Scene]:
+    """
+    Read the scenes from the config's 'Scenes', by number. Raises a ValueError describing the first invalid scene.
+    """
+    scenes = config.get('Scenes') or {}
+    if not isinstance(scenes, dict):
+        raise ValueError(f"Scenes must be a mapping of scene numbers to scenes, got {scenes!r}")
+    zones = set(config.get('Zones') or {})
+    parsed = {}
+    for number, scene in scenes.items():
+        if not isinstance(number, int) or not isinstance(scene, dict):
+            raise ValueError(f"Scene {number} must be numbered, with a mapping of its settings")
+        name = str(scene.get('Name', number))
+        group = scene.get('Group')
+        if group is not None:
+            if not isinstance(group, list):
+                raise ValueError(f"Group of scene {name} must be a list of zone names")
+            group = frozenset(group)
+        volumes = scene.get('Volumes') or {}
+        if not isinstance(volumes, dict):
+            raise ValueError(f"Volumes of scene {name} must be a mapping of zone names to volumes")
+        for zone, volume in volumes.items():
+            if not isinstance(volume, int) or not 0 <= volume <= 100:
+                raise ValueError(f"Volume of {zone} in scene {name} must be from 0 to 100, got {volume!r}")
+        unknown = ((group or set()) | set(volumes)) - zones
+        if unknown:
+            raise ValueError(f"Scene {name} uses zones which aren't in Zones: {sorted(unknown)}")
+        mute = scene.get('Mute')
+        if mute is not None and not isinstance(mute, bool):
+            raise ValueError(f"Mute of scene {name} must be true or false, got {mute!r}")
+        station = scene.get('Station')
+        if station is not None and not isinstance(station, int):
+            raise ValueError(f"Station of scene {name} must be a station number, got {station!r}")
+        parsed[number] = Scene(
+            number=number, name=name, group=group, volumes=dict(volumes), mute=mute, station=station
+        )
+    return parsed
+
+
+@dataclass(frozen=True)
+class Step:
+    """
+    A blocking call in a plan, made once the steps it comes after have finished.
+    """
+    name: str
+    call: Callable[[], Any]
+    after: Tuple[str, ...] = ()
+
+
+class _Skipped(Exception):
+    """A step not run as a step it comes after failed"""
+
+
+class PlanError(Exception):
+
+    def __init__(self, failed: Dict[str, BaseException]):
+        self.failed = failed
+        super().__init__(", ".join(f"{name}: {error}" for name, error in failed.items()))
+
+
+async def run_plan(
+    steps: Iterable[Step], call: Callable[[Callable[[], Any]], Awaitable[Any]]
+) -> Dict[str, float]:
+    """
+    Run each step with `call` as soon as the steps it comes after have finished, so independent steps run at once.
+    Returns the seconds after the start at which each step finished. Raises a PlanError naming the failed steps once
+    every step which could run has, where steps after a failed one aren't run.
+    """
+    steps = list(steps)
+    start = time.monotonic()
+    tasks: Dict[str, 'asyncio.Future[float]'] = {}
+
+    async def run(step: Step) -> float:
+        for name in step.after:
+            try:
+                await tasks[name]
+            except Exception as e:
+                raise _Skipped(name) from e
+        await call(step.call)
+        return time.monotonic() - start
+
+    # every task is created before any runs, so steps can come after steps listed later
+    for step in steps:
+        tasks[step.name] = asyncio.ensure_future(run(step))
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    failed = {
+        name: result for name, result in zip(tasks, results)
+        if isinstance(result, BaseException) and not isinstance(result, _Skipped)
+    }
+    if failed:
+        raise PlanError(failed)
+    return dict(zip(tasks, results))
@@ -0,0 +1,76 @@
+import logging
+import time
+from functools import wraps
+from threading import Lock
+from typing import Optional
+
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from soco.exceptions import SoCoException
+
+from socomote.http_pool import SPEAKERS, ConnectionPool, PooledRequests
+from socomote.metrics import METRICS
+from socomote.zone_health import ZONE_HEALTH, ZoneHealth
+
+logger = logging.getLogger(__name__)
+
+_install_lock = Lock()
+_installed = False
+
+
+def install_soco_hooks(health: Optional[ZoneHealth] = None, pool: Optional[ConnectionPool] = None):
+    """
+    Hook socomote into soco, once per process however often it's called:
+
+    - every request soco makes to the speakers is sent through `pool` (SPEAKERS by default), keeping connections open
+    - every UPnP action is given a timeout, failed instantly if its zone is known to be unavailable and otherwise
+      timed and its success tracked in `health` (ZONE_HEALTH by default), in a single wrapper around
+      `Service.send_command`
+    """
+    global _installed
+    import soco.config
+    import soco.core
+    import soco.events
+    import soco.services
+
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+    health = health or ZONE_HEALTH
+    pool = pool or SPEAKERS
+
+    soco.config.REQUEST_TIMEOUT = pool.timeout[1]
+    for module in (soco.core, soco.events, soco.services):
+        module.requests = PooledRequests(pool)
+
+    send_command = soco.services.Service.send_command
+
+    @wraps(send_command)
+    def hooked_send_command(self, action, *args, **kwargs):
+        name = health.zones.name_of(self.soco.ip_address)
+        retry_timeout = None if name is None else health.before_call(name)
+        kwargs.setdefault('timeout', retry_timeout or health.call_timeout(action))
+        start = time.monotonic()
+        try:
+            result = send_command(self, action, *args, **kwargs)
+        except (ConnectionError, Timeout) as e:
+            METRICS.speaker_call(action, time.monotonic() - start, failed=True)
+            if name is not None:
+                health.failed(name, e)
+            raise
+        except (SoCoException, HTTPError):
+            METRICS.speaker_call(action, time.monotonic() - start, failed=True)
+            # the zone responded, if with an error
+            if name is not None:
+                health.succeeded(name)
+            raise
+        except BaseException:
+            METRICS.speaker_call(action, time.monotonic() - start, failed=True)
+            raise
+        METRICS.speaker_call(action, time.monotonic() - start)
+        if name is not None:
+            health.succeeded(name)
+        return result
+
+    soco.services.Service.send_command = hooked_send_command
+    logger.debug("Installed soco hooks")
@@ -0,0 +1,139 @@
+import importlib.abc
+import importlib.machinery
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Number of modules listed in the report, slowest first
+REPORT_MODULES = 20
+# Loaders created for each module imported from a file, which can be timed one module at a time
+_FILE_LOADERS = (
+    importlib.machinery.SourceFileLoader,
+    importlib.machinery.SourcelessFileLoader,
+    importlib.machinery.ExtensionFileLoader,
+)
+
+
+def peak_rss() -> Optional[int]:
+    """
+    The most memory the process has had resident so far, in bytes, if known on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _mb(size: Optional[int]) -> str:
+    return "-" if size is None else f"{size / 2 ** 20:.1f}MB"
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Times the execution of each module imported from a file, as `python -X importtime` does, but in process so the
+    times can be reported alongside the startup phases.
+    """
+
+    def __init__(self, profile: 'StartupProfile'):
+        self.profile = profile
+        # cumulative seconds of the imports in progress, to take nested imports out of each module's own time
+        self._nested: List[float] = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # loaders of built in and frozen modules are shared, so can't be wrapped for a single module
+        if isinstance(spec.loader, _FILE_LOADERS):
+            spec.loader.exec_module = self._timed(name, spec.loader.exec_module)
+        return spec
+
+    def _timed(self, name: str, exec_module):
+        def timed_exec_module(module):
+            self._nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                seconds = time.perf_counter() - start
+                nested = self._nested.pop()
+                if self._nested:
+                    self._nested[-1] += seconds
+                self.profile.imports[name] = (seconds - nested, seconds)
+        return timed_exec_module
+
+
+class StartupProfile:
+    """
+    Records how long socomote takes to become ready for the first key press: the time of each startup phase, the
+    import time of each module and the peak resident memory. Does nothing unless started, by `--profile-startup`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.monotonic()
+        # name, seconds, peak RSS at the end
+        self.phases: List[Tuple[str, float, Optional[int]]] = []
+        # module name -> (own seconds, seconds including its imports)
+        self.imports: Dict[str, Tuple[float, float]] = {}
+        self.reported = False
+        self._timer: Optional[_ImportTimer] = None
+
+    def start(self):
+        """
+        Start profiling. Should be called before socomote's other modules are imported, to time their imports.
+        """
+        self.enabled = True
+        self.started = time.monotonic()
+        self._timer = _ImportTimer(self)
+        sys.meta_path.insert(0, self._timer)
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.monotonic() - start, peak_rss()))
+
+    def ready(self):
+        """
+        Report the profile, once, when socomote is first ready for a key press.
+        """
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        if self._timer in sys.meta_path:
+            sys.meta_path.remove(self._timer)
+        report = self.report()
+        logger.info(report)
+        print(report, flush=True)
+
+    def report(self) -> str:
+        total = time.monotonic() - self.started
+        lines = [f"Ready for the first key press {total:.3f}s after startup, peak RSS {_mb(peak_rss())}", "Phases:"]
+        lines += [f"  {name:24} {seconds:8.3f}s  peak RSS {_mb(rss)}" for name, seconds, rss in self.phases]
+        imported = sum(own for own, _ in self.imports.values())
+        lines.append(f"Imports: {len(self.imports)} modules in {imported:.3f}s, slowest (own / including imports):")
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)[:REPORT_MODULES]
+        lines += [f"  {name:40} {own:8.3f}s {cumulative:8.3f}s" for name, (own, cumulative) in slowest]
+        return "\n".join(lines)
+
+
+# Profile of this process's startup
+STARTUP = StartupProfile()
@@ -1,11 +1,19 @@
+import asyncio
 import logging
-import time
+import os
+import random
 from dataclasses import dataclass, field
-from threading import Thread
-from typing import Optional
+from itertools import count
+from pathlib import Path
+from threading import Event
+from typing import Optional, Callable, List, Dict, Tuple
 
+from soco import SoCo
 from soco.music_library import MusicLibrary
 
+from socomote.aio import AsyncRuntime
+from socomote.yaml_io import load, dump
+
 logger = logging.getLogger(__name__)
 
 STATION_PREFIXES = [
@@ -20,40 +28,311 @@ def is_station_uri(uri):
     return any(uri.startswith(p) for p in STATION_PREFIXES)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, repr=False)
 class Station:
+    # slotted, as there's one per favourite for the life of the process
+    __slots__ = ('title', 'uri')
     title: str
-    uri: str = field(repr=False)
+    uri: str
+
+    def __repr__(self):
+        return f"Station(title={self.title!r})"
+
+
+# Default seconds between checks for changes to the favourites
+REFRESH_INTERVAL = 60
+# Sonos favourites container
+FAVORITES_ID = "FV:2"
+
+
+@dataclass(frozen=True)
+class _Catalogue:
+    """
+    Immutable station list keyed by preset number, with its indexes, swapped in as a whole on refresh.
+    """
+    presets: Dict[int, Station] = field(default_factory=dict)
+    # preset numbers in order, and the stations in the same order
+    order: Tuple[int, ...] = ()
+    stations: Tuple[Station, ...] = ()
+    # preset number -> position in order
+    positions: Dict[int, int] = field(default_factory=dict)
+    # uri -> preset number
+    numbers: Dict[str, int] = field(default_factory=dict)
+    uri_index: Dict[str, Station] = field(default_factory=dict)
+    title_index: Dict[str, Station] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, presets: Dict[int, Station]) -> '_Catalogue':
+        order = tuple(sorted(presets))
+        return cls(
+            presets=dict(presets),
+            order=order,
+            stations=tuple(presets[n] for n in order),
+            positions={n: i for i, n in enumerate(order)},
+            numbers={station.uri: n for n, station in presets.items()},
+            uri_index={station.uri: station for station in presets.values()},
+            title_index={station.title: station for station in presets.values()},
+        )
+
+    def assign_presets(self, live: List[Station]) -> Dict[int, Station]:
+        """
+        Number the live stations, keeping the preset of every station already in this catalogue (matched by uri, or
+        by title if its uri has changed). New stations take the lowest free numbers.
+        """
+        presets: Dict[int, Station] = {}
+        unnumbered = []
+        for station in live:
+            number = self.numbers.get(station.uri)
+            if number is None and station.title in self.title_index:
+                number = self.numbers[self.title_index[station.title].uri]
+            if number is None or number in presets:
+                unnumbered.append(station)
+            else:
+                presets[number] = station
+        free = (n for n in count(1) if n not in presets)
+        for station in unnumbered:
+            presets[next(free)] = station
+        return presets
 
 
 class Stations:
+    """
+    The radio stations in the Sonos favourites, each with a stable preset number.
 
-    def __init__(self):
-        self._stations = []
-        self._station_index = {}
-        self._curr_ix: int = 0
-        self.refresh()
-        self._refresh_thread = Thread(target=self._refresh_loop, daemon=True)
-        self._refresh_thread.start()
-
-    def refresh(self):
-        curr_station = self[self._curr_ix] if len(self) else None
-        new_stations = []
-        for fav in MusicLibrary().get_sonos_favorites():
+    The catalogue is persisted to `snapshot_file`, so is available as soon as socomote starts, and is reconciled with
+    the live favourites in the background, by a task on the household's loop. Stations keep their preset number as
+    favourites are added and removed, and the numbers can be changed by editing the file.
+    """
+
+    def __init__(
+        self,
+        on_change: Optional[Callable[[List[Station]], None]] = None,
+        zone: Optional[SoCo] = None,
+        interval: float = REFRESH_INTERVAL,
+        snapshot_file: Optional[Path] = None,
+        runtime: Optional[AsyncRuntime] = None,
+    ):
+        """
+        :param on_change: called with the new station list whenever a refresh finds new or renamed stations.
+        :param zone: zone to browse favourites on and watch for favourites changes. Any zone if not given.
+        :param interval: seconds between checks for changes to the favourites.
+        :param snapshot_file: file the catalogue is loaded from and saved to, if any.
+        :param runtime: loop to refresh the favourites on in the background. Only refreshed by `refresh` if not given.
+        """
+        self._on_change = on_change
+        self._zone = zone
+        self._library: Optional[MusicLibrary] = None
+        self.interval = interval
+        self._snapshot_file = snapshot_file
+        self._catalogue = _Catalogue()
+        self._update_id: Optional[int] = None
+        self._event_update_id: Optional[str] = None
+        self._subscription = None
+        self._runtime = runtime
+        # set on the loop to refresh now, created there once the refresh task is running
+        self._wake: Optional[asyncio.Event] = None
+        self._ready = Event()
+        self._load()
+        self._refresh_task = None if runtime is None else runtime.submit(self._refresh_loop())
+
+    @property
+    def library(self) -> MusicLibrary:
+        if self._library is None:
+            self._library = MusicLibrary(self._zone)
+        return self._library
+
+    def stop(self):
+        # a refresh in progress is abandoned, not waited for
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._subscription is not None:
+            try:
+                self._subscription.unsubscribe()
+            except Exception as e:
+                logger.debug(f"Failed to unsubscribe from favourites events: {e}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the station list is known, from the snapshot or the first refresh. Returns whether it is.
+        """
+        return self._ready.wait(timeout)
+
+    def _load(self):
+        if self._snapshot_file is None or not self._snapshot_file.exists():
+            return
+        try:
+            with self._snapshot_file.open('r') as f:
+                snapshot = load(f.read()) or {}
+            presets = {
+                int(number): Station(entry['Title'], entry['URI'])
+                for number, entry in (snapshot.get('Stations') or {}).items()
+            }
+        except Exception as e:
+            logger.error(f"Unable to load stations from {self._snapshot_file}: {e}")
+            return
+        self._catalogue = _Catalogue.build(presets)
+        self._update_id = snapshot.get('UpdateID')
+        self._ready.set()
+        logger.info(f"Loaded {len(presets)} stations from {self._snapshot_file}")
+        if self._on_change is not None:
+            self._on_change(list(self))
+
+    def _save(self):
+        if self._snapshot_file is None:
+            return
+        snapshot = {
+            'UpdateID': self._update_id,
+            'Stations': {n: {'Title': s.title, 'URI': s.uri} for n, s in sorted(self._catalogue.presets.items())},
+        }
+        tmp = self._snapshot_file.with_name(self._snapshot_file.name + ".tmp")
+        with tmp.open('w') as f:
+            f.write(dump(snapshot, sort_keys=False, allow_unicode=True))
+        os.replace(tmp, self._snapshot_file)
+
+    def _favorites_update_id(self) -> Optional[int]:
+        """
+        Return the update ID of the favourites container, without browsing its contents.
+        """
+        try:
+            response = self.library.contentDirectory.Browse([
+                ('ObjectID', FAVORITES_ID),
+                ('BrowseFlag', 'BrowseMetadata'),
+                ('Filter', '*'),
+                ('StartingIndex', 0),
+                ('RequestedCount', 1),
+                ('SortCriteria', ''),
+            ])
+            return int(response['UpdateID'])
+        except Exception as e:
+            logger.debug(f"Unable to get favourites update ID: {e}")
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Rebuild the station list from the Sonos favourites, unless they are unchanged since the last refresh.
+        Returns whether the favourites were browsed.
+        """
+        update_id = self._favorites_update_id()
+        if not force and update_id is not None and update_id == self._update_id:
+            logger.debug(f"Favourites unchanged (update ID {update_id}), skipping refresh")
+            return False
+        old = self._catalogue
+        live = []
+        for fav in self.library.get_sonos_favorites():
             uri = fav.get_uri()
             if is_station_uri(uri):
-                new_stations.append(Station(fav.title, uri))
-        new_index = {station: i + 1 for i, station in enumerate(new_stations)}
-        new_curr_index = new_index.get(curr_station, 0)
-        self._stations = new_stations
-        self._station_index = new_index
-        self._curr_ix = new_curr_index
-        logger.info(f"Stations list initialised, there are {len(self)}")
-
-    def _refresh_loop(self):
+                live.append(Station(fav.title, uri))
+        catalogue = _Catalogue.build(old.assign_presets(live))
+        self._catalogue = catalogue
+        self._update_id = update_id
+        self._ready.set()
+        logger.info(f"Stations list refreshed, there are {len(self)}")
+        if catalogue.presets != old.presets:
+            self._save()
+        changed = {s.title for s in live} - set(old.title_index)
+        if changed and self._on_change is not None:
+            self._on_change(list(self))
+        return True
+
+    def _watch(self):
+        """
+        Subscribe to content directory events so favourites changes trigger an immediate refresh.
+        """
+        if self._zone is None:
+            return
+        try:
+            self._subscription = self._zone.contentDirectory.subscribe(auto_renew=True)
+        except Exception as e:
+            logger.warning(f"Unable to watch favourites for changes, polling every {self.interval}s: {e}")
+            return
+        self._subscription.callback = self._on_event
+
+    def _on_event(self, event):
+        update_id = event.variables.get('favorites_update_id')
+        if update_id is not None and update_id != self._event_update_id:
+            if self._event_update_id is not None and self._wake is not None:
+                logger.info("Favourites changed, refreshing")
+                self._runtime.loop.call_soon_threadsafe(self._wake.set)
+            self._event_update_id = update_id
+
+    async def _refresh_loop(self):
+        self._wake = asyncio.Event()
+        await self._runtime.call(self._watch)
+        # reconcile the snapshot with the live favourites straight away
+        self._wake.set()
         while True:
-            self.refresh()
-            time.sleep(60)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._runtime.call(self.refresh)
+            except Exception as e:
+                logger.error(f"Unable to refresh stations: {e}")
+
+    def __iter__(self):
+        return iter(self._catalogue.stations)
+
+    def __len__(self):
+        return len(self._catalogue.stations)
+
+    def __getitem__(self, number: int) -> Station:
+        """
+        Return the station with the given preset number, raising KeyError if there isn't one.
+        """
+        return self._catalogue.presets[number]
+
+    def by_uri(self, uri: str) -> Optional[Station]:
+        return self._catalogue.uri_index.get(uri)
+
+    def by_title(self, title: str) -> Optional[Station]:
+        return self._catalogue.title_index.get(title)
+
+    def number(self, station: Optional[Station]) -> int:
+        """
+        Return the preset number of the given station, or 0 if it isn't in the list.
+        """
+        if station is None:
+            return 0
+        return self._catalogue.numbers.get(station.uri, 0)
+
+    def step(self, number: int, steps: int) -> Station:
+        """
+        Return the station the given number of steps (negative for backwards) from the given preset number, in preset
+        order and wrapping around. From 0 (nothing selected), next is the first station and previous is the last.
+        """
+        catalogue = self._catalogue
+        if not catalogue.order:
+            raise KeyError("There are no stations")
+        position = catalogue.positions.get(number)
+        if position is None and steps == 0:
+            raise KeyError(number)
+        if position is None:
+            position = -1 if steps > 0 else len(catalogue.order)
+        return catalogue.stations[(position + steps) % len(catalogue.order)]
+
+    def random(self) -> Station:
+        return random.choice(self._catalogue.stations)
+
+    def cursor(self) -> 'StationCursor':
+        return StationCursor(self)
+
+
+class StationCursor:
+    """
+    A single remote's position in a shared station list. The selected station is held rather than its number, so the
+    selection survives the list being refreshed.
+    """
+
+    def __init__(self, stations: Stations):
+        self._stations = stations
+        self._current: Optional[Station] = None
+
+    @property
+    def current(self) -> int:
+        """The preset number of the selected station, or 0 if none"""
+        return self._stations.number(self._current)
 
     def __iter__(self):
         return iter(self._stations)
@@ -61,33 +340,29 @@ class Stations:
     def __len__(self):
         return len(self._stations)
 
-    def __getitem__(self, item):
-        # we 1-index the stations to correspond to button presses
-        return self._stations[item - 1]
+    def __getitem__(self, number: int) -> Station:
+        return self._stations[number]
+
+    def by_uri(self, uri: str) -> Optional[Station]:
+        return self._stations.by_uri(uri)
+
+    def random(self) -> Station:
+        return self._stations.random()
 
-    def select_station(self, ix: int) -> Station:
-        station = self[ix]
-        self._curr_ix = ix
+    def select(self, station: Station) -> Station:
+        self._current = station
         return station
 
+    def select_station(self, number: int) -> Station:
+        return self.select(self[number])
+
     def prev_next(self, is_next: bool) -> Station:
-        ix = self._next_index() if is_next else self._prev_index()
-        return self.select_station(ix)
-
-    def _next_index(self) -> int:
-        ix = self._curr_ix
-        if 0 <= ix < len(self):
-            return ix + 1
-        elif ix == len(self):
-            return 1
-        else:
-            raise ValueError(f"Index {ix} is invalid, no next station can be found.")
-
-    def _prev_index(self) -> int:
-        ix = self._curr_ix
-        if ix <= 1:
-            return len(self)
-        elif 1 < ix <= len(self):
-            return ix - 1
-        else:
-            raise ValueError(f"Index {ix} is invalid, no previous station can be found.")
\ No newline at end of file
+        return self.step(1 if is_next else -1)
+
+    def step(self, steps: int, base: Optional[int] = None) -> Station:
+        """
+        Select the station the given number of steps (negative for backwards) from the given preset number, or the
+        current station if None, wrapping around the list.
+        """
+        number = self.current if base is None else base
+        return self.select(self._stations.step(number, steps))
@@ -0,0 +1,207 @@
+import logging
+import os
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Collection, Dict, Iterator, Mapping, Optional, Tuple
+
+import soco
+from soco import SoCo
+
+from socomote.yaml_io import load, dump
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for responses to a full network discovery
+DISCOVERY_TIMEOUT = 5
+
+
+class ZoneDirectory(Mapping[str, SoCo]):
+    """
+    Mapping of player name to zone, loaded instantly from a persisted topology cache (player name -> UID / IP).
+
+    The cache is revalidated by a full discovery in the background, and a single zone which has moved or is missing
+    can be re-resolved on demand with `resolve`, which asks a known zone for the household topology rather than
+    discovering the whole network again. A full discovery is only made up front when there is no cache at all.
+    """
+
+    def __init__(self, cache_file: Path):
+        self._cache_file = cache_file
+        self._zones: Dict[str, SoCo] = {}
+        self._uids: Dict[str, str] = {}
+        # IP address -> player name, replaced as a whole whenever a zone is added or moves, so it's read without the
+        # lock on every call to a speaker
+        self._names: Dict[str, str] = {}
+        self._lock = Lock()
+        # held for the whole of the first load, so no one sees the directory until it's complete. Separate from _lock,
+        # which discover takes.
+        self._load_lock = Lock()
+        self._loaded = False
+        # full discoveries completed, so one asked for while another was running isn't repeated
+        self._discoveries = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            cached = self._load_cache()
+            with self._lock:
+                for name, (ip_address, uid) in cached.items():
+                    self._zones[name] = SoCo(ip_address)
+                    self._uids[name] = uid
+                self._index()
+            if not self._zones:
+                logger.info("No cached zones, discovering")
+                self._discover()
+            self._loaded = True
+
+    def _load_cache(self) -> Dict[str, Tuple[str, str]]:
+        """
+        Read the cache as player name -> (IP, UID). An unreadable cache is logged and ignored, so zones are discovered.
+        """
+        if not self._cache_file.exists():
+            return {}
+        try:
+            with self._cache_file.open('r') as f:
+                cached = {name: (entry['IP'], entry['UID']) for name, entry in (load(f.read()) or {}).items()}
+        except Exception as e:
+            logger.error(f"Unable to load zones from {self._cache_file}: {e}")
+            return {}
+        logger.info(f"Loaded {len(cached)} zones from {self._cache_file}")
+        return cached
+
+    def __getitem__(self, name: str) -> SoCo:
+        self._ensure_loaded()
+        zone = self._zones.get(name)
+        if zone is None:
+            zone = self.resolve(name)
+            if zone is None:
+                raise KeyError(name)
+        return zone
+
+    def __iter__(self) -> Iterator[str]:
+        self._ensure_loaded()
+        return iter(list(self._zones))
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._zones)
+
+    def uid(self, name: str) -> Optional[str]:
+        self._ensure_loaded()
+        return self._uids.get(name)
+
+    def address(self, name: str) -> Optional[str]:
+        """The zone's current IP address, without resolving it if unknown"""
+        self._ensure_loaded()
+        zone = self._zones.get(name)
+        return None if zone is None else zone.ip_address
+
+    def name_of(self, ip_address: str) -> Optional[str]:
+        """
+        The name of the zone at the given IP address, if any. Doesn't load the directory, as it's called on every call
+        to a speaker, including those made while loading, so is None for every address until it's loaded.
+        """
+        return self._names.get(ip_address)
+
+    def _index(self):
+        """
+        Rebuild the IP address index. Must be called holding the lock.
+        """
+        self._names = {zone.ip_address: name for name, zone in self._zones.items()}
+
+    def discover(self):
+        """
+        Discover all zones on the network, adding them to the directory. Zones which didn't respond are kept, as
+        a missed response doesn't mean the zone has gone. The cache is loaded first, so it can't overwrite what's
+        discovered, and if loading had to discover the zones they aren't discovered again.
+        """
+        self._rediscover(self._discoveries)
+
+    def _rediscover(self, discoveries: int):
+        """
+        Load the directory, then discover all zones unless a discovery has completed since `discoveries` had.
+        """
+        self._ensure_loaded()
+        if self._discoveries > discoveries:
+            logger.info("Zones were just discovered, not discovering them again")
+            return
+        self._discover()
+
+    def _discover(self):
+        found = soco.discover(timeout=DISCOVERY_TIMEOUT) or set()
+        discovered = {zone.player_name: zone for zone in found}
+        with self._lock:
+            changed = {
+                name for name, zone in discovered.items()
+                if name not in self._zones or self._zones[name].ip_address != zone.ip_address
+            }
+            self._zones.update(discovered)
+            self._uids.update({name: zone.uid for name, zone in discovered.items()})
+            self._index()
+            self._discoveries += 1
+        missing = set(self._zones) - set(discovered)
+        if missing:
+            logger.warning(f"Zones {sorted(missing)} didn't respond to discovery")
+        if changed:
+            logger.info(f"Discovered new or moved zones: {sorted(changed)}")
+            self._save()
+
+    def revalidate(self) -> Thread:
+        """
+        Rediscover all zones in a background thread, unless a discovery completes in the meantime, as it does when
+        there's no cache to load.
+        """
+        thread = Thread(target=self._revalidate, args=(self._discoveries,), daemon=True)
+        thread.start()
+        return thread
+
+    def _revalidate(self, discoveries: int):
+        try:
+            self._rediscover(discoveries)
+        except Exception as e:
+            logger.error(f"Zone discovery failed: {e}")
+
+    def resolve(self, name: str, skip: Collection[str] = ()) -> Optional[SoCo]:
+        """
+        Re-resolve a single zone by asking the known zones, other than those in `skip`, for the current household
+        topology, matching the zone by UID if known (so a renamed zone is still found), else by name. Only if no known
+        zone answers is it discovered by name.
+        """
+        with self._lock:
+            known = [zone for zone_name, zone in self._zones.items() if zone_name != name and zone_name not in skip]
+            uid = self._uids.get(name)
+        zone = None
+        answered = False
+        for other in known:
+            try:
+                zones = other.all_zones
+            except Exception as e:
+                logger.debug(f"Unable to get topology from {other.ip_address}: {e}")
+                continue
+            answered = True
+            zone = next((z for z in zones if (z.uid == uid if uid else z.player_name == name)), None)
+            break
+        if zone is None and not answered:
+            zone = soco.discovery.by_name(name)
+        if zone is None:
+            logger.error(f"Unable to resolve zone {name}")
+            return None
+        with self._lock:
+            previous = self._zones.get(name)
+            self._zones[name] = zone
+            self._uids[name] = zone.uid
+            self._index()
+        if previous is None or previous.ip_address != zone.ip_address:
+            logger.info(f"Resolved zone {name} to {zone.ip_address}")
+            self._save()
+        return zone
+
+    def _save(self):
+        with self._lock:
+            cached = {name: {'UID': self._uids[name], 'IP': zone.ip_address} for name, zone in self._zones.items()}
+        tmp = self._cache_file.with_name(self._cache_file.name + ".tmp")
+        with tmp.open('w') as f:
+            f.write(dump(cached))
+        os.replace(tmp, self._cache_file)
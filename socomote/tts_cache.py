@@ -0,0 +1,300 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from threading import Condition, Lock
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from socomote.clip_store import ClipStore, clip_key
+from socomote.mp3 import mp3_duration
+from socomote.tts_engines import FREETTS_LANGUAGE, FREETTS_VOICE, FreeTTS, SpeechEngine, SynthesisError, check_mp3
+
+logger = logging.getLogger(__name__)
+
+
+def engine_key(text: str, engine: str, voice: str, language: str) -> bytes:
+    """
+    Key of the clip of the given text synthesized by the named engine.
+    """
+    return clip_key(text, f"{engine}:{voice}", language)
+
+
+class TTSCache:
+    """
+    Cache of synthesized speech, stored in a ClipStore keyed by the phrase and the engine and voice it was spoken in.
+
+    Uncached phrases are synthesized on a pool of `engine.workers` threads, and can be streamed while they are being
+    synthesized. Concurrent requests for the same uncached phrase share a single synthesis. A clip is only stored once
+    it has been fully synthesized and checked, so failed synthesis is never cached.
+    """
+
+    def __init__(self, store: ClipStore, engine: SpeechEngine):
+        self.store = store
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        self.synthesized = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self._in_flight: Dict[str, _Synthesis] = {}
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(max_workers=engine.workers, thread_name_prefix="synthesis")
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.store.close()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def key(self, text: str) -> bytes:
+        return engine_key(text, self.engine.name, self.engine.voice, self.engine.language)
+
+    def contains(self, text: str) -> bool:
+        return self.key(text) in self.store
+
+    def duration(self, text: str) -> Optional[float]:
+        """
+        Return how long the clip for the given text plays for in seconds, or None if it isn't cached.
+        """
+        return self.store.duration(self.key(text))
+
+    def get(self, text: str) -> memoryview:
+        """
+        Return the MP3 for the given text, synthesizing it first if not cached.
+        """
+        clip = self._lookup(text)
+        if clip is not None:
+            return clip
+        return self.synthesize(text)
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        """
+        Yield the MP3 for the given text, as it is synthesized if not cached.
+        """
+        clip = self._lookup(text)
+        if clip is not None:
+            yield clip
+        else:
+            yield from self._start(text).chunks()
+
+    def synthesize(self, text: str) -> memoryview:
+        """
+        Synthesize the given text and store it in the cache, returning the clip. If the text is already being
+        synthesized, wait for that to finish instead.
+        """
+        return self._start(text).clip.result()
+
+    def _lookup(self, text: str) -> Optional[memoryview]:
+        clip = self.store.get(self.key(text))
+        with self._lock:
+            if clip is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if clip is None:
+            logger.info(f"Cache miss, synthesizing '{text}'")
+        return clip
+
+    def _start(self, text: str) -> '_Synthesis':
+        """
+        Return the synthesis of the given text, starting it unless already in flight. If it has finished since the
+        caller checked the cache, the returned synthesis is already complete.
+        """
+        with self._lock:
+            synthesis = self._in_flight.get(text)
+            if synthesis is not None:
+                self.deduplicated += 1
+                logger.debug(f"Joining in-flight synthesis of '{text}'")
+                return synthesis
+            synthesis = _Synthesis()
+            clip = self.store.get(self.key(text))
+            if clip is not None:
+                synthesis.append(clip)
+                synthesis.finish(clip)
+                return synthesis
+            self._in_flight[text] = synthesis
+        self._pool.submit(self._generate, text, synthesis)
+        return synthesis
+
+    def _generate(self, text: str, synthesis: '_Synthesis'):
+        start = time.monotonic()
+        chunks = []
+        # held back until there's enough to check it's an MP3, so a failure isn't streamed to a speaker
+        pending = b""
+        try:
+            for chunk in self.engine.stream(text):
+                chunks.append(chunk)
+                if pending is None:
+                    synthesis.append(chunk)
+                    continue
+                pending += chunk
+                if len(pending) >= 4:
+                    check_mp3(pending)
+                    synthesis.append(pending)
+                    pending = None
+            data = b"".join(chunks)
+            check_mp3(data)
+            clip = self.store.put(self.key(text), data, mp3_duration(data))
+        except BaseException as e:
+            logger.error(f"Failed to synthesize '{text}': {e}")
+            with self._lock:
+                self.failed += 1
+                del self._in_flight[text]
+            synthesis.finish(error=e)
+            return
+        with self._lock:
+            self.synthesized += 1
+            del self._in_flight[text]
+        synthesis.finish(clip)
+        logger.debug(f"Synthesized '{text}' in {time.monotonic() - start:.2f}s")
+
+    def import_files(self, lib: Path) -> int:
+        """
+        Import the clips from a directory of one MP3 per phrase, named after the phrase, as used by earlier versions.
+        These were all synthesized by FreeTTS with its default voice. Returns the number of clips imported.
+        """
+        imported = 0
+        for file in lib.glob("*.mp3"):
+            key = engine_key(file.name[:-len(".mp3")], FreeTTS.name, FREETTS_VOICE, FREETTS_LANGUAGE)
+            if key in self.store:
+                continue
+            try:
+                data = file.read_bytes()
+                check_mp3(data)
+                self.store.put(key, data, sync=False)
+            except (OSError, SynthesisError) as e:
+                logger.warning(f"Unable to import {file}: {e}")
+                continue
+            imported += 1
+        self.store.flush()
+        if imported:
+            logger.info(f"Imported {imported} clips from {lib}, which can now be deleted")
+        return imported
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 1.0
+
+    def __str__(self):
+        return (
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), "
+            f"{self.in_flight} in flight, {self.deduplicated} deduplicated, {self.failed} failed"
+        )
+
+
+class Presynthesizer:
+    """
+    Synthesizes missing phrases in the background on a small worker pool, so they are already cached by the time
+    they are announced.
+    """
+
+    def __init__(self, cache: TTSCache, max_workers: Optional[int] = None):
+        """
+        :param max_workers: number of phrases synthesized at once, defaults to as many as the engine allows.
+        """
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or cache.engine.workers, thread_name_prefix="presynth")
+        self._pending = set()
+        self._lock = Lock()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, texts: Iterable[str]) -> List[Future]:
+        """
+        Queue synthesis of every given phrase which isn't already cached or queued.
+        """
+        texts = list(dict.fromkeys(texts))
+        with self._lock:
+            missing = [t for t in texts if t not in self._pending and not self.cache.contains(t)]
+            self._pending.update(missing)
+        if not missing:
+            logger.debug(f"All {len(texts)} phrases already synthesized")
+            return []
+        logger.info(f"Pre-synthesizing {len(missing)} of {len(texts)} phrases")
+        batch = _Batch(total=len(missing), started=time.monotonic())
+        return [self._pool.submit(self._synthesize, text, batch) for text in missing]
+
+    def _synthesize(self, text: str, batch: '_Batch'):
+        failed = False
+        try:
+            if not self.cache.contains(text):
+                self.cache.synthesize(text)
+        except Exception as e:
+            logger.error(f"Failed to pre-synthesize '{text}': {e}")
+            failed = True
+        finally:
+            with self._lock:
+                self._pending.discard(text)
+        if batch.done(failed):
+            logger.info(
+                f"Pre-synthesis finished: {batch.total - batch.failed}/{batch.total} phrases in "
+                f"{time.monotonic() - batch.started:.1f}s. Cache: {self.cache}"
+            )
+        else:
+            logger.debug(f"Pre-synthesized {batch.completed}/{batch.total} phrases")
+
+
+class _Batch:
+
+    def __init__(self, total: int, started: float):
+        self.total = total
+        self.started = started
+        self.completed = 0
+        self.failed = 0
+        self._lock = Lock()
+
+    def done(self, failed: bool) -> bool:
+        """Record a finished phrase, returning True if it was the last in the batch"""
+        with self._lock:
+            self.completed += 1
+            self.failed += failed
+            return self.completed == self.total
+
+
+class _Synthesis:
+    """
+    A phrase being synthesized, which any number of readers can stream as it is produced.
+    """
+
+    def __init__(self):
+        self.clip: 'Future[memoryview]' = Future()
+        self._chunks: List[bytes] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._condition = Condition()
+
+    def append(self, chunk: bytes):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, clip: Optional[memoryview] = None, error: Optional[BaseException] = None):
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+        if error is None:
+            self.clip.set_result(clip)
+        else:
+            self.clip.set_exception(error)
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        Yield the audio produced so far, then the rest as it is produced. Raises the error if synthesis fails.
+        """
+        read = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._chunks) > read or self._done)
+                new = self._chunks[read:]
+                done, error = self._done, self._error
+            yield from new
+            read += len(new)
+            if done and read == len(self._chunks):
+                if error is not None:
+                    raise error
+                return
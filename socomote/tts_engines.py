@@ -0,0 +1,172 @@
+import json
+import logging
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Type
+from urllib.parse import quote
+
+from socomote.config import CONFIG
+from socomote.http_pool import INTERNET
+
+logger = logging.getLogger(__name__)
+
+# Size of the pieces synthesized audio is streamed in, in bytes
+CHUNK_SIZE = 8 * 1024
+
+# The FreeTTS voice used by default
+FREETTS_LANGUAGE = "en-GB"
+FREETTS_VOICE = "en-GB-Standard-C"
+
+# Synthesizes speech as WAV on stdout, from text on stdin
+LOCAL_SYNTHESIZER = ["espeak-ng", "--stdin", "--stdout", "-v", "{voice}"]
+# Encodes WAV on stdin as MP3 on stdout
+LOCAL_ENCODER = ["lame", "--quiet", "-", "-"]
+LOCAL_VOICE = "en-gb"
+LOCAL_LANGUAGE = "en-GB"
+# Number of phrases synthesized at once by default, per engine
+LOCAL_WORKERS = 4
+FREETTS_WORKERS = 2
+
+
+class SynthesisError(Exception):
+    pass
+
+
+def check_mp3(data: bytes):
+    """
+    Raise a SynthesisError unless the data looks like the start of an MP3 stream.
+    """
+    if len(data) < 4:
+        raise SynthesisError(f"Synthesized clip is too short ({len(data)} bytes)")
+    if not (data.startswith(b"ID3") or (data[0] == 0xFF and data[1] & 0xE0 == 0xE0)):
+        raise SynthesisError("Synthesized clip is not an MP3")
+
+
+class SpeechEngine(ABC):
+    """
+    A way of synthesizing speech. Engines stream MP3 audio as it is produced, so it can be played before the whole
+    phrase has been synthesized. Up to `workers` phrases are synthesized at once.
+    """
+    # identifies the engine in the announcement cache, along with the voice and language
+    name: str
+
+    def __init__(self, voice: str, language: str, workers: int):
+        self.voice = voice
+        self.language = language
+        self.workers = workers
+
+    @abstractmethod
+    def stream(self, text: str) -> Iterator[bytes]:
+        """
+        Synthesize the given text, yielding the MP3 as it is produced.
+        """
+        ...
+
+    def synthesize(self, text: str) -> bytes:
+        return b"".join(self.stream(text))
+
+    def __str__(self):
+        return f"{self.name} ({self.voice}, {self.language})"
+
+
+class FreeTTS(SpeechEngine):
+    """
+    Synthesizes speech with https://freetts.com, which needs an internet connection.
+    """
+    name = "freetts"
+
+    def __init__(self, voice: str = FREETTS_VOICE, language: str = FREETTS_LANGUAGE, workers: int = FREETTS_WORKERS):
+        super().__init__(voice, language, workers)
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        gen = (
+            f"https://freetts.com/Home/PlayAudio?Language={quote(self.language)}&Voice={quote(self.voice)}"
+            f"&TextMessage={quote(text)}&type=0"
+        )
+        resp = INTERNET.get(gen)
+        resp.raise_for_status()
+        data = json.loads(resp.text)
+        mp3_id = data['id']
+        download = f"https://freetts.com/audio/{mp3_id}"
+        with INTERNET.get(download, stream=True) as resp:
+            resp.raise_for_status()
+            expected = resp.headers.get('Content-Length')
+            received = 0
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                received += len(chunk)
+                yield chunk
+        if expected is not None and int(expected) != received:
+            raise SynthesisError(f"Truncated download, got {received} of {expected} bytes")
+
+
+class LocalEngine(SpeechEngine):
+    """
+    Synthesizes speech on this device, so announcements work offline. Each phrase is synthesized by a pipeline of two
+    processes: `synthesizer` (espeak-ng by default) writing WAV, which `encoder` (lame by default) encodes to MP3.
+    """
+    name = "local"
+
+    def __init__(
+        self,
+        voice: str = LOCAL_VOICE,
+        language: str = LOCAL_LANGUAGE,
+        workers: int = LOCAL_WORKERS,
+        synthesizer: Optional[List[str]] = None,
+        encoder: Optional[List[str]] = None,
+    ):
+        super().__init__(voice, language, workers)
+        self.synthesizer = [arg.format(voice=voice, language=language) for arg in synthesizer or LOCAL_SYNTHESIZER]
+        self.encoder = encoder or LOCAL_ENCODER
+        for command in (self.synthesizer, self.encoder):
+            if shutil.which(command[0]) is None:
+                raise SynthesisError(f"{command[0]} is needed for local speech synthesis, but isn't installed")
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        synthesizer = subprocess.Popen(
+            self.synthesizer, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        encoder = subprocess.Popen(
+            self.encoder, stdin=synthesizer.stdout, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        # only the encoder reads the synthesizer's output
+        synthesizer.stdout.close()
+        try:
+            synthesizer.stdin.write(text.encode())
+            synthesizer.stdin.close()
+            while True:
+                chunk = encoder.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            for process in (synthesizer, encoder):
+                if process.wait() != 0:
+                    raise SynthesisError(f"{process.args[0]} exited with {process.returncode}")
+        finally:
+            # stop the pipeline if the stream was abandoned or failed part way through
+            for process in (synthesizer, encoder):
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            encoder.stdout.close()
+
+
+# Engines which can be chosen in the config. Plugins can add their own.
+ENGINES: Dict[str, Type[SpeechEngine]] = {
+    FreeTTS.name: FreeTTS,
+    LocalEngine.name: LocalEngine,
+}
+
+
+def open_engine() -> SpeechEngine:
+    """
+    Create the speech engine chosen in the 'TTS' config, FreeTTS by default.
+    """
+    settings = dict(CONFIG.get('TTS') or {})
+    name = settings.pop('Engine', FreeTTS.name)
+    if name not in ENGINES:
+        raise ValueError(f"Unknown TTS engine {name}, expected one of {sorted(ENGINES)}")
+    kwargs = {key.lower(): value for key, value in settings.items()}
+    engine = ENGINES[name](**kwargs)
+    logger.info(f"Synthesizing speech with {engine}, {engine.workers} phrases at once")
+    return engine
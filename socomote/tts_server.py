@@ -1,76 +1,195 @@
-import json
+import itertools
 import logging
-import os
+import re
 import socket
 import threading
+import time
 from email.header import Header
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
 from urllib.parse import quote, unquote
 
-import requests
-
-from socomote.config import MP3_LIB
+from socomote.clip_store import ClipStore, MAX_BYTES
+from socomote.config import CLIP_STORE_DIR, MP3_LIB
+from socomote.live_config import LIVE_CONFIG
+from socomote.metrics import METRICS
+from socomote.tts_cache import TTSCache
+from socomote.tts_engines import SynthesisError, open_engine
 
 START_PORT = 9001
 END_PORT = 9999
 
+METRICS_PATH = "/metrics"
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
 logger = logging.getLogger('tts_server')
 
+
 class TTSRequestHandler(BaseHTTPRequestHandler):
+    # needed for chunked transfer encoding
+    protocol_version = "HTTP/1.1"
+    # whether the response to the current request has started, after which an error can't be sent instead
+    _headers_sent = False
+
+    def end_headers(self):
+        self._headers_sent = True
+        super().end_headers()
 
     def do_GET(self):
+        if self.path == METRICS_PATH:
+            self._send_metrics()
+        else:
+            self._send_clip(head_only=False)
+
+    def _send_metrics(self):
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._send_clip(head_only=True)
+
+    def _send_clip(self, head_only: bool):
+        start_time = time.monotonic()
+        self._headers_sent = False
         try:
             filename = unquote(self.path[1:])
-            file = self._get_mp3_file(filename)
-            with file.open('rb') as file:
-                encoded_basename = Header(self.path).encode()
-                stat = os.fstat(file.fileno())
-                self.send_response(200)
-                self.send_header('Content-Length', str(stat[6]))
-                self.send_header(
-                    'Content-Type',
-                    'audio/mpeg')
-                self.send_header(
-                    'Content-Disposition',
-                    'attachment; filename="%s"' % encoded_basename)
+            text = filename[:-len(".mp3")] if filename.endswith(".mp3") else filename
+            cache: TTSCache = self.server.cache
+            if not head_only and not cache.contains(text) and self._wants_whole_clip():
+                # the length isn't known until synthesis finishes, so stream it as it is produced
+                self._stream_clip(text, start_time)
+                return
+            clip = cache.get(text)
+            size = len(clip)
+            byte_range = self._parse_range(size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
                 self.end_headers()
-                self.wfile.write(file.read())
-        except socket.error as error:
+                return
+            start, end = byte_range
+            self._send_headers(size, start, end)
+            if head_only:
+                return
+            # written straight from the memory mapped clip store
+            self.wfile.write(clip[start:end + 1])
+            METRICS.tts_served(text, time.monotonic() - start_time)
+        except ConnectionError:
             logger.error('Connection is closed by peer')
-            pass
-        except IOError as error:
-            self.send_response(500)
+        except (OSError, SynthesisError) as error:
+            if self._headers_sent:
+                # too late for an error response, so the speaker sees the clip cut short
+                self.close_connection = True
+            else:
+                self.send_error(500)
             logger.error('I/O error: %s' % (str(error)))
-        return
 
-    def _get_mp3_file(self, filename):
-        file = MP3_LIB / filename
-        if not file.exists():
-            text = filename.replace('mp3', '')
-            gen = f"https://freetts.com/Home/PlayAudio?Language=en-GB&Voice=en-GB-Standard-C&TextMessage={quote(text)}&type=0"
-            resp = requests.get(gen)
-            data = json.loads(resp.text)
-            mp3_id = data['id']
-            download = f"https://freetts.com/audio/{mp3_id}"
-            resp = requests.get(download)
-            with file.open("wb") as f:
-                f.write(resp.content)
-        return file
+    def _stream_clip(self, text: str, start_time: float):
+        """
+        Send the clip with chunked transfer encoding while it is synthesized, so playback starts straight away.
+        """
+        chunks = self.server.cache.stream(text)
+        try:
+            # wait for the first audio before committing to a response, so a failure can still be reported
+            first = next(chunks)
+        except Exception as error:
+            self.send_error(502)
+            logger.error(f"Unable to synthesize '{text}': {error}")
+            return
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.end_headers()
+        try:
+            for chunk in itertools.chain([first], chunks):
+                self.wfile.write(f"{len(chunk):X}\r\n".encode())
+                self.wfile.write(chunk)
+                self.wfile.write(b"\r\n")
+        except ConnectionError:
+            raise
+        except Exception as error:
+            # too late for an error response, so end the response without completing it
+            logger.error(f"Synthesis of '{text}' failed while streaming: {error}")
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+        METRICS.tts_served(text, time.monotonic() - start_time)
+
+    def _wants_whole_clip(self) -> bool:
+        header = self.headers.get('Range')
+        match = RANGE_PATTERN.match(header.strip()) if header else None
+        return match is None or match.groups() in (('', ''), ('0', ''))
 
+    def _parse_range(self, size: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the inclusive byte range requested, the whole file if no valid range header was sent, or None if the
+        range can't be satisfied.
+        """
+        header = self.headers.get('Range')
+        match = RANGE_PATTERN.match(header.strip()) if header else None
+        if match is None:
+            return 0, size - 1
+        first, last = match.groups()
+        if first == '' and last == '':
+            return 0, size - 1
+        if first == '':
+            # suffix range, the final n bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), size - 1 if last == '' else min(int(last), size - 1)
+        if start >= size or start > end:
+            return None
+        return start, end
 
-class TTSServer(HTTPServer):
+    def _send_headers(self, size: int, start: int, end: int):
+        encoded_basename = Header(self.path).encode()
+        partial = (start, end) != (0, size - 1)
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-Length', str(end + 1 - start))
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header(
+            'Content-Type',
+            'audio/mpeg')
+        self.send_header(
+            'Content-Disposition',
+            'attachment; filename="%s"' % encoded_basename)
+        self.end_headers()
+
+
+class TTSServer(ThreadingHTTPServer):
+    """
+    Serves synthesized speech to the speakers, one thread per request so that a slow speaker or a cache miss doesn't
+    hold up any other zone.
+    """
 
     def __init__(self):
         self.ip_addr = self._detect_ip_addr()
         self.port = self._find_free_port()
+        store = ClipStore(CLIP_STORE_DIR, max_bytes=LIVE_CONFIG.snapshot.raw.get('AnnouncementCacheBytes', MAX_BYTES))
+        self.cache = TTSCache(store, open_engine())
+        if store.is_new and MP3_LIB.exists():
+            self.cache.import_files(MP3_LIB)
         super().__init__((self.ip_addr, self.port), TTSRequestHandler)
         self._thread = threading.Thread(target=self.serve_forever, daemon=True)
 
     def __enter__(self):
         super().__enter__()
         self._thread.start()
+        logger.info(f"Serving metrics at {self.metrics_uri}")
         return self
 
+    @property
+    def metrics_uri(self) -> str:
+        return f"http://{self.ip_addr}:{self.port}{METRICS_PATH}"
+
     def get_uri(self, text: str):
         return f"http://{self.ip_addr}:{self.port}/{quote(text)}.mp3"
 
@@ -0,0 +1,153 @@
+import logging
+import math
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from threading import Lock, Timer
+from typing import Dict, FrozenSet, Mapping, Optional, Tuple
+
+from soco import SoCo
+
+from socomote.zone_state import ZoneStateCache
+
+logger = logging.getLogger(__name__)
+
+# Default change per volume up / down press. Sonos uses a scale of 0 - 100.
+VOLUME_INCREMENT = 3
+# Volume modes: change just the master zone's volume, or the whole group's, keeping the members' relative volumes.
+ZONE = "zone"
+GROUP = "group"
+MODES = (ZONE, GROUP)
+# Seconds between the steps of a volume ramp
+RAMP_TICK = 0.05
+# A group's volumes are snapshotted before a change if not changed by socomote for this many seconds, in case they were
+# changed elsewhere in the meantime. Sonos keeps the members' relative volumes from the last snapshot.
+GROUP_SNAPSHOT_SECONDS = 10.0
+
+
+@dataclass(frozen=True)
+class VolumeSettings:
+    increment: int = VOLUME_INCREMENT
+    mode: str = ZONE
+    # seconds over which each press's change is spread, or 0 to change in one step
+    ramp: float = 0.0
+
+
+def resolve_volume_settings(config: dict) -> Dict[str, VolumeSettings]:
+    """
+    Resolve the volume settings of each zone from its own settings in the config, falling back to the global ones.
+    Zones not in the config get the global settings.
+    """
+
+    def settings(section: dict, default: VolumeSettings) -> VolumeSettings:
+        resolved = VolumeSettings(
+            increment=int(section.get('VolumeIncrement', default.increment)),
+            mode=section.get('VolumeMode', default.mode),
+            ramp=float(section.get('VolumeRamp', default.ramp)),
+        )
+        if resolved.mode not in MODES:
+            raise ValueError(f"VolumeMode must be one of {MODES}, got {resolved.mode}")
+        return resolved
+
+    default = settings(config, VolumeSettings())
+    resolved = defaultdict(lambda: default)
+    for name, zone in (config.get('Zones') or {}).items():
+        resolved[name] = settings(zone or {}, default)
+    return resolved
+
+
+class VolumeControl:
+    """
+    Changes the volume of a master zone, or of its whole group, with a single relative volume call per change rather
+    than reading the volume and setting it. Optionally ramps each change in steps on a timer.
+    """
+
+    def __init__(
+        self, zone: SoCo, zones: Mapping[str, SoCo], zone_state: ZoneStateCache, settings: VolumeSettings
+    ):
+        self.zone = zone
+        self.settings = settings
+        self._zones = zones
+        self._zone_state = zone_state
+        # coordinator -> group members and time.monotonic() of the last group volume change
+        self._group_changes: Dict[str, Tuple[FrozenSet[str], float]] = {}
+        self._ramp_remaining = 0
+        self._ramp_timer: Optional[Timer] = None
+        self._lock = Lock()
+
+    def change(self, steps: int):
+        """
+        Change the volume by the given number of increments, negative to decrease it.
+        """
+        change = steps * self.settings.increment
+        if not change:
+            return
+        if self.settings.ramp <= 0:
+            self._apply(change)
+            return
+        with self._lock:
+            self._ramp_remaining += change
+            if self._ramp_timer is None:
+                self._schedule_ramp()
+
+    def stop(self):
+        """
+        Abandon any ramp in progress.
+        """
+        with self._lock:
+            self._ramp_remaining = 0
+            if self._ramp_timer is not None:
+                self._ramp_timer.cancel()
+                self._ramp_timer = None
+
+    def _schedule_ramp(self):
+        self._ramp_timer = Timer(RAMP_TICK, self._ramp_step)
+        self._ramp_timer.daemon = True
+        self._ramp_timer.start()
+
+    def _ramp_step(self):
+        # read once, as a reload can replace the settings between steps
+        settings = self.settings
+        try:
+            with self._lock:
+                if settings.ramp <= 0:
+                    # ramping was turned off part way through, so the rest of the change is made at once
+                    step = self._ramp_remaining
+                else:
+                    # large enough that each press's change takes `ramp` seconds
+                    step_size = max(1, math.ceil(settings.increment * RAMP_TICK / settings.ramp))
+                    step = max(-step_size, min(step_size, self._ramp_remaining))
+                self._ramp_remaining -= step
+            if step:
+                self._apply(step)
+        except Exception as e:
+            logger.error(f"Volume ramp of {self.zone.player_name} failed, abandoning it: {e}")
+            self.stop()
+            return
+        with self._lock:
+            if self._ramp_remaining and self._ramp_timer is not None:
+                self._schedule_ramp()
+            else:
+                self._ramp_timer = None
+
+    def _apply(self, change: int):
+        name = self.zone.player_name
+        if self.settings.mode == GROUP:
+            members = self._zone_state.members(self.zone)
+            if len(members) > 1:
+                volume = self._change_group(self._zone_state.coordinator(self.zone), members, change)
+                logger.debug(f"Changed volume of {name}'s group by {change} to {volume}")
+                return
+        volume = self.zone.set_relative_volume(change)
+        self._zone_state.update(name, volume=volume)
+        logger.debug(f"Changed volume of {name} by {change} to {volume}")
+
+    def _change_group(self, coordinator_name: str, members: FrozenSet[str], change: int) -> int:
+        control = self._zones[coordinator_name].groupRenderingControl
+        last = self._group_changes.get(coordinator_name)
+        now = time.monotonic()
+        if last is None or last[0] != members or now - last[1] > GROUP_SNAPSHOT_SECONDS:
+            control.SnapshotGroupVolume([("InstanceID", 0)])
+        self._group_changes[coordinator_name] = (members, now)
+        response = control.SetRelativeGroupVolume([("InstanceID", 0), ("Adjustment", change)])
+        return int(response["NewVolume"])
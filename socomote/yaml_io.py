@@ -0,0 +1,20 @@
+from typing import Any
+
+import yaml
+
+# libyaml's loader and dumper when PyYAML was built with it: the same output, but parsing is several times faster,
+# which counts as the config, topology and station snapshot are all read before the first key press
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+YAMLError = yaml.YAMLError
+
+
+def load(text: str) -> Any:
+    return yaml.load(text, Loader=SafeLoader)
+
+
+def dump(data: Any, **kwargs) -> str:
+    return yaml.dump(data, Dumper=SafeDumper, **kwargs)
@@ -0,0 +1,172 @@
+import logging
+import time
+from dataclasses import dataclass
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from soco import SoCo
+
+from socomote.config import ZONES
+from socomote.metrics import METRICS
+from socomote.topology import ZoneDirectory
+
+logger = logging.getLogger(__name__)
+
+# Seconds allowed for each UPnP call to a speaker, (connect, read). Unlike soco's default this bounds every call,
+# so a speaker which has gone quiet holds up a command for seconds, not minutes.
+CALL_TIMEOUT = (2.0, 5.0)
+# Actions which can take longer, e.g. browsing a long list of favourites
+SLOW_ACTIONS = {'Browse': (2.0, 20.0)}
+# Consecutive failed calls to a zone after which it's treated as unavailable and calls to it fail instantly
+FAILURE_THRESHOLD = 2
+# Seconds after which a call to an unavailable zone is let through again, to see if it's back
+RETRY_SECONDS = 30.0
+# Timeout for that call, short as the zone is likely still unavailable
+RETRY_TIMEOUT = (1.0, 5.0)
+
+CLOSED = "closed"
+OPEN = "open"
+
+
+class ZoneUnavailable(Exception):
+    pass
+
+
+@dataclass
+class Circuit:
+    """
+    The health of a single zone: closed while calls are succeeding, and open once FAILURE_THRESHOLD calls in a row
+    have failed, when calls fail instantly, except for one let through every RETRY_SECONDS to see if it's back.
+    """
+    state: str = CLOSED
+    failures: int = 0
+    # time.monotonic() after which a call is next let through while open
+    retry_at: float = 0.0
+    resolving: bool = False
+
+
+class ZoneHealth:
+    """
+    Tracks failed calls to each zone, so calls to zones known to be unavailable fail instantly rather than each
+    waiting out a timeout. When a zone becomes unavailable it's re-resolved in the background by its UID, in case it
+    has moved to a new address, and listeners are told of the new zone.
+    """
+
+    def __init__(
+        self,
+        zones: ZoneDirectory,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        retry_seconds: float = RETRY_SECONDS,
+    ):
+        self.zones = zones
+        self.failure_threshold = failure_threshold
+        self.retry_seconds = retry_seconds
+        self._circuits: Dict[str, Circuit] = {}
+        self._listeners: List[Callable[[str, SoCo], None]] = []
+        self._lock = Lock()
+
+    def add_listener(self, listener: Callable[[str, SoCo], None]):
+        """
+        Register a function to be called with the zone name and new zone whenever a zone is found at a new address.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, SoCo], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def available(self, name: str) -> bool:
+        """
+        Whether calls to the zone are expected to work, i.e. it hasn't failed recently, or is due a retry.
+        """
+        with self._lock:
+            circuit = self._circuits.get(name)
+            return circuit is None or circuit.state == CLOSED or time.monotonic() >= circuit.retry_at
+
+    def unavailable(self) -> Set[str]:
+        with self._lock:
+            return {name for name, circuit in self._circuits.items() if circuit.state == OPEN}
+
+    def before_call(self, name: str) -> Optional[Tuple[float, float]]:
+        """
+        Raise ZoneUnavailable if the zone isn't available. Otherwise returns the timeout for the call if it's a
+        retry, else None.
+        """
+        with self._lock:
+            circuit = self._circuits.get(name)
+            if circuit is None or circuit.state == CLOSED:
+                return None
+            now = time.monotonic()
+            if now >= circuit.retry_at:
+                # only one call is let through per retry period, however long it takes
+                circuit.retry_at = now + self.retry_seconds
+                return RETRY_TIMEOUT
+        METRICS.incr('zone_calls_rejected_total', zone=name)
+        raise ZoneUnavailable(f"Zone {name} is unavailable")
+
+    def succeeded(self, name: str):
+        with self._lock:
+            circuit = self._circuits.get(name)
+            if circuit is None:
+                return
+            was_open = circuit.state == OPEN
+            circuit.state, circuit.failures = CLOSED, 0
+        if was_open:
+            logger.info(f"Zone {name} is available again")
+
+    def failed(self, name: str, error: BaseException):
+        with self._lock:
+            circuit = self._circuits.setdefault(name, Circuit())
+            circuit.failures += 1
+            opened = circuit.state == CLOSED and circuit.failures >= self.failure_threshold
+            if opened:
+                circuit.state, circuit.retry_at = OPEN, time.monotonic() + self.retry_seconds
+            resolve = circuit.state == OPEN and not circuit.resolving
+            if resolve:
+                circuit.resolving = True
+        if opened:
+            METRICS.incr('zone_circuit_opened_total', zone=name)
+            logger.warning(f"Zone {name} is unavailable after {circuit.failures} failed calls ({error}), re-resolving")
+        if resolve:
+            Thread(target=self._resolve, args=(name,), name=f"resolve-{name}", daemon=True).start()
+
+    def resolve_soon(self, name: str):
+        """
+        Re-resolve the zone in the background, unless already doing so.
+        """
+        with self._lock:
+            circuit = self._circuits.setdefault(name, Circuit())
+            if circuit.resolving:
+                return
+            circuit.resolving = True
+        Thread(target=self._resolve, args=(name,), name=f"resolve-{name}", daemon=True).start()
+
+    def _resolve(self, name: str):
+        previous = self.zones.address(name)
+        try:
+            zone = self.zones.resolve(name, skip=self.unavailable())
+        except Exception as e:
+            logger.error(f"Unable to re-resolve zone {name}: {e}")
+            zone = None
+        finally:
+            with self._lock:
+                self._circuits[name].resolving = False
+        moved = zone is not None and zone.ip_address != previous
+        METRICS.incr('zone_resolves_total', zone=name, moved=str(moved).lower())
+        if not moved:
+            return
+        # calls to the new address start afresh
+        with self._lock:
+            self._circuits.pop(name, None)
+        for listener in self._listeners:
+            try:
+                listener(name, zone)
+            except Exception as e:
+                logger.error(f"Failed to apply new address of {name} to {listener}: {e}")
+
+    def call_timeout(self, action: str) -> Union[float, Tuple[float, float]]:
+        return SLOW_ACTIONS.get(action, CALL_TIMEOUT)
+
+
+# Health of the zones in ZONES
+ZONE_HEALTH = ZoneHealth(ZONES)
@@ -0,0 +1,280 @@
+import logging
+import time
+from dataclasses import dataclass, field, replace
+from functools import partial
+from threading import Lock, Thread
+from typing import Dict, FrozenSet, Optional, Callable, Any, List, Set, Tuple
+
+from soco import SoCo
+
+from socomote.topology import ZoneDirectory
+
+logger = logging.getLogger(__name__)
+
+# The UPnP services subscribed to for every zone, as named on SoCo instances
+SUBSCRIBED_SERVICES = ("renderingControl", "avTransport", "zoneGroupTopology")
+# The service whose events keep each field of ZoneState up to date
+FIELD_SERVICES = {
+    "volume": "renderingControl",
+    "mute": "renderingControl",
+    "transport_state": "avTransport",
+    "uri": "avTransport",
+    "coordinator": "zoneGroupTopology",
+    "members": "zoneGroupTopology",
+}
+# Seconds a value read from a speaker is trusted for, when there's no live subscription to keep it up to date
+UNSUBSCRIBED_TTL = 2.0
+# Seconds to wait on shutdown for the initial subscriptions, which can each hang on an unresponsive zone. Any made
+# after that are cancelled as they're made.
+SUBSCRIBE_JOIN_TIMEOUT = 1.0
+
+# Transport states which mean the zone is (or is about to be) playing
+PLAYING_STATES = {"PLAYING", "TRANSITIONING"}
+
+
+@dataclass(frozen=True)
+class ZoneState:
+    """
+    Snapshot of the last known state of a single zone. Fields are None until first known.
+    """
+    volume: Optional[int] = None
+    mute: Optional[bool] = None
+    transport_state: Optional[str] = None
+    uri: Optional[str] = None
+    coordinator: Optional[str] = None
+    members: FrozenSet[str] = field(default_factory=frozenset)
+
+    @property
+    def is_playing(self) -> bool:
+        return self.transport_state in PLAYING_STATES
+
+
+class ZoneStateCache:
+    """
+    In-memory cache of zone state, kept up to date by UPnP event subscriptions.
+
+    Reads are served from memory while the zone's subscription is live. If a value has not yet been received via an
+    event it is read from the speaker and cached. For a zone without a live subscription (it failed, or its renewal
+    did) values read are only trusted for `ttl` seconds, so changes made outside socomote are picked up. Writes made
+    by socomote itself should be recorded with `update` / `set_group` so the cache is correct before the
+    corresponding event arrives.
+    """
+
+    def __init__(self, zones: ZoneDirectory, ttl: float = UNSUBSCRIBED_TTL):
+        self._zones = zones
+        self.ttl = ttl
+        self._states: Dict[str, ZoneState] = {}
+        # (zone name, field) -> time.monotonic() the field was last set
+        self._updated: Dict[Tuple[str, str], float] = {}
+        # zone name -> services with a live subscription
+        self._live: Dict[str, Set[str]] = {}
+        self._lock = Lock()
+        self._subscriptions: List[Any] = []
+        self._listeners: List[Callable[[str, ZoneState], None]] = []
+        self._subscribe_thread: Optional[Thread] = None
+        self._stopped = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        """
+        Subscribe to events for all zones in the background. Until then, state is read from the speakers as needed.
+        """
+        self._subscribe_thread = Thread(target=self._subscribe_all, daemon=True)
+        self._subscribe_thread.start()
+
+    def _subscribe_all(self):
+        for name in self._zones:
+            if self._stopped:
+                return
+            self._subscribe_zone(name)
+        logger.info(f"Subscribed to {len(self._subscriptions)} zone services")
+
+    def stop(self):
+        if self._subscribe_thread is not None:
+            self._subscribe_thread.join(SUBSCRIBE_JOIN_TIMEOUT)
+        with self._lock:
+            # subscriptions made after this are cancelled as soon as they're made
+            self._stopped = True
+            subscriptions, self._subscriptions = self._subscriptions, []
+            self._live.clear()
+        for sub in subscriptions:
+            try:
+                sub.unsubscribe()
+            except Exception as e:
+                logger.debug(f"Failed to unsubscribe from {sub.service.service_type}: {e}")
+
+    def resubscribe(self, name: str, zone: Optional[SoCo] = None):
+        """
+        Forget the zone's state and subscribe to its events again in the background, e.g. as it's moved to a new
+        address. Its old subscriptions lapse once they fail to renew.
+        """
+        with self._lock:
+            self._forget(name)
+        Thread(target=self._subscribe_zone, args=(name,), daemon=True).start()
+
+    def _subscribe_zone(self, name: str):
+        failed = [s for s in SUBSCRIBED_SERVICES if not self._subscribe(name, self._zones[name], s)]
+        if failed:
+            # the cached address may be stale, so re-resolve the zone and try once more
+            logger.warning(f"Unable to subscribe to {failed} events for zone {name}, re-resolving")
+            zone = self._zones.resolve(name)
+            if zone is not None:
+                failed = [s for s in failed if not self._subscribe(name, zone, s)]
+        if failed:
+            logger.error(f"Unable to subscribe to {failed} events for zone {name}, will read from the speaker instead")
+
+    def _subscribe(self, name: str, zone: SoCo, service_name: str) -> bool:
+        try:
+            sub = getattr(zone, service_name).subscribe(auto_renew=True)
+        except Exception as e:
+            logger.debug(f"Subscribing to {service_name} for zone {name} failed: {e}")
+            return False
+        sub.callback = partial(self._on_event, name)
+        sub.auto_renew_fail = partial(self._on_renew_fail, name, service_name)
+        # The initial event may have arrived before the callback was set
+        while not sub.events.empty():
+            self._on_event(name, sub.events.get_nowait())
+        with self._lock:
+            stopped = self._stopped
+            if not stopped:
+                self._subscriptions.append(sub)
+                self._live.setdefault(name, set()).add(service_name)
+        if stopped:
+            try:
+                sub.unsubscribe()
+            except Exception as e:
+                logger.debug(f"Failed to unsubscribe from {service_name} for zone {name}: {e}")
+        return True
+
+    def _on_event(self, name: str, event):
+        service_type = event.service.service_type
+        variables = event.variables
+        logger.debug(f"{service_type} event for zone {name}: {sorted(variables)}")
+        if service_type == "RenderingControl":
+            changes = {}
+            if "volume" in variables:
+                changes["volume"] = int(variables["volume"]["Master"])
+            if "mute" in variables:
+                changes["mute"] = variables["mute"]["Master"] == "1"
+            self.update(name, **changes)
+        elif service_type == "AVTransport":
+            changes = {}
+            if "transport_state" in variables:
+                changes["transport_state"] = variables["transport_state"]
+            if "av_transport_uri" in variables:
+                changes["uri"] = variables["av_transport_uri"]
+            self.update(name, **changes)
+        elif service_type == "ZoneGroupTopology":
+            # SoCo updates its zone group state from the event itself, so this does not hit the network
+            self._refresh_groups(self._zones[name])
+
+    def _on_renew_fail(self, name: str, service_name: str, exc: Exception):
+        logger.warning(f"Event subscription renewal failed for zone {name}, state will be re-read: {exc}")
+        with self._lock:
+            self._forget(name)
+
+    def _forget(self, name: str):
+        """
+        Drop the zone's state and mark its subscriptions as no longer live. Must be called holding the lock.
+        """
+        self._states.pop(name, None)
+        self._live.pop(name, None)
+
+    def _refresh_groups(self, zone: SoCo):
+        for group in zone.all_groups:
+            members = frozenset(m.player_name for m in group.members)
+            self.set_group(group.coordinator.player_name, members)
+
+    def add_listener(self, listener: Callable[[str, ZoneState], None]):
+        """
+        Register a function to be called with the zone name and new state whenever a zone's state changes.
+        """
+        self._listeners.append(listener)
+
+    def state(self, name: str) -> ZoneState:
+        with self._lock:
+            return self._states.get(name, ZoneState())
+
+    def is_live(self, name: str, service_name: str) -> bool:
+        """
+        Whether events from the service are keeping the zone's state up to date.
+        """
+        with self._lock:
+            return service_name in self._live.get(name, ())
+
+    def _fresh(self, name: str, attr: str) -> bool:
+        """
+        Whether the zone's cached value of the field can be used without reading it from the speaker again.
+        """
+        with self._lock:
+            if getattr(self._states.get(name, ZoneState()), attr) is None:
+                return False
+            if FIELD_SERVICES[attr] in self._live.get(name, ()):
+                return True
+            return time.monotonic() - self._updated.get((name, attr), 0.0) < self.ttl
+
+    def update(self, name: str, **changes):
+        if not changes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._states[name] = replace(self._states.get(name, ZoneState()), **changes)
+            for attr in changes:
+                self._updated[(name, attr)] = now
+        for listener in self._listeners:
+            listener(name, state)
+
+    def set_group(self, coordinator: str, members: FrozenSet[str]):
+        """
+        Record that the given zones form a group with the given coordinator.
+        """
+        members = frozenset(members) | {coordinator}
+        now = time.monotonic()
+        with self._lock:
+            for member in members:
+                self._states[member] = replace(
+                    self._states.get(member, ZoneState()), coordinator=coordinator, members=members
+                )
+                self._updated[(member, "coordinator")] = self._updated[(member, "members")] = now
+
+    def _get(self, zone: SoCo, attr: str, read: Callable[[], Any]):
+        name = zone.player_name
+        if self._fresh(name, attr):
+            return getattr(self.state(name), attr)
+        logger.debug(f"Cache miss for {attr} of zone {name}, reading from speaker")
+        value = read()
+        self.update(name, **{attr: value})
+        return value
+
+    def volume(self, zone: SoCo) -> int:
+        return self._get(zone, "volume", lambda: zone.volume)
+
+    def mute(self, zone: SoCo) -> bool:
+        return self._get(zone, "mute", lambda: zone.mute)
+
+    def transport_state(self, zone: SoCo) -> str:
+        return self._get(
+            zone, "transport_state", lambda: zone.get_current_transport_info()['current_transport_state']
+        )
+
+    def uri(self, zone: SoCo) -> str:
+        return self._get(zone, "uri", lambda: zone.get_current_media_info()['uri'])
+
+    def coordinator(self, zone: SoCo) -> str:
+        """Return the player name of the coordinator of the zone's group"""
+        name = zone.player_name
+        if not self._fresh(name, "coordinator"):
+            group = zone.group
+            self.set_group(group.coordinator.player_name, frozenset(m.player_name for m in group.members))
+        return self.state(name).coordinator
+
+    def members(self, zone: SoCo) -> FrozenSet[str]:
+        """Return the player names of all zones in the zone's group, including itself"""
+        self.coordinator(zone)
+        return self.state(zone.player_name).members
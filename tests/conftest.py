@@ -0,0 +1,19 @@
+import os
+import tempfile
+from pathlib import Path
+
+# socomote.config reads SOCOMOTE_HOME when first imported, so point it at a throwaway home with a minimal config before
+# any test imports socomote
+_home = Path(tempfile.mkdtemp(prefix="socomote-test-"))
+(_home / "config.yaml").write_text(
+    "Zones:\n"
+    "  Study:\n"
+    "    Index: 1\n"
+    "    Groups:\n"
+    "      2: [Kitchen]\n"
+    "  Kitchen:\n"
+    "    Index: 2\n"
+)
+# the example plugins import socomote.core, which would then import itself, so start with none
+(_home / "plugins.py").write_text("")
+os.environ['SOCOMOTE_HOME'] = str(_home)
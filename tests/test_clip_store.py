@@ -0,0 +1,66 @@
+from socomote.clip_store import DATA_FILE, ClipStore, clip_key
+
+
+def key(text: str) -> bytes:
+    return clip_key(text, "voice", "en")
+
+
+def clip(fill: bytes, size: int = 100) -> bytes:
+    return fill * size
+
+
+def test_clips_are_stored_and_reloaded(tmp_path):
+    store = ClipStore(tmp_path)
+    assert store.is_new
+    store.put(key("one"), clip(b"1"), duration=1.5)
+    store.put(key("two"), clip(b"2"), duration=2.5)
+    store.close()
+
+    reopened = ClipStore(tmp_path)
+    assert not reopened.is_new
+    assert len(reopened) == 2
+    assert bytes(reopened.get(key("one"))) == clip(b"1")
+    assert reopened.duration(key("two")) == 2.5
+    assert reopened.get(key("three")) is None
+
+
+def test_least_recently_used_clips_are_evicted(tmp_path):
+    store = ClipStore(tmp_path, max_bytes=250)
+    store.put(key("one"), clip(b"1"), duration=1)
+    store.put(key("two"), clip(b"2"), duration=1)
+    store.get(key("one"))
+    store.put(key("three"), clip(b"3"), duration=1)
+    assert key("one") in store
+    assert key("two") not in store
+    assert key("three") in store
+    assert store.evicted == 1
+    assert store.size == 200
+
+
+def test_a_clip_larger_than_the_budget_is_served_once(tmp_path):
+    store = ClipStore(tmp_path, max_bytes=50)
+    assert bytes(store.put(key("big"), clip(b"b"), duration=1)) == clip(b"b")
+    assert len(store) == 0
+
+
+def test_the_data_file_is_compacted_once_mostly_evicted(tmp_path):
+    store = ClipStore(tmp_path, max_bytes=200)
+    store.put(key("one"), clip(b"1"), duration=1)
+    store.put(key("two"), clip(b"2"), duration=1)
+    held = store.get(key("one"))
+    # evicts two, leaving 100 of 300 bytes unused, and then one, leaving 200 of 400 unused: not over the ratio yet
+    store.put(key("three"), clip(b"3"), duration=1)
+    store.put(key("four"), clip(b"4"), duration=1)
+    assert (tmp_path / DATA_FILE).stat().st_size == 400
+    # evicts three, leaving 300 of 500 unused
+    store.put(key("five"), clip(b"5"), duration=1)
+    assert (tmp_path / DATA_FILE).stat().st_size == 200
+    assert bytes(store.get(key("four"))) == clip(b"4")
+    assert bytes(store.get(key("five"))) == clip(b"5")
+    # a view handed out before compaction still reads the old mapping
+    assert bytes(held) == clip(b"1")
+
+    store.close()
+    reopened = ClipStore(tmp_path)
+    assert bytes(reopened.get(key("four"))) == clip(b"4")
+    assert bytes(reopened.get(key("five"))) == clip(b"5")
@@ -0,0 +1,101 @@
+import time
+
+from socomote.command_queue import CoalescingQueue, DEFAULT_DEADLINE
+from socomote.core import (
+    NextStation, NextTrack, PlayPause, PrevStation, PrevTrack, SelectGroup, SelectStation, ShuffleStation, StepStation,
+    ToggleMute, VolChange, VolDown, VolUp,
+)
+from socomote.metrics import CommandTrace
+
+
+def queued(queue: CoalescingQueue) -> list:
+    queue.close()
+    commands = []
+    while (command := queue.get()) is not None:
+        commands.append(command)
+    return commands
+
+
+def test_volume_changes_merge_into_one():
+    queue = CoalescingQueue()
+    for command in (VolUp(), VolUp(), VolDown(), VolUp()):
+        queue.put(command)
+    assert queued(queue) == [VolChange(2)]
+    assert queue.saved == 3
+
+
+def test_opposite_commands_cancel_out():
+    queue = CoalescingQueue()
+    queue.put(VolUp())
+    queue.put(VolDown())
+    queue.put(ToggleMute())
+    queue.put(ToggleMute())
+    assert queued(queue) == []
+    assert queue.saved == 4
+
+
+def test_only_the_most_recent_command_is_merged_with():
+    queue = CoalescingQueue()
+    for command in (VolUp(), ToggleMute(), VolUp()):
+        queue.put(command)
+    assert queued(queue) == [VolUp(), ToggleMute(), VolUp()]
+
+
+def test_station_skips_merge_with_the_selected_station():
+    queue = CoalescingQueue()
+    for command in (SelectStation('3'), NextStation(), NextStation(), PrevStation(), NextStation()):
+        queue.put(command)
+    assert queued(queue) == [StepStation(steps=2, base=3)]
+
+
+def test_station_skips_which_cancel_out_are_dropped():
+    queue = CoalescingQueue()
+    queue.put(NextStation())
+    queue.put(PrevStation())
+    assert queued(queue) == []
+
+
+def test_a_shuffle_is_not_stepped_from():
+    queue = CoalescingQueue()
+    queue.put(ShuffleStation())
+    queue.put(NextStation())
+    assert queued(queue) == [ShuffleStation(), NextStation()]
+
+
+def test_selecting_a_station_supersedes_waiting_station_commands():
+    queue = CoalescingQueue()
+    for command in (NextStation(), VolUp(), ShuffleStation(), SelectGroup('2'), SelectStation('5')):
+        queue.put(command)
+    assert queued(queue) == [VolUp(), SelectGroup('2'), SelectStation('5')]
+    assert queue.saved == 2
+
+
+def test_a_merged_command_is_timed_from_the_first_key_press():
+    queue = CoalescingQueue()
+    first, second = VolUp(), VolUp()
+    now = time.monotonic()
+    first.trace, second.trace = CommandTrace(received=now - 1), CommandTrace(received=now)
+    queue.put(first)
+    queue.put(second)
+    merged, = queued(queue)
+    assert merged.trace is first.trace
+
+
+def test_commands_past_their_deadline_are_dropped():
+    queue = CoalescingQueue()
+    late, on_time = NextStation(), VolUp()
+    late.trace = CommandTrace(received=time.monotonic() - DEFAULT_DEADLINE - 1)
+    on_time.trace = CommandTrace()
+    queue.put(late)
+    queue.put(on_time)
+    assert queued(queue) == [on_time]
+    assert queue.expired == 1
+
+
+def test_a_full_queue_discards_unless_forced():
+    queue = CoalescingQueue(max_queued=2)
+    assert queue.put(PlayPause())
+    assert queue.put(NextTrack())
+    assert not queue.put(PrevTrack())
+    assert queue.put(PrevTrack(), force=True)
+    assert queue.qsize() == 3
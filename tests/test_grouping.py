@@ -0,0 +1,34 @@
+from socomote.grouping import JOIN, UNJOIN, plan_regroup
+
+
+def test_no_changes_when_already_grouped():
+    plan = plan_regroup("Study", "Study", {"Study", "Kitchen"}, {"Kitchen"})
+    assert plan.is_empty
+    assert plan.phases == ()
+
+
+def test_coordinator_only_joins_and_unjoins_the_difference():
+    plan = plan_regroup("Study", "Study", {"Study", "Kitchen", "Hall"}, {"Kitchen", "Bedroom"})
+    assert plan.unjoin == {"Hall"}
+    assert plan.join == {"Bedroom"}
+    assert plan.phases == ((UNJOIN, frozenset({"Hall"})), (JOIN, frozenset({"Bedroom"})))
+
+
+def test_the_master_is_never_a_target():
+    plan = plan_regroup("Study", "Study", {"Study"}, {"Study", "Kitchen"})
+    assert plan.target == {"Kitchen"}
+    assert plan.join == {"Kitchen"}
+    assert not plan.unjoin
+
+
+def test_a_master_which_isnt_coordinator_leaves_its_group():
+    plan = plan_regroup("Study", "Kitchen", {"Study", "Kitchen", "Hall"}, {"Hall"})
+    # Kitchen isn't wanted, Hall rejoins the master from wherever it is
+    assert plan.unjoin == {"Study", "Kitchen"}
+    assert plan.join == {"Hall"}
+
+
+def test_back_to_just_the_master():
+    plan = plan_regroup("Study", "Study", {"Study", "Kitchen", "Hall"}, ())
+    assert plan.unjoin == {"Kitchen", "Hall"}
+    assert not plan.join
@@ -0,0 +1,123 @@
+import logging
+
+import pytest
+
+from socomote.keys import DEFAULT_KEY_MAP, resolve_key_map
+from socomote.live_config import ConfigError, LiveConfig, parse_config
+
+ZONES = {
+    'Study': {'Index': 1, 'Groups': {2: ['Kitchen']}},
+    'Kitchen': {'Index': 2},
+}
+
+
+def config(**settings) -> dict:
+    return {'Zones': ZONES, **settings}
+
+
+def test_default_key_map():
+    key_map = resolve_key_map({})
+    assert key_map == {name: key for name, key in DEFAULT_KEY_MAP.items() if key is not None}
+    # added after the key map was, so unbound unless set
+    assert 'SCENE' not in key_map
+
+
+def test_keys_can_be_remapped_and_bound():
+    key_map = resolve_key_map({'KeyMap': {'MUTE': 'x', 'SCENE': 'c'}})
+    assert key_map['MUTE'] == 'x'
+    assert key_map['SCENE'] == 'c'
+
+
+def test_unknown_key_map_entries_are_ignored():
+    assert resolve_key_map({'KeyMap': {'NOPE': 'x'}}) == resolve_key_map({})
+
+
+@pytest.mark.parametrize("key_map", [
+    ['p'],
+    {'MUTE': '5'},
+    {'MUTE': ''},
+    {'MUTE': 'p'},
+    {'MUTE': None},
+    {'SCENE': 'g'},
+])
+def test_invalid_key_maps(key_map):
+    with pytest.raises(ValueError):
+        resolve_key_map({'KeyMap': key_map})
+
+
+def test_a_valid_config():
+    snapshot = parse_config(config(Codes={'EXIT': 999}, KeyMap={'SCENE': 'c'}), version=3)
+    assert snapshot.version == 3
+    assert snapshot.codes == {'EXIT': '999'}
+    assert snapshot.key_map['SCENE'] == 'c'
+    assert snapshot.zone_with_index(2) == 'Kitchen'
+    assert snapshot.group('Study', 2) == ['Kitchen']
+
+
+@pytest.mark.parametrize("raw", [
+    [],
+    {},
+    {'Zones': {}},
+    config(KeyMap={'MUTE': 'p'}),
+    config(VolumeMode='loud'),
+    config(Scenes={1: {'Group': ['Garage']}}),
+])
+def test_invalid_configs(raw):
+    with pytest.raises(ConfigError):
+        parse_config(raw)
+    with pytest.raises(ConfigError):
+        parse_config(raw, strict=False)
+
+
+@pytest.mark.parametrize("raw", [
+    {'Zones': {**ZONES, 'Hall': None}},
+    {'Zones': {**ZONES, 'Hall': {'Index': '3'}}},
+    {'Zones': {**ZONES, 'Hall': {'Index': 1}}},
+    {'Zones': {**ZONES, 'Hall': {'Index': 3, 'Groups': [['Study']]}}},
+    {'Zones': {**ZONES, 'Hall': {'Index': 3, 'Groups': {2: 'Study'}}}},
+    config(Codes={'EXIT': 'quit'}),
+])
+def test_problems_only_affecting_a_zone_or_code_are_logged_at_startup(raw, caplog):
+    with pytest.raises(ConfigError):
+        parse_config(raw)
+    with caplog.at_level(logging.WARNING):
+        snapshot = parse_config(raw, strict=False)
+    assert "ignoring" in caplog.text
+    assert snapshot.zone_with_index(1) == 'Study'
+
+
+def test_reload(tmp_path, caplog):
+    path = tmp_path / "config.yaml"
+    live = LiveConfig(path, parse_config(config()))
+    reloaded = []
+    live.add_listener(reloaded.append)
+
+    path.write_text("Zones: {Study: {Index: 1}}\nKeyMap: {MUTE: x}\n")
+    assert live.reload()
+    assert live.snapshot.version == 1
+    assert live.snapshot.key_map['MUTE'] == 'x'
+    assert reloaded == [live.snapshot]
+
+    # invalid, so the current config stays
+    path.write_text("Zones: {Study: {Index: one}}\n")
+    assert not live.reload()
+    assert live.snapshot.version == 1
+    assert live.rejected == 1
+
+    path.write_text("Zones: {Study: {Index: 1}}\nTTS: {Engine: local}\n")
+    with caplog.at_level(logging.WARNING):
+        assert live.reload()
+    assert "TTS changed" in caplog.text
+
+
+def test_validators_can_reject_a_reload(tmp_path):
+    path = tmp_path / "config.yaml"
+    live = LiveConfig(path, parse_config(config()))
+
+    def validate(snapshot):
+        raise ConfigError("no")
+
+    live.add_validator(validate)
+    path.write_text("Zones: {Study: {Index: 1}}\n")
+    assert not live.reload()
+    assert live.snapshot.version == 0
@@ -0,0 +1,54 @@
+import pytest
+
+from socomote.mp3 import _frame, mp3_duration
+
+# MPEG 1 layer III, 128kbps, 44.1kHz
+MPEG1_LAYER3 = b"\xff\xfb\x90\x00" + b"\x00" * 413
+# MPEG 2 layer III, 64kbps, 22.05kHz
+MPEG2_LAYER3 = b"\xff\xf3\x80\x00" + b"\x00" * 204
+# MPEG 1 layer I, 384kbps, 44.1kHz
+MPEG1_LAYER1 = b"\xff\xff\xc0\x00" + b"\x00" * 412
+
+
+@pytest.mark.parametrize("frame, samples, sample_rate", [
+    (MPEG1_LAYER3, 1152, 44100),
+    (MPEG2_LAYER3, 576, 22050),
+    (MPEG1_LAYER1, 384, 44100),
+])
+def test_frame_headers(frame, samples, sample_rate):
+    assert _frame(frame, 0) == (len(frame), samples / sample_rate)
+
+
+def test_padded_frames_are_a_byte_longer():
+    padded = b"\xff\xfb\x92\x00"
+    assert _frame(padded, 0)[0] == len(MPEG1_LAYER3) + 1
+
+
+@pytest.mark.parametrize("header", [
+    b"\xff\xfb\xf0\x00",  # bad bitrate
+    b"\xff\xfb\x9c\x00",  # reserved sample rate
+    b"\xff\xeb\x90\x00",  # reserved version
+    b"\xff\xf9\x90\x00",  # reserved layer
+    b"\xfe\xfb\x90\x00",  # no sync
+    b"\xff\xfb",  # truncated
+])
+def test_invalid_frame_headers(header):
+    assert _frame(header, 0) is None
+
+
+def test_duration_sums_the_frames():
+    assert mp3_duration(MPEG1_LAYER3 * 10 + MPEG2_LAYER3 * 5) == pytest.approx(10 * 1152 / 44100 + 5 * 576 / 22050)
+    assert mp3_duration(MPEG1_LAYER3 * 115) == pytest.approx(3.0, abs=1152 / 44100)
+
+
+def test_tags_and_junk_are_skipped():
+    # ID3v2 tag with a 20 byte body, synchsafe size
+    id3v2 = b"ID3\x04\x00\x00\x00\x00\x00\x14" + b"\xff" * 20
+    id3v1 = b"TAG" + b"\xff\xfb\x90\x00" * 40
+    data = id3v2 + MPEG1_LAYER3 + b"junk" + MPEG1_LAYER3 + id3v1
+    assert mp3_duration(data) == pytest.approx(2 * 1152 / 44100)
+
+
+def test_no_frames():
+    assert mp3_duration(b"") == 0
+    assert mp3_duration(b"not an mp3") == 0
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+from socomote.core import PlayScene
+from socomote.scenes import PlanError, Scene, Step, parse_scenes, run_plan
+
+
+async def call_in_thread(fn):
+    return await asyncio.get_running_loop().run_in_executor(None, fn)
+
+
+def run(steps):
+    return asyncio.run(run_plan(steps, call_in_thread))
+
+
+class Recorder:
+    """
+    Steps which sleep, recording the order they start and finish in.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def step(self, name: str, seconds: float = 0.05, after=(), fail: bool = False) -> Step:
+        return Step(name, partial(self._run, name, seconds, fail), after=tuple(after))
+
+    def _run(self, name: str, seconds: float, fail: bool):
+        self.events.append(f"start {name}")
+        time.sleep(seconds)
+        self.events.append(f"end {name}")
+        if fail:
+            raise RuntimeError(f"{name} failed")
+
+
+def test_independent_steps_run_at_once():
+    recorder = Recorder()
+    start = time.monotonic()
+    finished = run([recorder.step("volume a", 0.1), recorder.step("volume b", 0.1), recorder.step("mute", 0.1)])
+    assert time.monotonic() - start < 0.25
+    assert set(finished) == {"volume a", "volume b", "mute"}
+
+
+def test_steps_wait_for_those_they_come_after():
+    recorder = Recorder()
+    # listed before the step it comes after
+    finished = run([recorder.step("station", after=["group"]), recorder.step("group", 0.1), recorder.step("volume")])
+    events = recorder.events
+    assert events.index("start station") > events.index("end group")
+    assert events.index("start volume") < events.index("end group")
+    assert finished["station"] > finished["group"]
+
+
+def test_steps_after_a_failed_step_are_skipped():
+    recorder = Recorder()
+    with pytest.raises(PlanError) as raised:
+        run([
+            recorder.step("group", fail=True),
+            recorder.step("station", after=["group"]),
+            recorder.step("announce", after=["station"]),
+            recorder.step("volume"),
+        ])
+    # only the failure itself is reported, and steps which didn't depend on it still ran
+    assert set(raised.value.failed) == {"group"}
+    assert "start station" not in recorder.events
+    assert "start announce" not in recorder.events
+    assert "end volume" in recorder.events
+
+
+def test_an_empty_plan():
+    assert run([]) == {}
+
+
+def test_parse_scenes():
+    zones = {'Study': {'Index': 1}, 'Kitchen': {'Index': 2}}
+    scenes = parse_scenes({'Zones': zones, 'Scenes': {
+        1: {'Name': 'Morning', 'Group': ['Kitchen'], 'Volumes': {'Study': 20}, 'Mute': False, 'Station': 3},
+        2: {},
+    }})
+    morning = scenes[1]
+    assert (morning.name, morning.group, morning.volumes, morning.mute, morning.station) == (
+        'Morning', frozenset({'Kitchen'}), {'Study': 20}, False, 3
+    )
+    assert scenes[2].name == '2'
+    assert scenes[2].group is None
+
+
+@pytest.mark.parametrize("scene", [
+    {'Group': 'Kitchen'},
+    {'Group': ['Garage']},
+    {'Volumes': {'Study': 101}},
+    {'Volumes': {'Garage': 10}},
+    {'Mute': 'yes'},
+    {'Station': 'Radio 1'},
+])
+def test_invalid_scenes(scene):
+    with pytest.raises(ValueError):
+        parse_scenes({'Zones': {'Study': {}, 'Kitchen': {}}, 'Scenes': {1: scene}})
+
+
+def test_play_scene_only_starts_the_station_after_regrouping():
+    receiver = SimpleNamespace(master_zone=SimpleNamespace(player_name='Study'))
+    scene = Scene(1, 'Morning', group=frozenset({'Kitchen'}), volumes={'Study': 20}, mute=True, station=3)
+    steps = {step.name: step.after for step in PlayScene('1').steps(scene, receiver)}
+    assert steps == {
+        'group': (), 'volume Study': (), 'mute Kitchen': (), 'mute Study': (), 'station': ('group',)
+    }
+
+
+def test_play_scene_without_a_group_mutes_the_current_one():
+    receiver = SimpleNamespace(master_zone=SimpleNamespace(player_name='Study'))
+    scene = Scene(1, 'Quiet', mute=True)
+    steps = [step.name for step in PlayScene('1').steps(scene, receiver, frozenset({'Study', 'Hall'}))]
+    assert steps == ['mute Hall', 'mute Study']
@@ -0,0 +1,41 @@
+from socomote.station import Station, _Catalogue
+
+RADIO_1 = Station("Radio 1", "x-sonosapi-stream:r1")
+RADIO_2 = Station("Radio 2", "x-sonosapi-stream:r2")
+RADIO_3 = Station("Radio 3", "x-sonosapi-stream:r3")
+JAZZ = Station("Jazz", "x-rincon-mp3radio:jazz")
+
+
+def test_first_stations_are_numbered_in_order():
+    assert _Catalogue().assign_presets([RADIO_1, RADIO_2]) == {1: RADIO_1, 2: RADIO_2}
+
+
+def test_stations_keep_their_numbers_when_others_are_removed():
+    catalogue = _Catalogue.build({1: RADIO_1, 2: RADIO_2, 3: RADIO_3})
+    assert catalogue.assign_presets([RADIO_3, RADIO_1]) == {1: RADIO_1, 3: RADIO_3}
+
+
+def test_new_stations_take_the_lowest_free_numbers():
+    catalogue = _Catalogue.build({1: RADIO_1, 3: RADIO_3})
+    assert catalogue.assign_presets([JAZZ, RADIO_3, RADIO_1, RADIO_2]) == {1: RADIO_1, 2: JAZZ, 3: RADIO_3, 4: RADIO_2}
+
+
+def test_a_station_whose_uri_changed_is_matched_by_title():
+    catalogue = _Catalogue.build({1: RADIO_1, 2: RADIO_2})
+    moved = Station("Radio 2", "x-sonosapi-stream:r2-hd")
+    assert catalogue.assign_presets([moved, RADIO_1]) == {1: RADIO_1, 2: moved}
+
+
+def test_two_stations_claiming_one_number_dont_share_it():
+    catalogue = _Catalogue.build({1: RADIO_1})
+    renamed = Station("Radio 1", "x-sonosapi-stream:r1-new")
+    assert catalogue.assign_presets([RADIO_1, renamed]) == {1: RADIO_1, 2: renamed}
+
+
+def test_build_indexes_the_presets():
+    catalogue = _Catalogue.build({4: JAZZ, 1: RADIO_1})
+    assert catalogue.order == (1, 4)
+    assert catalogue.stations == (RADIO_1, JAZZ)
+    assert catalogue.positions == {1: 0, 4: 1}
+    assert catalogue.numbers[JAZZ.uri] == 4
+    assert catalogue.title_index["Radio 1"] is RADIO_1
@@ -0,0 +1,66 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from socomote import topology
+from socomote.topology import ZoneDirectory
+from socomote.yaml_io import dump, load
+
+
+class Network:
+    """
+    Stands in for soco.discover, finding the given zones after a short wait.
+    """
+
+    def __init__(self, **addresses):
+        self.zones = [
+            SimpleNamespace(player_name=name, ip_address=ip_address, uid=f"RINCON_{name}")
+            for name, ip_address in addresses.items()
+        ]
+        self.discoveries = 0
+        self._lock = threading.Lock()
+
+    def discover(self, timeout=None):
+        with self._lock:
+            self.discoveries += 1
+        time.sleep(0.05)
+        return self.zones
+
+
+@pytest.fixture
+def network(monkeypatch):
+    network = Network(Study="10.0.0.2")
+    monkeypatch.setattr(topology.soco, "discover", network.discover)
+    return network
+
+
+def test_zones_are_discovered_once_without_a_cache(tmp_path, network):
+    zones = ZoneDirectory(tmp_path / "topology.yaml")
+    revalidation = zones.revalidate()
+    assert zones.address("Study") == "10.0.0.2"
+    revalidation.join(1)
+    assert network.discoveries == 1
+    assert load((tmp_path / "topology.yaml").read_text()) == {'Study': {'UID': 'RINCON_Study', 'IP': '10.0.0.2'}}
+    assert not (tmp_path / "topology.yaml.tmp").exists()
+
+
+def test_discovered_addresses_replace_cached_ones(tmp_path, network):
+    cache_file = tmp_path / "topology.yaml"
+    cache_file.write_text(dump({'Study': {'UID': 'RINCON_Study', 'IP': '10.0.0.1'}}))
+    zones = ZoneDirectory(cache_file)
+    zones.revalidate().join(1)
+    assert network.discoveries == 1
+    assert zones.address("Study") == "10.0.0.2"
+    assert zones.name_of("10.0.0.2") == "Study"
+
+
+@pytest.mark.parametrize("cached", ["[Study]\n", "Study: {IP: 10.0.0.1}\n", "Study: [\n"])
+def test_an_unreadable_cache_is_discovered_past(tmp_path, network, cached, caplog):
+    cache_file = tmp_path / "topology.yaml"
+    cache_file.write_text(cached)
+    zones = ZoneDirectory(cache_file)
+    assert list(zones) == ["Study"]
+    assert network.discoveries == 1
+    assert "Unable to load zones" in caplog.text
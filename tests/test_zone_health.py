@@ -0,0 +1,101 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from socomote.zone_health import CALL_TIMEOUT, RETRY_TIMEOUT, SLOW_ACTIONS, ZoneHealth, ZoneUnavailable
+
+
+class Directory:
+    """
+    Stands in for the ZoneDirectory, resolving every zone to `moved_to`, if given, else failing to.
+    """
+
+    def __init__(self, moved_to=None):
+        self.moved_to = moved_to
+        self.resolved = []
+        self.done = threading.Event()
+
+    def address(self, name):
+        return "10.0.0.1"
+
+    def resolve(self, name, skip=()):
+        self.resolved.append(name)
+        self.done.set()
+        return None if self.moved_to is None else SimpleNamespace(ip_address=self.moved_to)
+
+
+def fail(health: ZoneHealth, name: str, times: int):
+    for _ in range(times):
+        health.failed(name, ConnectionError("refused"))
+
+
+def test_calls_go_through_until_the_threshold():
+    health = ZoneHealth(Directory(), failure_threshold=3)
+    fail(health, "Study", 2)
+    assert health.available("Study")
+    assert health.before_call("Study") is None
+    assert health.unavailable() == set()
+
+
+def test_a_success_resets_the_failures():
+    health = ZoneHealth(Directory(), failure_threshold=2)
+    fail(health, "Study", 1)
+    health.succeeded("Study")
+    fail(health, "Study", 1)
+    assert health.available("Study")
+
+
+def test_the_circuit_opens_and_the_zone_is_re_resolved():
+    zones = Directory()
+    health = ZoneHealth(zones, failure_threshold=2, retry_seconds=60)
+    fail(health, "Study", 2)
+    assert not health.available("Study")
+    assert health.unavailable() == {"Study"}
+    with pytest.raises(ZoneUnavailable):
+        health.before_call("Study")
+    assert zones.done.wait(1)
+    assert zones.resolved == ["Study"]
+    # other zones aren't affected
+    assert health.before_call("Kitchen") is None
+
+
+def test_one_call_is_let_through_per_retry_period():
+    health = ZoneHealth(Directory(), failure_threshold=1, retry_seconds=0.05)
+    fail(health, "Study", 1)
+    with pytest.raises(ZoneUnavailable):
+        health.before_call("Study")
+    time.sleep(0.06)
+    assert health.available("Study")
+    assert health.before_call("Study") == RETRY_TIMEOUT
+    with pytest.raises(ZoneUnavailable):
+        health.before_call("Study")
+    # the retry worked
+    health.succeeded("Study")
+    assert health.before_call("Study") is None
+    assert health.unavailable() == set()
+
+
+def test_listeners_are_told_when_a_zone_has_moved():
+    zones = Directory(moved_to="10.0.0.2")
+    health = ZoneHealth(zones, failure_threshold=1, retry_seconds=60)
+    moved = threading.Event()
+    found = []
+
+    def on_moved(name, zone):
+        found.append((name, zone.ip_address))
+        moved.set()
+
+    health.add_listener(on_moved)
+    fail(health, "Study", 1)
+    assert moved.wait(1)
+    assert found == [("Study", "10.0.0.2")]
+    # calls to the new address start afresh
+    assert health.before_call("Study") is None
+
+
+def test_slow_actions_get_longer_timeouts():
+    health = ZoneHealth(Directory())
+    assert health.call_timeout("Browse") == SLOW_ACTIONS["Browse"]
+    assert health.call_timeout("SetVolume") == CALL_TIMEOUT